@@ -2,27 +2,33 @@
 This module contains the API service for predicting network attack based on network packet data supplied by user on web UI
 """
 
+import io
 import os
+import json
 import time
+import threading
 import asyncio
 import concurrent.futures
-from multiprocessing import Process
-import joblib
-import zipfile
-from fastapi import FastAPI, Request, File, UploadFile, Response
+from fastapi import FastAPI, Request, File, UploadFile
 import uvicorn
-import pandas as pd
 import numpy as np
 from pydantic import BaseModel
-import xgboost as xgb
 import pyshark
-from src.features.build_features import convert_to_float
-from src.data.packet_streamer import pcap_stream
+from src.data.packet_streamer import pcap_stream, batches_to_frame
+from src.data.packet_schema import read_packet_csv
 from src.utils.backend_log_config import backend as logger
+from src.utils.job_queue import JobQueue, DONE, FAILED
+from src.utils.result_cache import ResultCache
+from src.utils.upload_store import UploadStore, UploadError
+from src.utils import metrics
+from src.utils.zip_stream import stream_zip, copy_file, csv_matrix, npy_matrix, arrow_matrix
+from src.models.model_bundle import ModelBundle
+from src.features.build_features import label_mapping
 # Frontend
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 
 
 
@@ -36,10 +42,88 @@ app = FastAPI(title='Cloud Based IDS for IoT Networks',
 app.mount("/static", StaticFiles(directory="./static"), name="static")
 templates = Jinja2Templates(directory="./templates")
 
-# Load model
+# Load model bundle (booster, scaler and features), shared by all handlers
 MODELS_DIR = './models/'
-model = xgb.Booster()
-model.load_model(MODELS_DIR+'xgb_model.bin')
+SCALER_PATH = './src/features/scaler.pkl'
+bundle = ModelBundle.load(MODELS_DIR+'xgb_model.bin', SCALER_PATH)
+reload_lock = threading.Lock()
+
+# Background jobs (pcap parsing)
+def record_parse(parse_stats: dict):
+    """Record the packets and parse rate of a pcap parse in the metrics.
+
+    Args:
+        parse_stats (dict): "packets" and "seconds" returned by `process_pcap`
+    """
+    metrics.PARSE_PACKETS.inc(parse_stats['packets'])
+    if parse_stats['seconds'] > 0:
+        metrics.PARSE_RATE.observe(parse_stats['packets'] / parse_stats['seconds'])
+
+jobs = JobQueue(max_workers=int(os.environ.get('IDS_JOB_WORKERS', 2)),
+                on_finish=lambda status, result: result and record_parse(result))
+JOB_DEPTH = metrics.Gauge('ids_job_queue_depth', 'Processing jobs queued or running', function=jobs.depth)
+
+# Processed results by capture content, scaler and model version
+reversed_label = {value: key for key, value in label_mapping.items()}
+
+# Uploaded captures, one directory per upload
+UPLOAD_CHUNK = 1 << 20
+uploads = UploadStore(os.environ.get('IDS_UPLOAD_DIR', './temp/uploads'),
+                      max_bytes=int(os.environ.get('IDS_MAX_UPLOAD_BYTES', 8 << 30)),
+                      ttl=float(os.environ.get('IDS_UPLOAD_TTL', 24 * 3600)))
+
+results = ResultCache(max_bytes=int(os.environ.get('IDS_CACHE_BYTES', 512 << 20)),
+                      disk_dir=os.environ.get('IDS_CACHE_DIR', './temp/cache'))
+
+
+def result_key(filename: str, version: str) -> str:
+    """Cache key of the processed results of an uploaded capture.
+
+    Args:
+        filename (str): PCAP file name
+        version (str): Model bundle version
+
+    Returns:
+        str: Cache key, None if the file does not exist
+    """
+    file_path = os.path.join(os.getcwd(), "temp", filename)
+    if not os.path.isfile(file_path):
+        return None
+    return results.key(file_path, version)
+
+
+def unprocessed_csv_path(filename: str) -> str:
+    """Path of the CSV of parsed packets written by `/process` for an uploaded capture.
+
+    Args:
+        filename (str): PCAP file name
+
+    Returns:
+        str: CSV file path, next to the capture in its upload directory
+    """
+    return os.path.join(os.getcwd(), "temp", str(filename[:-5]+'unprocessed.csv'))
+
+
+# Formats of the processed features in `/retrieve` archives: extension and member writer
+MATRIX_FORMATS = {
+    'csv': ('.csv', lambda features, columns: csv_matrix(features)),
+    'npy': ('.npy', lambda features, columns: npy_matrix(features)),
+    'arrow': ('.arrow', arrow_matrix)
+    }
+
+
+def zip_response(members: list) -> StreamingResponse:
+    """Build the `/retrieve` response streaming a Zip file.
+
+    Args:
+        members (list): Zip file members, see `stream_zip`
+
+    Returns:
+        StreamingResponse: Response object with Zip file
+    """
+    response = StreamingResponse(stream_zip(members), media_type='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename="files.zip"'
+    return response
 
 # Data Validation
 class Data(BaseModel):
@@ -72,68 +156,218 @@ async def home_page(request: Request):
     """    
     return templates.TemplateResponse("home.html", {"request": request})
 
+def upload_response(upload_id: str, status_code: int=200) -> JSONResponse:
+    """Helper function to build the response of a finished upload.
+
+    Args:
+        upload_id (str): Upload ID
+        status_code (int, optional): Response status code. Defaults to 200.
+
+    Returns:
+        JSONResponse: File path on server, success message, upload ID, size and SHA-256
+    """
+    upload = uploads.finish(upload_id)
+    filename = os.path.basename(upload['path'])
+    logger.info(f"File '{filename}' uploaded and saved to: {upload['path']}")
+    return JSONResponse(status_code=status_code,
+                        content={"filename": upload['path'],
+                                 "success_message": f"{filename} Uploaded successfully!",
+                                 "upload_id": upload_id,
+                                 "size": upload['size'],
+                                 "sha256": upload['sha256']})
+
+async def write_upload(upload_id: str, offset: int, chunks) -> int:
+    """Helper function to append an async stream of chunks to an upload.
+
+    Chunks are gathered into blocks of `UPLOAD_CHUNK` bytes, each written and
+    hashed in a worker thread, so memory stays constant and the event loop is
+    not blocked. Opening the upload, which may re-hash the data already on disk,
+    and closing it also run in a worker thread. On error, the data written by
+    this request is dropped.
+
+    Args:
+        upload_id (str): Upload ID
+        offset (int): Expected number of bytes received so far
+        chunks (AsyncIterator[bytes]): Data to append
+
+    Returns:
+        int: Bytes received after the write
+    """
+    writer = await run_in_threadpool(uploads.open, upload_id, offset)
+    try:
+        block = bytearray()
+        async for chunk in chunks:
+            block += chunk
+            if len(block) >= UPLOAD_CHUNK:
+                await run_in_threadpool(writer.write, bytes(block))
+                block.clear()
+        if block:
+            await run_in_threadpool(writer.write, bytes(block))
+    except BaseException:
+        await run_in_threadpool(writer.close, discard=True)
+        raise
+    await run_in_threadpool(writer.close)
+    return writer.size
+
+async def _read_file(file: UploadFile):
+    # Async chunks of a multipart file
+    while chunk := await file.read(UPLOAD_CHUNK):
+        yield chunk
+
 # File upload endpoint
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)) -> JSONResponse:
     """Endpoint to upload file to server from client side
 
-    Read and save uploaded file on server.
+    Streams the uploaded file in chunks to its own upload directory on the
+    server, hashing it on the way. Files larger than the upload size limit
+    are rejected. For very large captures, see the resumable `/uploads` endpoints.
 
     Return JSON response with parameters:
         "filename": Path to uploaded file on server\n
-        "success_message": Status of upload operation for UI return
+        "success_message": Status of upload operation for UI return\n
+        "upload_id": Upload ID\n
+        "size": File size in bytes\n
+        "sha256": SHA-256 of the file content
 
     Args:
         file (UploadFile, optional): File from client machine. Defaults to File(...).
 
     Returns:
         JSONResponse: File path on server and success message
-    """    
-    filename = file.filename
-
+    """
+    upload_id = None
     try:
-        if filename:
-            # File was selected and submit button was clicked, save the file
-            main_directory = os.getcwd()
-            directory_path = os.path.join(main_directory, "temp")
-
-            # Clear all files in temp dir
-            # Get the list of files in the directory
-            file_list = os.listdir(directory_path)
-
-            # Iterate over the files and delete them
-            for file_name in file_list:
-                if ".gitignore" not in file_name:
-                    file_path = os.path.join(directory_path, file_name)
-                    if os.path.isfile(file_path):
-                        os.remove(file_path)
-                        logger.info(f"Deleted file: {file_path}")
-
-            # Define new file file path
-            file_path = os.path.join(directory_path, filename)
-
-            # Create the directory if it does not exist
-            if not os.path.exists(directory_path):
-                os.makedirs(directory_path)
-
-            # Write the pcap file
-            with open(file_path, "wb") as f:
-                contents = await file.read()
-                f.write(contents)
-            logger.info(f"File '{filename}' uploaded and saved to: {file_path}")
-            success_message = f"{filename} Uploaded successfully!"
+        # Creating prunes expired uploads: keep the disk work off the event loop
+        upload_id = await run_in_threadpool(uploads.create, file.filename)
+        await write_upload(upload_id, 0, _read_file(file))
+        return await run_in_threadpool(upload_response, upload_id)
     except Exception as e:
         logger.warning(f"File upload failed: {e}")
-        success_message = f"File upload failed: {e}"
+        if upload_id is not None:
+            await run_in_threadpool(uploads.remove, upload_id)
+        return JSONResponse(status_code=getattr(e, 'status_code', 500),
+                            content={"filename": None, "success_message": f"File upload failed: {e}"})
+
+# Resumable upload endpoints
+@app.post("/uploads")
+def create_upload(data: dict) -> JSONResponse:
+    """Endpoint to start a resumable upload.
+
+    The file is then sent with one or more `PUT /uploads/{upload_id}` requests
+    and finished with `POST /uploads/{upload_id}/complete`.
+
+    Return JSON response with parameters:
+        "upload_id": Upload ID\n
+        "offset": Bytes received so far (0)\n
+        "max_bytes": Upload size limit
+
+    Args:
+        data (dict): Dictionary holding filename
+
+    Returns:
+        JSONResponse: Upload ID
+    """
+    try:
+        upload_id = uploads.create(data.get('filename'))
+    except UploadError as exc:
+        return JSONResponse(status_code=exc.status_code, content={"response": str(exc)})
+    return JSONResponse(content={"upload_id": upload_id, "offset": 0, "max_bytes": uploads.max_bytes})
 
-    return JSONResponse(content={"filename": file_path, "success_message": success_message})
+@app.get("/uploads/{upload_id}")
+def upload_status(upload_id: str) -> JSONResponse:
+    """Endpoint to check a resumable upload, e.g. to resume it after a failed request.
+
+    Return JSON response with parameters:
+        "upload_id": Upload ID\n
+        "filename": Name of the uploaded file\n
+        "offset": Bytes received so far, where the next chunk starts
+
+    Args:
+        upload_id (str): Upload ID
+
+    Returns:
+        JSONResponse: Upload status
+    """
+    try:
+        path = uploads.path(upload_id)
+        return JSONResponse(content={"upload_id": upload_id,
+                                     "filename": os.path.basename(path),
+                                     "offset": os.path.getsize(path)})
+    except UploadError as exc:
+        return JSONResponse(status_code=exc.status_code, content={"response": str(exc)})
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, offset: int=0) -> JSONResponse:
+    """Endpoint to append the raw request body to a resumable upload.
+
+    The body is streamed to disk as it arrives. `offset` must be the number
+    of bytes received so far, otherwise the request is rejected with status
+    code 409 and the current offset, from which the client resumes.
+
+    Return JSON response with parameters:
+        "upload_id": Upload ID\n
+        "offset": Bytes received so far
+
+    Args:
+        upload_id (str): Upload ID
+        request (Request): Request holding the chunk
+        offset (int, optional): Position of the chunk in the file. Defaults to 0.
+
+    Returns:
+        JSONResponse: Upload offset
+    """
+    try:
+        size = await write_upload(upload_id, offset, request.stream())
+    except UploadError as exc:
+        return JSONResponse(status_code=exc.status_code,
+                            content={"response": str(exc), "upload_id": upload_id, "offset": exc.offset})
+    return JSONResponse(content={"upload_id": upload_id, "offset": size})
+
+@app.post("/uploads/{upload_id}/complete")
+def complete_upload(upload_id: str, data: dict=None) -> JSONResponse:
+    """Endpoint to finish a resumable upload.
+
+    If the client sends the SHA-256 of the file, a mismatch is rejected with
+    status code 422 and the upload is deleted, so the corrupted file cannot be
+    processed; the client starts a new upload from `/uploads`.
+
+    Return JSON response with the same parameters as `/upload`.
+
+    Args:
+        upload_id (str): Upload ID
+        data (dict, optional): Dictionary optionally holding the expected sha256. Defaults to None.
+
+    Returns:
+        JSONResponse: File path on server and success message
+    """
+    try:
+        response = upload_response(upload_id)
+    except UploadError as exc:
+        return JSONResponse(status_code=exc.status_code, content={"response": str(exc)})
+
+    expected = (data or {}).get('sha256')
+    content = json.loads(response.body)
+    if expected and expected.lower() != content['sha256']:
+        uploads.remove(upload_id)
+        logger.warning(f"Upload {upload_id} does not match the expected sha256, deleted")
+        return JSONResponse(status_code=422,
+                            content={"response": "Uploaded content does not match the sha256, "
+                                                 "upload deleted: start a new upload",
+                                     "upload_id": upload_id,
+                                     "sha256": content['sha256']})
+    return response
 
 # File processing endpoint
-def process_pcap(filename: str):
+def process_pcap(filename: str, report=None) -> dict:
     """Helper function to process PCAP file from `/process` endpoint
 
     Args:
         filename (str): PCAP file name
+        report (Callable, optional): Called with the number of packets parsed so far. Defaults to None.
+
+    Returns:
+        dict: Number of "packets" parsed and parse time in "seconds"
     """    
     print("running data parse")
     logger.info("Parsing network data from pcap file")
@@ -145,25 +379,40 @@ def process_pcap(filename: str):
         # Define new file file path
         file_path = os.path.join(directory_path, filename)
 
-        temp_df = pd.DataFrame()
-        for i in pcap_stream(file_path):
-            temp_df = pd.concat([temp_df, i], axis=0)
+        # Collect packets in record batches and build the DataFrame once
+        start_time = time.perf_counter()
+        batches = []
+        COUNT = 0
+        for batch in pcap_stream(file_path, batch_size=1000):
+            batches.append(batch)
+            COUNT += len(batch['timestamp'])
+            if report is not None:
+                report(COUNT)
+        temp_df = batches_to_frame(batches)
+        parse_time = time.perf_counter() - start_time
 
         # Define unprocessed csv file file path
-        unprocessed_csv_file_path = os.path.join(directory_path, str(filename[:-5]+'unprocessed.csv'))
+        unprocessed_csv_file_path = unprocessed_csv_path(filename)
         temp_df.to_csv(unprocessed_csv_file_path, index=False, header=True, mode='w')
         print("process complete")
         logger.info("Parsing completed")
+        return {"packets": COUNT, "seconds": parse_time}
     except Exception as e:
-        logger.warning("Parsing failed: {e}")
-        print("Process failed: {e}")
+        logger.warning(f"Parsing failed: {e}")
+        print(f"Process failed: {e}")
+        raise
 
 @app.post("/process")
 def process_file(data: dict) -> JSONResponse:
     """Endpoint to convert PCAP file to CSV
 
+    Queues the parse on the background job pool and returns immediately.
+    Progress is available from the `/jobs/{job_id}` endpoint. Uploads already
+    parsed, whose results are cached for their content, are not parsed again.
+
     Return JSON response with parameters:
-        "response": Processing status for UI feedback
+        "response": Processing status for UI feedback\n
+        "job_id": ID of the processing job (absent if cached)
 
 
     Args:
@@ -174,99 +423,271 @@ def process_file(data: dict) -> JSONResponse:
     """    
     try:
         filename = data['filename']
-        p = Process(target=process_pcap, args=(filename,))
-        p.start()
-        p.join()
-        return JSONResponse(content={"response": "Processing complete!"})
+        # Cached results are keyed by content: the CSV of this upload must still be parsed once
+        if (result_key(filename, bundle.version) in results
+                and os.path.isfile(unprocessed_csv_path(filename))):
+            logger.info(f"Processed results of {filename} found in cache")
+            return JSONResponse(content={"response": "Processing complete! (cached)"})
+
+        job_id = jobs.submit(process_pcap, filename, name=filename)
+        return JSONResponse(content={"response": "Processing started", "job_id": job_id})
     except Exception as e:
         logger.error(f"Processing failed: {e}")
         return JSONResponse(content={"response": f"Processing failed: \n{e}"})
 
+# Job status endpoint
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str) -> JSONResponse:
+    """Endpoint to check the status of a background processing job.
+
+    Return JSON response with parameters:
+        "id": Job ID\n
+        "name": File name being processed\n
+        "status": One of 'queued', 'running', 'done', 'failed'\n
+        "packets": Number of packets processed so far\n
+        "error": Error message if the job failed\n
+        "elapsed": Job run time in seconds
+
+    Args:
+        job_id (str): Job ID returned by `/process`
+
+    Returns:
+        JSONResponse: Job status
+    """
+    status = jobs.status(job_id)
+    if status is None:
+        return JSONResponse(status_code=404, content={"response": f"Unknown job: {job_id}"})
+    return JSONResponse(content=status)
+
 # Processed file retrieval endpoint
 @app.post("/retrieve")
 def download_csv(data: dict):
     """Endpoint to retrieve processed PCAP file from server.
 
     Loads CSV file generated by `/process` endpoint, applies inference
-    preprocessing steps to data, adds CSV of unprocessed and
-    processed file to Zip file and returns response with Zip file 
+    preprocessing steps to data, and streams a Zip file of the processed
+    features and the unprocessed CSV, compressed on the fly.
+
+    The processed features are sent as text CSV by default (`"format": "csv"`),
+    or in binary as `.npy` (`"format": "npy"`) or Arrow IPC stream
+    (`"format": "arrow"`, requires `pyarrow`), which are smaller and faster to read.
+
+    Responds with status code 202 while the processing job of the file is
+    still queued or running, and 404 if the file was not processed. Processed features are cached by file content and
+    model bundle version, so repeat retrievals are served from the cache.
 
     Args:
-        data (dict): Dictonary containing file name
+        data (dict): Dictonary containing file name and optionally job ID and format
 
     Returns:
-        Response: Response object with Zip file if operation is successful
+        StreamingResponse: Response object with Zip file if operation is successful
         JSONResponse: JSON object with error message if operation fails
     """    
     filename = data['filename']
-    # Get temp dir
-    main_directory = os.getcwd()
-    directory_path = os.path.join(main_directory, "temp")
-
-    # Define new file file path
-    csv_file_path = os.path.join(directory_path, str(filename[:-5]+'.csv'))
-    unprocessed_csv_file_path = os.path.join(directory_path, str(filename[:-5]+'unprocessed.csv'))
-
-
-    temp_df = pd.read_csv(unprocessed_csv_file_path)
+    fmt = data.get('format') or 'csv'
+    if fmt not in MATRIX_FORMATS:
+        return JSONResponse(status_code=400,
+                            content={"response": f"Unknown format '{fmt}', expected one of {list(MATRIX_FORMATS)}"})
+    current = bundle
+
+    # Define unprocessed csv file file path
+    unprocessed_csv_file_path = unprocessed_csv_path(filename)
+
+    key = result_key(filename, current.version)
+    cached = results.get(key) if key else None
+    if cached is not None and os.path.isfile(unprocessed_csv_file_path):
+        logger.info(f"Serving processed results of {filename} from cache")
+        data_scaled = cached['features']
+    else:
+        # Check the processing job of the file
+        job_id = data.get('job_id') or jobs.latest(filename)
+        status = jobs.status(job_id) if job_id else None
+        if status is not None and status['status'] == FAILED:
+            return JSONResponse(status_code=500,
+                                content={"response": f"Processing failed: \n{status['error']}"})
+        if status is not None and status['status'] != DONE:
+            return JSONResponse(status_code=202,
+                                content={"response": f"File not ready: processing {status['status']}",
+                                         "job_id": job_id,
+                                         "status": status['status'],
+                                         "packets": status['packets']})
+        if not os.path.isfile(unprocessed_csv_file_path):
+            return JSONResponse(status_code=404,
+                                content={"response": f"File not processed: {filename}, call /process first"})
 
-    scaler = joblib.load('./src/features/scaler.pkl')
-    optimal_features =[
-            'timestamp', 'ip_len', 'ip_id', 'ip_flags', 'ip_ttl', 'ip_proto',
-            'ip_checksum', 'ip_dst', 'ip_dst_host','tcp_srcport', 'tcp_dstport',
-            'tcp_port', 'tcp_stream', 'tcp_completeness', 'tcp_seq_raw', 'tcp_ack',
-            'tcp_ack_raw', 'tcp_flags_reset', 'tcp_flags_syn', 'tcp_window_size_value',
-            'tcp_window_size', 'tcp_window_size_scalefactor', 'tcp_', 'udp_srcport',
-            'udp_dstport', 'udp_port', 'udp_length', 'udp_time_delta', 'eth_dst_oui',
-            'eth_addr_oui', 'eth_dst_lg', 'eth_lg', 'eth_ig', 'eth_src_oui', 'eth_type',
-            'icmp_type', 'icmp_code', 'icmp_checksum', 'icmp_checksum_status', 'arp_opcode'
-            ]
-    data_optimal_features = temp_df[optimal_features]
-    data_floats = convert_to_float(data_optimal_features)
-    data_scaled = scaler.transform(data_floats)
+        try:
+            temp_df = read_packet_csv(unprocessed_csv_file_path, columns=current.features)
+            data_scaled = current.preprocess(temp_df, progress=True)
+            if key:
+                results.put(key, {
+                    'features': data_scaled,
+                    'predictions': current.predict(data_scaled)
+                    })
+        except Exception as e:
+            logger.error(f"Retrieval of {filename} failed: {e}")
+            return JSONResponse(status_code=500, content={"response": f"Error: {e}"})
 
-    # Save processed NDArray to csv file file path
-    np.savetxt(csv_file_path, data_scaled, delimiter=',')
+    # Zip file members: processed features, then unprocessed CSV
+    name = os.path.basename(filename)[:-5]
+    extension, matrix_writer = MATRIX_FORMATS[fmt]
+    date_time = time.localtime(os.path.getmtime(unprocessed_csv_file_path))[:6]
+    try:
+        members = [(name+extension, date_time, matrix_writer(data_scaled, current.features)),
+                   (name+'unprocessed.csv', date_time, copy_file(unprocessed_csv_file_path))]
+    except ImportError as e:
+        return JSONResponse(status_code=400, content={"response": f"Format '{fmt}' not available: {e}"})
 
+    return zip_response(members)
 
-    file_paths = [csv_file_path, unprocessed_csv_file_path]
+def analyze_pcap(filename: str, current: ModelBundle) -> tuple:
+    """Helper function to preprocess and classify an uploaded PCAP file
+    for the `/analyze` endpoint.
 
-    if file_paths:
-        try:
-            # Create a zip archive containing the files
-            zip_file_path = os.path.join(directory_path, str('files.zip'))
-            with zipfile.ZipFile(zip_file_path, 'w') as zip_file:
-                for file_path in file_paths:
-                    zip_file.write(file_path)
+    Reads the CSV of the file parsed by a processing job, and reuses the cached
+    predictions of a file already analyzed with the same model bundle.
 
-            # Set the appropriate HTTP response headers
-            
-            with open(zip_file_path, 'rb') as zip_file:
-                content = zip_file.read()
+    Args:
+        filename (str): PCAP file name
+        current (ModelBundle): Model bundle to classify with
 
-            response = Response(content=content, media_type='application/zip')
-            response.headers['Content-Disposition'] = 'attachment; filename="files.zip"'
+    Returns:
+        tuple: Unprocessed packets (DataFrame), predicted class of each packet,
+        timings in seconds (dict) and whether predictions came from the cache
+    """
+    unprocessed_csv_file_path = unprocessed_csv_path(filename)
+    timing = {"parse": 0.0, "predict": 0.0}
+
+    start_time = time.perf_counter()
+    # All columns, for the flagged packets, typed by the packet schema
+    temp_df = read_packet_csv(unprocessed_csv_file_path)
+    timing["parse"] = time.perf_counter() - start_time
+
+    key = result_key(filename, current.version)
+    key = key and key+'-analysis'
+    cached = results.get(key) if key else None
+    if cached is not None and len(cached['predictions']) == len(temp_df):
+        return temp_df, cached['predictions'], timing, True
+
+    start_time = time.perf_counter()
+    predictions = current.predict_packets(temp_df).astype(np.int16)
+    timing["predict"] = time.perf_counter() - start_time
+    if key:
+        results.put(key, {'predictions': predictions})
+
+    return temp_df, predictions, timing, False
+
+# End-to-end analysis endpoint
+@app.post("/analyze")
+def analyze(data: dict):
+    """Endpoint to analyze an uploaded PCAP file entirely on the server.
+
+    Extracts the model features of a parsed file, classifies every packet, and
+    returns a summary with only the packets flagged as attacks, instead of the
+    full processed data.
 
-            return response
+    Return JSON response with parameters:
+        "filename": PCAP file name\n
+        "packets": Number of packets analyzed\n
+        "flagged": Number of packets flagged as attacks\n
+        "counts": Number of packets of each class\n
+        "time": Parse, prediction and total time in seconds\n
+        "cached": Whether the predictions came from the cache\n
+        "version": Model bundle version\n
+        "flagged_packets": Fields of each flagged packet, with its "attack_type"
+
+    With `"format": "ndjson"` the response is streamed as newline delimited
+    JSON instead: the summary on the first line, then one flagged packet per line.
+
+    Responds with status code 202 while a processing job of the file is still
+    queued or running. A file not parsed yet is queued on the background job
+    pool, as with `/process`, and the response (also 202) holds the job ID to
+    retry with; the parse never runs on the request thread.
 
-        except Exception as e:
-            return JSONResponse(content={"response": f"Error: {e}"})
+    Args:
+        data (dict): Dictionary holding filename, and optionally job ID and format
 
-    return JSONResponse(content={"response": "Error: File path not provided."})
+    Returns:
+        JSONResponse: Analysis summary and flagged packets
+        StreamingResponse: NDJSON summary and flagged packets
+    """
+    filename = data.get('filename')
+    if not filename:
+        return JSONResponse(status_code=400, content={"response": "Error: File name not provided."})
+    current = bundle
+
+    # Wait for a processing job of the file, if any
+    job_id = data.get('job_id') or jobs.latest(filename)
+    status = jobs.status(job_id) if job_id else None
+    if status is not None and status['status'] not in (DONE, FAILED):
+        return JSONResponse(status_code=202,
+                            content={"response": f"File not ready: processing {status['status']}",
+                                     "job_id": job_id,
+                                     "status": status['status'],
+                                     "packets": status['packets']})
+
+    if not os.path.isfile(os.path.join(os.getcwd(), "temp", filename)):
+        return JSONResponse(status_code=404, content={"response": f"File not found: {filename}"})
+
+    if not os.path.isfile(unprocessed_csv_path(filename)):
+        if status is not None and status['status'] == FAILED:
+            return JSONResponse(status_code=500,
+                                content={"response": f"Processing failed: \n{status['error']}"})
+        # Parse in the background, the client retries with the job ID
+        job_id = jobs.submit(process_pcap, filename, name=filename)
+        return JSONResponse(status_code=202,
+                            content={"response": "File not ready: processing started",
+                                     "job_id": job_id,
+                                     "status": "queued",
+                                     "packets": 0})
+
+    start_time = time.perf_counter()
+    try:
+        temp_df, predictions, timing, cached = analyze_pcap(filename, current)
+    except Exception as exc:
+        logger.exception(f"Analysis of {filename} failed:\n{exc}")
+        return JSONResponse(status_code=500, content={"response": f"Analysis failed: {exc}"})
+    timing["total"] = time.perf_counter() - start_time
+
+    counts = np.bincount(predictions, minlength=len(label_mapping))
+    flagged = np.flatnonzero(predictions != label_mapping['normal'])
+    flagged_df = temp_df.iloc[flagged].reset_index(drop=True)
+    flagged_df.insert(0, 'attack_type', [reversed_label[int(label)] for label in predictions[flagged]])
+
+    summary = {"filename": filename,
+               "packets": len(predictions),
+               "flagged": len(flagged),
+               "counts": {reversed_label[label]: int(count) for label, count in enumerate(counts)},
+               "time": timing,
+               "cached": cached,
+               "version": current.version}
+    logger.info(f"Analysis of {filename}: {len(flagged)} of {len(predictions)} packets flagged")
+
+    if data.get('format') == 'ndjson':
+        def _lines(chunk_size: int=10_000):
+            yield json.dumps(summary) + '\n'
+            for start in range(0, len(flagged_df), chunk_size):
+                yield flagged_df.iloc[start:start+chunk_size].to_json(orient='records', lines=True)
+
+        return StreamingResponse(_lines(), media_type='application/x-ndjson')
+
+    summary["flagged_packets"] = json.loads(flagged_df.to_json(orient='records'))
+    return JSONResponse(content=summary)
 
 # Prediction endpoint
 @app.post("/predict")
-def predict(packet: dict) -> JSONResponse:
+def predict(packet: dict, top_k: int=0) -> JSONResponse:
     """Endpoint to make inference on network packets with trained model.
 
     Reconstructs `ndarray` of network packet from `dict`, makes inference and
     return JSON response with parameters:
         "result": Predicted class of network packet\n
-        "time": Model inference time
+        "time": Model inference time\n
+        "top": [class, probability] pairs of the `top_k` most probable classes, if requested
 
 
     Args:
         packet (dict): Dictionary with network packet data
+        top_k (int, optional): Number of most probable classes to return. Defaults to 0.
 
     Returns:
         JSONResponse: JSON with prediction result and inference time
@@ -275,9 +696,9 @@ def predict(packet: dict) -> JSONResponse:
     logger.info("preprocessing web UI data")
 
     try:
+        current = bundle
         packet = packet["data"]
-        packet = np.array(list(packet.values())).reshape(1, 40)
-        packet = xgb.DMatrix(packet)
+        packet = np.array(list(packet.values())).reshape(1, current.num_features)
 
     except Exception as exc:
         logger.exception(f"Error preprocessing data:\n{exc}")
@@ -285,16 +706,178 @@ def predict(packet: dict) -> JSONResponse:
     logger.info("generating prediction")
     try:
         start_time = time.perf_counter()
-        result = model.predict(packet)
-        result = result.item()
+        if top_k > 0:
+            classified = current.classify(packet, k=top_k)
+            result = float(classified['classes'][0])
+            top = [[int(label), float(probability)] for label, probability
+                   in zip(classified['top_classes'][0], classified['top_probabilities'][0])]
+        else:
+            result = current.predict(packet).item()
         elapsed_time = time.perf_counter()-start_time
-        outcome = JSONResponse(content={"result": result, "time": elapsed_time})
+        content = {"result": result, "time": elapsed_time}
+        if top_k > 0:
+            content["top"] = top
+        outcome = JSONResponse(content=content)
 
         logger.info(f"sending result '{result}'  to frontend")
     except Exception as exc:
         logger.exception(f"Error generating prediction:\n{exc}")
     return outcome
 
+def parse_batch(body: bytes, content_type: str, dtype: str='float32',
+                n_features: int=None) -> np.ndarray:
+    """Helper function to decode the request body of `/predict/batch` into a
+    2D `ndarray` of network packets.
+
+    Supported payloads:
+        `application/json`: {"data": [[...], [...], ...]} list-of-lists\n
+        `application/octet-stream`: raw little-endian C-ordered array of `dtype`,
+        or a `.npy` file (detected from its magic string)
+
+    Args:
+        body (bytes): Raw request body
+        content_type (str): Request content type header
+        dtype (str, optional): Element type of raw binary bodies. Defaults to 'float32'.
+        n_features (int, optional): Features per packet. Defaults to the model's number of features.
+
+    Returns:
+        np.ndarray: Packets array of shape (N, number of model features)
+    """
+    if n_features is None:
+        n_features = bundle.num_features
+
+    if 'json' in content_type:
+        packets = np.asarray(json.loads(body)["data"], dtype=np.float32)
+    elif body[:6] == b'\x93NUMPY':
+        packets = np.load(io.BytesIO(body), allow_pickle=False)
+    else:
+        packets = np.frombuffer(body, dtype=np.dtype(dtype).newbyteorder('<'))
+
+    return packets.reshape(-1, n_features)
+
+# Batch prediction endpoint
+@app.post("/predict/batch")
+async def predict_batch(request: Request,
+                        dtype: str='float32',
+                        top_k: int=0,
+                        threshold: float=None) -> JSONResponse:
+    """Endpoint to make inference on a batch of network packets with a single
+    call to the trained model.
+
+    Accepts N packets as a dense array, either as JSON list-of-lists or as a
+    binary body (see `parse_batch`), and return JSON response with parameters:
+        "result": Predicted class of each network packet\n
+        "count": Number of packets in the batch\n
+        "time": Model inference time for the whole batch\n
+        "top_classes": `top_k` most probable classes of each packet, if requested\n
+        "probabilities": Probabilities of `top_classes`, if requested\n
+        "confidence": Probability of the predicted class, if `threshold` is set\n
+        "uncertain": Indices of the packets with confidence below `threshold`, to be
+        sent to a secondary check, if `threshold` is set
+
+    Args:
+        request (Request): Request holding the packets batch
+        dtype (str, optional): Element type of raw binary bodies. Defaults to 'float32'.
+        top_k (int, optional): Number of most probable classes to return. Defaults to 0.
+        threshold (float, optional): Confidence below which packets are reported as uncertain. Defaults to None.
+
+    Returns:
+        JSONResponse: JSON with prediction results and inference time
+    """
+    logger.info("batch prediction request received")
+
+    current = bundle
+    try:
+        body = await request.body()
+        packets = parse_batch(body, request.headers.get('content-type', ''), dtype,
+                              n_features=current.num_features)
+    except Exception as exc:
+        logger.exception(f"Error preprocessing batch:\n{exc}")
+        return JSONResponse(status_code=400,
+                            content={"response": f"Invalid packet batch: {exc}"})
+
+    def _predict():
+        start_time = time.perf_counter()
+        if top_k > 0 or threshold is not None:
+            classified = current.classify(packets, k=max(top_k, 1), threshold=threshold)
+            result = classified['classes']
+        else:
+            classified = None
+            result = current.predict(packets)
+        elapsed_time = time.perf_counter()-start_time
+        return result, classified, elapsed_time
+
+    try:
+        # Run inference off the event loop
+        result, classified, elapsed_time = await run_in_threadpool(_predict)
+        logger.info(f"sending {len(result)} results to frontend")
+        content = {"result": result.astype(int).tolist(),
+                   "count": len(result),
+                   "time": elapsed_time}
+        if top_k > 0:
+            content["top_classes"] = classified['top_classes'].tolist()
+            content["probabilities"] = classified['top_probabilities'].tolist()
+        if threshold is not None:
+            content["confidence"] = classified['confidence'].tolist()
+            content["uncertain"] = classified['uncertain'].tolist()
+        return JSONResponse(content=content)
+    except Exception as exc:
+        logger.exception(f"Error generating batch prediction:\n{exc}")
+        return JSONResponse(status_code=500,
+                            content={"response": f"Prediction failed: {exc}"})
+
+# Model reload endpoint
+@app.post("/reload")
+def reload_model() -> JSONResponse:
+    """Endpoint to reload the model bundle after the model or scaler files were updated.
+
+    The new bundle is loaded and checked while requests keep being served with the
+    current one, then swapped in at once. If loading fails, the current bundle is kept.
+
+    Return JSON response with parameters:
+        "response": Reload status\n
+        "version": Version of the bundle being served\n
+        "previous": Version of the bundle served before the reload
+
+    Returns:
+        JSONResponse: Reload status and bundle versions
+    """
+    global bundle
+    with reload_lock:
+        previous = bundle.version
+        try:
+            new_bundle = ModelBundle.load(MODELS_DIR+'xgb_model.bin', SCALER_PATH)
+        except Exception as exc:
+            logger.exception(f"Model reload failed:\n{exc}")
+            return JSONResponse(status_code=500,
+                                content={"response": f"Model reload failed: {exc}",
+                                         "version": previous})
+        bundle = new_bundle
+
+    logger.info(f"Model bundle reloaded: {previous} -> {new_bundle.version}")
+    return JSONResponse(content={"response": "Model reloaded",
+                                 "version": new_bundle.version,
+                                 "previous": previous})
+
+# Metrics endpoint
+@app.get("/metrics")
+def metrics_page() -> PlainTextResponse:
+    """Endpoint exposing the API metrics in the Prometheus text format.
+
+    Histograms of parse rate (packets/s), float conversion, scaling and
+    prediction durations (by batch size), counters of packets parsed and
+    classified and bytes uploaded, and the processing job queue depth.
+
+    Returns:
+        PlainTextResponse: Metrics text
+    """
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+# Stop background workers with the server
+@app.on_event("shutdown")
+def shutdown_jobs():
+    jobs.shutdown()
+
 
 if __name__ == '__main__':
     logger.info("API service running")
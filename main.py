@@ -2,10 +2,11 @@
 to model training and evaluation
 """
 
-import pandas as pd
-from src.data.load_n_filter import scan_directory, load_and_filter_files
-from src.features.build_features import preprocess
-from src.models.train_model import train_model, evaluate_model
+import os
+from src.data.load_n_filter import scan_directory, load_and_filter_files, labelled_partitions
+from src.features.build_features import preprocess_out_of_core
+from src.features.processed_data import merge_shards
+from src.models.train_model import train_model_sharded, evaluate_model, peak_memory_mb, reset_peak_memory
 from src.utils.pipeline_log_config import pipeline as logger
 
 logger.info("Initializing full pipeline")
@@ -32,8 +33,8 @@ try:
     load_and_filter_files(directory_path=directory_path,
                         pcap_files_list=pcap_files_list,
                         destination_path=destination_path,
-                        merge=True,
-                        pick_up=True
+                        pick_up=True,
+                        n_workers=os.cpu_count()
                         )
     logger.info("Loading, filtering and labeling complete")
 except Exception as e:
@@ -42,11 +43,15 @@ except Exception as e:
 ## ----------- Preprocess and Split Data ------------ ##
 logger.info('Preprocessing and splitting data')
 try:
-    labelled_data = pd.read_csv('./data/labelled/all_data_labelled.csv')
+    # Stream the labelled partitions in chunks instead of loading the merged file
+    labelled_paths = labelled_partitions(destination_path, pcap_files_list)
 
-    X_train_scaled, X_test_scaled, y_train, y_test = preprocess(data=labelled_data,
-                                                                train=True,
-                                                                save=True)
+    manifest = preprocess_out_of_core(paths=labelled_paths,
+                                      path='./data/processed/')
+
+    # Training reads the shards, evaluation the single test arrays
+    for name in ('X_test_scaled', 'y_test'):
+        merge_shards('./data/processed/', name)
     logger.info('Preprocessing and splitting complete')
 except Exception as e:
     logger.warning(f'Error preprocessing and splitting data:\n{e}')
@@ -56,11 +61,14 @@ logger.info('Training model')
 try:
     # Define path to save model
     MODELS_DIR = './models/'
-    # Training data paths
-    X_TRAIN_PATH = './data/processed/X_train_scaled.csv'
-    Y_TRAIN_PATH = './data/processed/y_train.csv'
+    # Training data shards
+    PROCESSED_DIR = './data/processed/'
 
-    train_time = train_model(MODELS_DIR, X_TRAIN_PATH, Y_TRAIN_PATH)
+    # Train from an external memory cache of the shards, measuring the peak
+    # memory of training only, not of the preprocessing run before it
+    measured = reset_peak_memory()
+    train_time = train_model_sharded(MODELS_DIR, PROCESSED_DIR, matrix='external')
+    peak_memory = peak_memory_mb() if measured else None
     logger.info('Model training complete')
 except Exception as e:
     logger.warning(f"Error training model:\n{e}")
@@ -72,13 +80,14 @@ try:
     # Define path to load model
     MODELS_DIR = './models/'
     # Test data paths
-    X_TEST_PATH = './data/processed/X_test_scaled.csv'
-    Y_TEST_PATH = './data/processed/y_test.csv'
+    X_TEST_PATH = './data/processed/X_test_scaled.npy'
+    Y_TEST_PATH = './data/processed/y_test.npy'
 
     eval_metrics = evaluate_model(MODELS_DIR,
                                 X_TEST_PATH,
                                 Y_TEST_PATH,
-                                train_time
+                                train_time,
+                                peak_memory
                                 )
     logger.info('Model evaluation complete')
 except Exception as e:
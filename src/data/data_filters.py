@@ -1,6 +1,9 @@
 """
 To filter datasets and apply labels based on
 defined parameters in dataset description
+
+The pipeline labels files with the equivalent rule table in `label_rules`;
+these functions are kept as the reference implementation.
 """
 import ipaddress
 from pandas import DataFrame
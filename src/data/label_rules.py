@@ -0,0 +1,391 @@
+"""
+Declarative labelling rules for the converted pcap files.
+
+`LABEL_RULES` maps pcap file name patterns to an ordered list of
+(condition, label, row limit) rules, following the dataset description.
+Conditions are plain nested dicts:
+
+    {'eq': [column, value]}         column == value
+    {'in': [column, [values]]}      column is one of values
+    {'cidr': [column, 'x.x.x.x/n']} IPv4 address string within network
+    {'truthy': column}              value is set and truthy
+    {'any_falsy': column}           any value of the whole file is falsy (scalar)
+    {'all': [conditions]}           logical and
+    {'any': [conditions]}           logical or
+    {'not': condition}              logical not
+
+Rules are compiled once into functions evaluating vectorized masks over a
+`DataFrame`. Every packet is labelled 'normal' first, then each rule labels the
+packets it matches within its first `row limit` rows, later rules overriding
+earlier ones (same semantics as the `data_filters` functions).
+"""
+
+import ipaddress
+from fnmatch import fnmatchcase
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+
+# ____ Shared conditions ____________________________
+def _host_discovery(eth_src: str) -> dict:
+    return {'all': [
+        {'eq': ['eth_src', eth_src]},
+        {'truthy': 'arp_hw_type'},
+        {'eq': ['eth_dst', 'ff:ff:ff:ff:ff:ff']}
+        ]}
+
+
+def _port_scanning(ip_src: str, ip_dst: str) -> dict:
+    return {'all': [
+        {'eq': ['ip_src', ip_src]},
+        {'eq': ['ip_dst', ip_dst]},
+        {'any': [
+            {'all': [{'eq': ['tcp_flags_syn', 1]}, {'eq': ['tcp_window_size', 1024]}]},
+            {'eq': ['tcp_flags_reset', 1]}
+            ]}
+        ]}
+
+
+def _os_scanning(ip_src: str, ip_dst: str) -> dict:
+    return {'all': [
+        {'eq': ['ip_src', ip_src]},
+        {'eq': ['ip_dst', ip_dst]},
+        {'any_falsy': 'icmp_type'},
+        {'not': _port_scanning(ip_src, ip_dst)}
+        ]}
+
+
+def _dos_synflooding(ip_src_range: str, ip_dst: str, tcp_dstport: int) -> dict:
+    return {'all': [
+        {'cidr': ['ip_src', ip_src_range]},
+        {'eq': ['tcp_flags_syn', 1]},
+        {'eq': ['ip_dst', ip_dst]},
+        {'eq': ['tcp_dstport', tcp_dstport]},
+        {'truthy': 'tcp_'}
+        ]}
+
+
+def _mirai_hostbruteforce(host: str) -> list:
+    return [
+        ({'all': [
+            {'cidr': ['arp_dst_proto_ipv4', '192.168.0.0/24']},
+            {'eq': ['arp_src_proto_ipv4', host]},
+            {'eq': ['eth_dst', 'ff:ff:ff:ff:ff:ff']}
+            ]}, 'host_discovery', None),
+        ({'all': [
+            {'eq': ['tcp_dstport', 23]},
+            {'eq': ['ip_src', host]}
+            ]}, 'telnet_bruteforce', None)
+        ]
+
+
+def _scan_hostport(ip_dst: str, host_rows: int) -> list:
+    return [
+        (_host_discovery('f0:18:98:5e:ff:9f'), 'scanning_host', host_rows),
+        (_port_scanning('192.168.0.15', ip_dst), 'scanning_port', None)
+        ]
+
+
+def _scan_portos(ip_dst: str) -> list:
+    return [
+        (_port_scanning('192.168.0.15', ip_dst), 'scanning_port', None),
+        (_os_scanning('192.168.0.15', ip_dst), 'scanning_os', None)
+        ]
+
+
+# ____ Rule table ____________________________
+# File name pattern (fnmatch, first match wins) -> [(condition, label, row limit)]
+LABEL_RULES: dict = {
+    '*benign-dec.pcap*': [],
+    '*mitm-arpspoofing-[1-3]-dec.pcap*': [
+        ({'any': [
+            {'all': [
+                {'eq': ['eth_addr', 'f0:18:98:5e:ff:9f']},
+                {'any': [
+                    {'all': [{'eq': ['ip_src', '192.168.0.16']}, {'eq': ['ip_dst', '192.168.0.13']}]},
+                    {'all': [{'eq': ['ip_src', '192.168.0.13']}, {'eq': ['ip_dst', '192.168.0.16']}]}
+                    ]},
+                {'any_falsy': 'icmp_type'},
+                {'truthy': 'tcp_'}
+                ]},
+            {'all': [
+                {'eq': ['arp_src_hw_mac', 'f0:18:98:5e:ff:9f']},
+                {'in': ['arp_dst_hw_mac', ['bc:1c:81:4b:ae:ba', '48:4b:aa:2c:d8:f9']]}
+                ]}
+            ]}, 'mitm_arpspoofing', None)
+        ],
+    '*mitm-arpspoofing-[4-6]-dec.pcap*': [
+        ({'all': [
+            {'eq': ['eth_addr', 'f0:18:98:5e:ff:9f']},
+            {'any': [
+                {'all': [
+                    {'eq': ['ip_addr', '192.168.0.24']},
+                    {'any_falsy': 'icmp_type'},
+                    {'truthy': 'tcp_'}
+                    ]},
+                {'all': [
+                    {'eq': ['arp_src_hw_mac', 'f0:18:98:5e:ff:9f']},
+                    {'in': ['arp_dst_hw_mac', ['04:32:f4:45:17:b3', '88:36:6c:d7:1c:56']]}
+                    ]}
+                ]}
+            ]}, 'mitm_arpspoofing', None)
+        ],
+    '*dos-synflooding-[1-2]-dec.pcap*': [
+        (_dos_synflooding('222.0.0.0/8', '192.168.0.13', 554), 'dos_synflooding', None)
+        ],
+    '*dos-synflooding-3-dec.pcap*': [
+        (_dos_synflooding('111.0.0.0/8', '192.168.0.13', 554), 'dos_synflooding', None)
+        ],
+    '*dos-synflooding-[4-6]-dec.pcap*': [
+        (_dos_synflooding('111.0.0.0/8', '192.168.0.24', 19604), 'dos_synflooding', None)
+        ],
+    '*scan-hostport-1-dec.pcap*': _scan_hostport('192.168.0.13', 12999),
+    '*scan-hostport-2-dec.pcap*': _scan_hostport('192.168.0.13', 14499),
+    '*scan-hostport-3-dec.pcap*': _scan_hostport('192.168.0.13', 1999),
+    '*scan-hostport-4-dec.pcap*': _scan_hostport('192.168.0.24', 3999),
+    '*scan-hostport-5-dec.pcap*': _scan_hostport('192.168.0.24', 1299),
+    '*scan-hostport-6-dec.pcap*': _scan_hostport('192.168.0.24', 999),
+    '*scan-portos-[1-3]-dec.pcap*': _scan_portos('192.168.0.13'),
+    '*scan-portos-[4-6]-dec.pcap*': _scan_portos('192.168.0.24'),
+    '*mirai-udpflooding-[1-4]-dec.pcap*': [
+        ({'eq': ['ip_dst', '210.89.164.90']}, 'mirai_udpflooding', None)
+        ],
+    '*mirai-ackflooding-[1-4]-dec.pcap*': [
+        ({'eq': ['ip_dst', '210.89.164.90']}, 'mirai_ackflooding', None)
+        ],
+    '*mirai-httpflooding-[1-4]-dec.pcap*': [
+        ({'eq': ['ip_dst', '210.89.164.90']}, 'mirai_httpflooding', None)
+        ],
+    '*mirai-hostbruteforce-[135]-dec.pcap*': _mirai_hostbruteforce('192.168.0.13'),
+    '*mirai-hostbruteforce-[24]-dec.pcap*': _mirai_hostbruteforce('192.168.0.24'),
+    }
+
+
+# ____ Vectorized condition primitives ____________________________
+def ip_to_int(column: pd.Series) -> np.ndarray:
+    """Convert a column of IPv4 address strings to integers.
+
+    Addresses are parsed once per distinct value. Values that are not IPv4
+    address strings (NaN, numbers, malformed strings) map to -1.
+
+    Args:
+        column (pd.Series): Column of IPv4 address strings
+
+    Returns:
+        np.ndarray: int64 array of addresses, -1 where not an address
+    """
+    if column.dtype != object and not pd.api.types.is_string_dtype(column.dtype):
+        return np.full(len(column), -1, dtype=np.int64)
+
+    codes, uniques = pd.factorize(column)
+    table = np.full(len(uniques) + 1, -1, dtype=np.int64)
+    for i, value in enumerate(uniques):
+        if isinstance(value, str):
+            try:
+                table[i] = int(ipaddress.IPv4Address(value))
+            except ValueError:
+                pass
+    # code -1 (missing) picks the trailing -1 entry
+    return table[codes]
+
+
+def truthy(column: pd.Series) -> np.ndarray:
+    """Truthiness of each value, missing values being False.
+
+    Args:
+        column (pd.Series): Column to evaluate
+
+    Returns:
+        np.ndarray: Boolean mask
+    """
+    return (column.notna() & column.astype(bool)).to_numpy(dtype=bool)
+
+
+def any_falsy(column: pd.Series) -> bool:
+    """Whether any value of the column is falsy (missing values count as truthy).
+
+    The `data_filters` functions use `column.apply(bool)`, which also counts
+    missing values as truthy when they are NaN, as in files read from csv, but
+    counts object `None` as falsy; here `None` is missing like NaN.
+
+    Args:
+        column (pd.Series): Column to evaluate
+
+    Returns:
+        bool: True if any set value is falsy
+    """
+    return bool((column.notna() & ~column.astype(bool)).any())
+
+
+def _network_bounds(network: str) -> tuple:
+    network = ipaddress.IPv4Network(network)
+    return int(network.network_address), int(network.broadcast_address)
+
+
+def _compile_condition(condition: dict):
+    """Compile a condition dict into a function of (data, context) returning
+    a boolean `ndarray`, or a numpy scalar bool for whole-file conditions."""
+    (op, arg), = condition.items()
+
+    if op == 'eq':
+        column, value = arg
+        return lambda data, context: (data[column] == value).to_numpy(dtype=bool)
+
+    if op == 'in':
+        column, values = arg
+        return lambda data, context: data[column].isin(values).to_numpy(dtype=bool)
+
+    if op == 'cidr':
+        column, network = arg
+        low, high = _network_bounds(network)
+
+        def _cidr(data, context):
+            key = ('ip', column)
+            if key not in context:
+                context[key] = ip_to_int(data[column])
+            ips = context[key]
+            return (ips >= low) & (ips <= high)
+        return _cidr
+
+    if op == 'truthy':
+        return lambda data, context: truthy(data[arg])
+
+    if op == 'any_falsy':
+        def _any_falsy(data, context):
+            key = ('any_falsy', arg)
+            if key not in context:
+                context[key] = any_falsy(data[arg])
+            return context[key]
+        return _any_falsy
+
+    if op in ('all', 'any'):
+        parts = [_compile_condition(part) for part in arg]
+        reduce = np.logical_and if op == 'all' else np.logical_or
+
+        def _reduce(data, context):
+            mask = parts[0](data, context)
+            for part in parts[1:]:
+                mask = reduce(mask, part(data, context))
+            return mask
+        return _reduce
+
+    if op == 'not':
+        part = _compile_condition(arg)
+        return lambda data, context: np.logical_not(part(data, context))
+
+    raise ValueError(f"Unknown rule condition '{op}'")
+
+
+def global_columns(rules: list) -> set:
+    """Columns of the `any_falsy` conditions of compiled rules, which are
+    evaluated over a whole file rather than per packet.
+
+    Args:
+        rules (list): Compiled rules from `compile_rules`
+
+    Returns:
+        set: Column names
+    """
+    return {column for _, _, _, columns in rules for column in columns}
+
+
+def _any_falsy_columns(condition: dict) -> set:
+    (op, arg), = condition.items()
+    if op == 'any_falsy':
+        return {arg}
+    if op in ('all', 'any'):
+        return set().union(*(_any_falsy_columns(part) for part in arg))
+    if op == 'not':
+        return _any_falsy_columns(arg)
+    return set()
+
+
+# ____ Rule sets ____________________________
+def compile_rules(rules: list) -> list:
+    """Compile a list of (condition, label, row limit) rules.
+
+    Args:
+        rules (list): Rules as found in `LABEL_RULES`
+
+    Returns:
+        list: Compiled (mask function, label, row limit, any_falsy columns) rules
+    """
+    return [(_compile_condition(condition), label, limit, _any_falsy_columns(condition))
+            for condition, label, limit in rules]
+
+
+_COMPILED: dict = {}
+
+
+def match_rules(filename: str, rule_table: dict=LABEL_RULES) -> list:
+    """Find and compile the rules defined for a pcap file.
+
+    Args:
+        filename (str): Name of the pcap file
+        rule_table (dict, optional): File pattern to rules table. Defaults to LABEL_RULES.
+
+    Returns:
+        list: Compiled rules, None if no pattern matches the file
+    """
+    for pattern, rules in rule_table.items():
+        if fnmatchcase(filename, pattern):
+            key = (id(rule_table), pattern)
+            if key not in _COMPILED:
+                _COMPILED[key] = compile_rules(rules)
+            return _COMPILED[key]
+    return None
+
+
+def scan_context(chunks, rules: list) -> dict:
+    """Evaluate the whole-file conditions of compiled rules over a file read in
+    chunks, for labelling the same file chunk by chunk with `apply_rules`.
+
+    Args:
+        chunks (Iterable[DataFrame]): Chunks of the file, holding at least the
+            columns from `global_columns`
+        rules (list): Compiled rules
+
+    Returns:
+        dict: Context for `apply_rules`
+    """
+    flags = dict.fromkeys(global_columns(rules), False)
+    for chunk in chunks:
+        for column in flags:
+            flags[column] = flags[column] or any_falsy(chunk[column])
+
+    return {('any_falsy', column): flag for column, flag in flags.items()}
+
+
+def apply_rules(data: DataFrame,
+                rules: list,
+                row_offset: int=0,
+                context: dict=None) -> DataFrame:
+    """Label packets with compiled rules in a new 'label' column.
+
+    Args:
+        data (DataFrame): Converted packet data
+        rules (list): Compiled rules from `compile_rules` or `match_rules`
+        row_offset (int, optional): Position of the first row of `data` in its
+            file, for row limits when labelling a file in chunks. Defaults to 0.
+        context (dict, optional): Whole-file conditions from `scan_context`, required
+            when `data` is a chunk of a file. Defaults to None.
+
+    Returns:
+        DataFrame: Labelled data (modified in place)
+    """
+    context = {} if context is None else dict(context)
+    labels = ['normal']
+    codes = np.zeros(len(data), dtype=np.int16)
+
+    for condition, label, limit, _ in rules:
+        mask = np.broadcast_to(condition(data, context), (len(data),))
+        if limit is not None:
+            mask = mask.copy()
+            mask[max(limit - row_offset, 0):] = False
+        labels.append(label)
+        codes[mask] = len(labels) - 1
+
+    data['label'] = np.array(labels, dtype=object)[codes]
+
+    return data
@@ -0,0 +1,117 @@
+"""
+This module is used to read packets continuously from a capture that is still
+being written: a single growing pcap/pcapng file, or a ring buffer directory of
+capture files (e.g. `dumpcap -b filesize:...`), as a local stand-in for a
+capture interface.
+
+"""
+
+import os
+import time
+import threading
+from typing import Iterator
+from src.data.pcap_reader import read_pcap, PacketDecoder
+
+
+CAPTURE_EXTENSIONS = ('.pcap', '.pcapng')
+
+
+class FollowFile:
+    """Read-only binary file that waits for data still being appended to it,
+    like `tail -f`.
+
+    `read(n)` polls the file until `n` bytes are available, and only returns
+    fewer bytes once `stop` is set or `finished()` returns True, which ends the
+    pcap record reader at the last complete record.
+
+    Args:
+        path (str): Capture file to follow
+        stop (threading.Event): Set to stop waiting for data
+        finished (Callable, optional): Returns True once the file will not grow anymore. Defaults to None.
+        poll_interval (float, optional): Seconds between polls for new data. Defaults to 0.05.
+    """
+    def __init__(self, path: str, stop: threading.Event, finished=None, poll_interval: float=0.05):
+        self.file = open(path, 'rb')
+        self.stop = stop
+        self.finished = finished or (lambda: False)
+        self.poll_interval = poll_interval
+
+    def read(self, n: int) -> bytes:
+        data = self.file.read(n)
+        while len(data) < n:
+            if self.stop.is_set() or self.finished():
+                # Last attempt: data may have been written before the file was finished
+                return data + self.file.read(n - len(data))
+            time.sleep(self.poll_interval)
+            data += self.file.read(n - len(data))
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _ring_files(directory: str) -> list:
+    """Capture files of a ring buffer directory, oldest first."""
+    return sorted(filename for filename in os.listdir(directory)
+                  if filename.endswith(CAPTURE_EXTENSIONS))
+
+
+def follow_packets(source: str,
+                   stop: threading.Event=None,
+                   follow: bool=True,
+                   poll_interval: float=0.05) -> Iterator[dict]:
+    """Yield decoded packets of a capture as they are written.
+
+    `source` is either a capture file, followed as it grows, or a ring buffer
+    directory, whose files are read in name order, each one until a newer file
+    appears. Packets are decoded with the native engine into the same fields as
+    `pcap_reader.native_packets`; stream state carries over between ring files.
+
+    Args:
+        source (str): Growing capture file or ring buffer directory
+        stop (threading.Event, optional): Set to stop following. Defaults to None.
+        follow (bool, optional): if False, reads what has been written so far and returns. Defaults to True.
+        poll_interval (float, optional): Seconds between polls for new data. Defaults to 0.05.
+
+    Yields:
+        Iterator[dict]: Packet fields keyed by `PACKET_COLUMNS`
+    """
+    stop = stop or threading.Event()
+    decoder = PacketDecoder()
+
+    if not os.path.isdir(source):
+        paths = iter([(source, lambda: not follow)])
+    else:
+        paths = _follow_ring(source, stop, follow, poll_interval)
+
+    for path, finished in paths:
+        capture = FollowFile(path, stop, finished, poll_interval)
+        try:
+            for timestamp, linktype, data in read_pcap(capture):
+                yield decoder.decode(timestamp, linktype, data)
+        except ValueError:
+            # Empty or truncated file header (capture stopped before writing it)
+            if not (stop.is_set() or finished()):
+                raise
+        finally:
+            capture.close()
+
+        if stop.is_set():
+            return
+
+
+def _follow_ring(directory: str, stop: threading.Event, follow: bool, poll_interval: float):
+    """Yield (path, finished) for each file of a ring buffer directory in turn,
+    `finished` telling whether a newer file has been started."""
+    current = None
+    while not stop.is_set():
+        files = [f for f in _ring_files(directory) if current is None or f > current]
+        if not files:
+            if not follow:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        current = files[0]
+        newer = lambda name=current: not follow or any(f > name for f in _ring_files(directory))
+        yield os.path.join(directory, current), newer
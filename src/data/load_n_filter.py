@@ -6,10 +6,13 @@ Saves labelled files in specified directory
 """
 
 import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+from pandas import DataFrame
 from tqdm import tqdm
 from src.data.pcap_to_csv import pcapng_to_csv
-import src.data.data_filters as data_filters
+from src.data.label_rules import match_rules, apply_rules, global_columns, scan_context
+from src.data.packet_schema import read_packet_csv
 from src.utils.pipeline_log_config import pipeline as logger
 
 def scan_directory(directory: str, extension: str) -> list:
@@ -30,21 +33,255 @@ def scan_directory(directory: str, extension: str) -> list:
     return files
 
 
+def label_file(filename: str, data_df: DataFrame) -> DataFrame:
+    """Label packets of a converted pcap file with the rules defined for that
+    file in the `label_rules` module.
+
+    Args:
+        filename (str): Name of the pcap file the data was converted from
+        data_df (DataFrame): Converted packet data
+
+    Returns:
+        DataFrame: Labelled data, None if no filter is defined for the file
+    """
+    rules = match_rules(filename)
+    if rules is None:
+        return None
+
+    return apply_rules(data_df, rules)
+
+
+def label_csv_in_chunks(filename: str,
+                        csv_path: str,
+                        labelled_path: str,
+                        chunksize: int=100_000) -> bool:
+    """Label a converted pcap file chunk by chunk with the rules defined for
+    that file in the `label_rules` module, keeping at most `chunksize` packets
+    in memory.
+
+    Whole-file conditions are evaluated in a first pass over their columns only
+    and row limits are applied with a running row offset, so the labels are the
+    same as when labelling the whole file at once.
+
+    Args:
+        filename (str): Name of the pcap file the data was converted from
+        csv_path (str): Converted packet data csv file
+        labelled_path (str): Path of the labelled csv file to write, replaced
+                             only once all chunks are labelled
+        chunksize (int, optional): Packets per chunk. Defaults to 100_000.
+
+    Returns:
+        bool: True if the file was labelled, False if no rules are defined for the file
+    """
+    rules = match_rules(filename)
+    if rules is None:
+        return False
+
+    context = {}
+    columns = list(global_columns(rules))
+    if columns:
+        with pd.read_csv(csv_path, usecols=columns, chunksize=chunksize) as reader:
+            context = scan_context(reader, rules)
+
+    # Chunks go to a temporary file that replaces the labelled file once complete,
+    # so an interrupted run never leaves a partially labelled file behind
+    tmp_path = f'{labelled_path}.{os.getpid()}.tmp'
+    ROW_OFFSET = 0
+    try:
+        with pd.read_csv(csv_path, chunksize=chunksize) as reader:
+            for chunk in reader:
+                chunk = apply_rules(chunk, rules, row_offset=ROW_OFFSET, context=context)
+                chunk.to_csv(tmp_path, index=False,
+                             header=ROW_OFFSET == 0, mode='w' if ROW_OFFSET == 0 else 'a')
+                ROW_OFFSET += len(chunk)
+
+        if ROW_OFFSET == 0:
+            # No packets: write the header only
+            empty = pd.read_csv(csv_path, nrows=0)
+            empty['label'] = []
+            empty.to_csv(tmp_path, index=False, header=True, mode='w')
+
+        os.replace(tmp_path, labelled_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return True
+
+
+def convert_and_label(directory_path: str,
+                      filename: str,
+                      destination_path: str,
+                      engine: str='pyshark',
+                      chunksize: int=None) -> str:
+    """Convert a single .pcap file to csv, label its packets and save the labelled
+    csv file to the destination path.
+
+    With `chunksize` set, packets are streamed to the interim csv file and labelled
+    in chunks, so memory use is bounded by the chunk size instead of the file size.
+
+    Args:
+        directory_path (str): Path to load .pcap files
+        filename (str): Name of the .pcap file in the directory
+        destination_path (str): Path to save labelled files
+        engine (str, optional): Packet parsing engine, 'pyshark' or 'native'. Defaults to 'pyshark'.
+        chunksize (int, optional): Packets per chunk, whole file at once if None. Defaults to None.
+
+    Returns:
+        str: Name of the converted file
+    """
+    print(f"Coverting {filename} to csv...")
+    logger.info(f"Coverting {filename} to csv...")
+    labelled_path = str(destination_path+"/"+filename[:-5]+".csv")
+
+    if chunksize:
+        # Convert file to csv without reading it back
+        csv_path = pcapng_to_csv(
+            PCAPNG_FILE=str(directory_path+"/"+filename),
+            CSV_FOLDER_PATH='./data/interim',
+            BATCH_SIZE=chunksize,
+            engine=engine,
+            return_df=False
+        )
+
+        print(f"Adding labels to {filename[:-5]}.csv in chunks of {chunksize}...\n")
+        logger.info(f"Adding labels to {filename[:-5]}.csv in chunks of {chunksize}...\n")
+        label_csv_in_chunks(filename, csv_path, labelled_path, chunksize)
+
+        return filename
+
+    # Convert file to csv
+    data_df = pcapng_to_csv(
+        PCAPNG_FILE=str(directory_path+"/"+filename),
+        CSV_FOLDER_PATH='./data/interim',
+        engine=engine
+    )
+
+    print(f"Adding labels to {filename[:-5]}.csv...\n")
+    logger.info(f"Adding labels to {filename[:-5]}.csv...\n")
+    # filter the files using the specific filter function for each file
+    data_labelled = label_file(filename, data_df)
+    if data_labelled is not None:
+        data_labelled.to_csv(labelled_path, index=False, header=True, mode='w')
+
+    return filename
+
+
+def _convert_and_label_worker(args: tuple) -> tuple:
+    """Process pool entry point for `convert_and_label`.
+
+    Returns:
+        tuple: (filename, error message or None)
+    """
+    filename = args[1]
+    try:
+        convert_and_label(*args)
+        return filename, None
+    except Exception as e:
+        return filename, str(e)
+
+
+def labelled_partitions(destination_path: str, pcap_files_list: list) -> list:
+    """Return paths of the labelled csv files (partitions) of the given pcap
+    files, in the order of `pcap_files_list`, skipping files that were not labelled.
+
+    Args:
+        destination_path (str): Path holding labelled files
+        pcap_files_list (list): List of .pcap file names
+
+    Returns:
+        list: Paths of existing labelled csv files
+    """
+    paths = []
+    for filename in pcap_files_list:
+        path = str(destination_path+"/"+filename[:-5]+".csv")
+        if os.path.isfile(path):
+            paths.append(path)
+        else:
+            logger.warning(f"No labelled file for '{filename}', skipped")
+    return paths
+
+
+def merge_csv_files(paths: list, merged_path: str, buffer_size: int=1 << 24) -> int:
+    """Concatenate csv files into one file without parsing them.
+
+    Rows are copied at the byte level; only the header line of each file is
+    read to drop repeated headers. Files whose header differs from the first
+    file are realigned to its columns in chunks instead, with values read as
+    text so they are written back unchanged.
+
+    Args:
+        paths (list): csv files to merge, in order
+        merged_path (str): Path of the merged csv file
+        buffer_size (int, optional): Copy buffer size in bytes. Defaults to 16 MiB.
+
+    Returns:
+        int: Number of files merged
+    """
+    header = None
+    COUNT = 0
+
+    with open(merged_path, 'wb') as merged:
+        for path in tqdm(paths, desc="Merging Files", unit=" files", total=len(paths)):
+            with open(path, 'rb') as shard:
+                shard_header = shard.readline()
+                if not shard_header.strip():
+                    continue
+
+                if header is None:
+                    header = shard_header.rstrip(b'\r\n') + b'\n'
+                    merged.write(header)
+
+                if shard_header.rstrip(b'\r\n') + b'\n' == header:
+                    # Same columns: copy the rows as they are
+                    ends_with_newline = True
+                    while True:
+                        block = shard.read(buffer_size)
+                        if not block:
+                            break
+                        merged.write(block)
+                        ends_with_newline = block.endswith(b'\n')
+                    if not ends_with_newline:
+                        merged.write(b'\n')
+                else:
+                    logger.warning(f"Columns of '{path}' differ from the merged file, realigning")
+                    columns = header.decode().rstrip('\n').split(',')
+                    for chunk in read_packet_csv(path, chunksize=100_000, text=True):
+                        merged.write(chunk.reindex(columns=columns)
+                                     .to_csv(index=False, header=False).encode())
+
+            COUNT += 1
+
+    return COUNT
+
+
 def load_and_filter_files(directory_path: str,
                           pcap_files_list: list,
                           destination_path: str,
                           merge: bool=False,
-                          pick_up: bool=False):
+                          pick_up: bool=False,
+                          n_workers: int=1,
+                          engine: str='pyshark',
+                          chunksize: int=None):
     """Load .pcap files from specified directory, filter them according to the rules
-    defined in `data_filters` module and create a new column with appropriate datapoint
+    defined in `label_rules` module and create a new column with appropriate datapoint
     labels. Save new dataframe to specified destination path.
 
+    With `n_workers` > 1, files are converted and labelled concurrently in a pool of
+    worker processes. The merged file always follows the order of `pcap_files_list`
+    and is built by concatenating the labelled files without parsing them.
+
     Args:
         directory_path (str): Path to load .pcap files
         pcap_files_list (list): List of files in the directory to be filtered.
         destination_path (str): Path to save labelled files
         merge (bool, optional): if True, merges all the filtered data into one file. Defaults to False.
         pick_up (bool, optional): if True, scans destination path to skip already filtered files. Defaults to False.
+        n_workers (int, optional): Number of worker processes. Defaults to 1 (serial).
+        engine (str, optional): Packet parsing engine, 'pyshark' or 'native'. Defaults to 'pyshark'.
+        chunksize (int, optional): Packets per chunk to convert and label files with
+            bounded memory, whole files at once if None. Defaults to None.
     """    
 
     # Scan destination path for existing csv files
@@ -53,156 +290,37 @@ def load_and_filter_files(directory_path: str,
     print(f"Converting {len(pcap_files_list)} pcap files to csv\n")
     logger.info(f"Converting {len(pcap_files_list)} pcap files to csv\n")
 
-
-    # Initialize fails counter
-    FAILS = 0
-
-    # Loop through the files in the directory and load each one
+    # Scan destination path if pick_up is True
+    pending_files = []
     for filename in pcap_files_list:
-
-        # Scan destination path if pick_up is True
         if pick_up==True and str(filename[:-5]+".csv") in existing_csv:
             print(f"{filename} already converted\n")
             logger.info("'pick_up' set to continue from last run")
             logger.info(f"{filename} already converted\n")
         else:
+            pending_files.append(filename)
+
+    # Initialize fails counter
+    FAILS = 0
 
-            try:
-                print(f"Coverting {filename} to csv...")
-                logger.info(f"Coverting {filename} to csv...")
-                # Convert file to csv
-                csv_file = pcapng_to_csv(
-                    PCAPNG_FILE=str(directory_path+"/"+filename),
-                    CSV_FOLDER_PATH='./data/interim'
-                )
-                # Load converted csv to memory
-                data_df = pd.read_csv(str("./data/interim"+"/"+filename[:-5]+".csv"))
-                
-                print(f"Adding labels to {filename[:-5]}.csv...\n")
-                logger.info(f"Adding labels to {filename[:-5]}.csv...\n")
-                # filter the files using the specific filter function for each file
-                if "benign-dec.pcap" in filename:
-                    data_labelled = data_filters.benign_dec(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "mitm-arpspoofing-1-dec.pcap" in filename or\
-                "mitm-arpspoofing-2-dec.pcap" in filename or\
-                "mitm-arpspoofing-3-dec.pcap" in filename:
-                    data_labelled = data_filters.mitm_arpspoofing_1_3_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "mitm-arpspoofing-4-dec.pcap" in filename or\
-                "mitm-arpspoofing-5-dec.pcap" in filename or\
-                "mitm-arpspoofing-6-dec.pcap" in filename:
-                    data_labelled = data_filters.mitm_arpspoofing_4_6_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "dos-synflooding-1-dec.pcap" in filename or\
-                "dos-synflooding-2-dec.pcap" in filename:
-                    data_labelled = data_filters.dos_synflooding_1_2_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "dos-synflooding-3-dec.pcap" in filename:
-                    data_labelled = data_filters.dos_synflooding_3_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "dos-synflooding-4-dec.pcap" in filename or\
-                "dos-synflooding-5-dec.pcap" in filename or\
-                "dos-synflooding-6-dec.pcap" in filename:
-                    data_labelled = data_filters.dos_synflooding_4_6_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "scan-hostport-1-dec.pcap" in filename:
-                    data_labelled = data_filters.scan_hostport_1_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "scan-hostport-2-dec.pcap" in filename:
-                    data_labelled = data_filters.scan_hostport_2_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "scan-hostport-3-dec.pcap" in filename:
-                    data_labelled = data_filters.scan_hostport_3_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "scan-hostport-4-dec.pcap" in filename:
-                    data_labelled = data_filters.scan_hostport_4_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "scan-hostport-5-dec.pcap" in filename:
-                    data_labelled = data_filters.scan_hostport_5_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "scan-hostport-6-dec.pcap" in filename:
-                    data_labelled = data_filters.scan_hostport_6_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "scan-portos-1-dec.pcap" in filename or\
-                "scan-portos-2-dec.pcap" in filename or\
-                "scan-portos-3-dec.pcap" in filename:
-                    data_labelled = data_filters.scan_portos_1_3_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "scan-portos-4-dec.pcap" in filename or\
-                "scan-portos-5-dec.pcap" in filename or\
-                "scan-portos-6-dec.pcap" in filename:
-                    data_labelled = data_filters.scan_portos_4_6_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "mirai-udpflooding-1-dec.pcap" in filename or\
-                "mirai-udpflooding-2-dec.pcap" in filename or\
-                "mirai-udpflooding-3-dec.pcap" in filename or\
-                "mirai-udpflooding-4-dec.pcap" in filename:
-                    data_labelled = data_filters.mirai_udpflooding_1_4_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "mirai-ackflooding-1-dec.pcap" in filename or\
-                "mirai-ackflooding-2-dec.pcap" in filename or\
-                "mirai-ackflooding-3-dec.pcap" in filename or\
-                "mirai-ackflooding-4-dec.pcap" in filename:
-                    data_labelled = data_filters.mirai_ackflooding_1_4_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "mirai-httpflooding-1-dec.pcap" in filename or\
-                "mirai-httpflooding-2-dec.pcap" in filename or\
-                "mirai-httpflooding-3-dec.pcap" in filename or\
-                "mirai-httpflooding-4-dec.pcap" in filename:
-                    data_labelled = data_filters.mirai_httpflooding_1_4_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "mirai-hostbruteforce-1-dec.pcap" in filename or\
-                "mirai-hostbruteforce-3-dec.pcap" in filename or\
-                "mirai-hostbruteforce-5-dec.pcap" in filename:
-                    data_labelled = data_filters.mirai_hostbruteforce_1_3_n_5_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-
-                if "mirai-hostbruteforce-2-dec.pcap" in filename or\
-                "mirai-hostbruteforce-4-dec.pcap" in filename:
-                    data_labelled = data_filters.mirai_hostbruteforce_2_n_4_dec_filter(data_df)
-                    data_labelled.to_csv(str(destination_path+"/"+filename[:-5]+".csv"),
-                                        index=False, header=True, mode='w')
-            except Exception as e:
-                print(f"An error occured with file '{filename}': \n", e)
-                logger.warning(f"An error occured with file '{filename}': \n", e)
-                FAILS+=1
-                
+    jobs = [(directory_path, filename, destination_path, engine, chunksize)
+            for filename in pending_files]
+    if n_workers > 1 and len(jobs) > 1:
+        logger.info(f"Converting files with {n_workers} worker processes")
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(tqdm(executor.map(_convert_and_label_worker, jobs),
+                                desc="Converting Files",
+                                unit=" files",
+                                total=len(jobs)))
+    else:
+        # Loop through the files in the directory and load each one
+        results = [_convert_and_label_worker(job) for job in jobs]
+
+    for filename, error in results:
+        if error is not None:
+            print(f"An error occured with file '{filename}': \n", error)
+            logger.warning(f"An error occured with file '{filename}': \n{error}")
+            FAILS+=1
 
     print(f"\n{len(pcap_files_list) - FAILS} pcap files labelled and saved to csv\n",
           f"{FAILS} files could not be converted. Read terminal logs for details")
@@ -213,27 +331,10 @@ def load_and_filter_files(directory_path: str,
         print(f"Merging {len(pcap_files_list)} csv files...")
         logger.info("Merge set to True")
         logger.info(f"Merging {len(pcap_files_list)} csv files...")
-        # Initialize counter
-        COUNT = 0
-
-        for filename in tqdm(pcap_files_list,
-                             desc="Merging Files",
-                             unit=" files",
-                             total=len(pcap_files_list)):
-
-            # Increment counter
-            COUNT+=1
-            labelled_dataframe = pd.read_csv(str(destination_path+"/"+filename[:-5]+".csv"))
-
-            if COUNT == 1:
-                # Create new marge file
-                labelled_dataframe.to_csv(str(destination_path+"/"+"all_data_labelled.csv"),
-                                          index=False, header=True, mode='w')
-            else:
-                # Update merge file
-                labelled_dataframe.to_csv(str(destination_path+"/"+"all_data_labelled.csv"),
-                                          index=False, header=False, mode='a')
-        
+        shard_paths = labelled_partitions(destination_path, pcap_files_list)
+        COUNT = merge_csv_files(shard_paths,
+                                str(destination_path+"/"+"all_data_labelled.csv"))
+
         print(f"|| {COUNT} csv files merged and saved to {destination_path} ||")
         logger.info(f"|| {COUNT} csv files merged and saved to {destination_path} ||")
 
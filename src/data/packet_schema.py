@@ -0,0 +1,232 @@
+"""
+Schema of the packet data csv columns and a typed, column-projected reader.
+
+Every column written by `pcap_to_csv` (and the `label` column added by
+`load_n_filter`) is registered with the type its values are read as: numeric
+fields as float64, and hexadecimal fields, addresses and text as strings,
+which is how `convert_to_float` expects them. Reading only the requested
+columns with these types skips type inference and the parsing of the
+unused columns, and uses the multithreaded pyarrow parser when pyarrow is
+installed.
+
+"""
+
+import warnings
+import pandas as pd
+from pandas import DataFrame
+from src.data.pcap_reader import LAYER_FIELDS
+
+
+# Column value types
+NUMBER = 'float64'
+TEXT = 'str'
+
+# Fields of each layer read as strings, all other fields are numbers
+TEXT_FIELDS = {
+    'ip': [
+        # hexadecimal
+        'dsfield', 'id', 'flags', 'checksum',
+        # addresses
+        'src', 'addr', 'src_host', 'host', 'dst', 'dst_host'
+        ],
+    'tcp': ['flags', 'checksum', 'flags_str', '', 'analysis'],
+    'udp': ['checksum'],
+    'eth': [
+        # addresses and resolved names
+        'dst', 'dst_resolved', 'dst_oui_resolved', 'addr', 'addr_resolved', 'addr_oui_resolved',
+        'src', 'src_resolved', 'src_oui_resolved',
+        # hexadecimal
+        'type'
+        ],
+    'icmp': ['checksum'],
+    'arp': ['proto_type', 'src_hw_mac', 'src_proto_ipv4', 'dst_hw_mac', 'dst_proto_ipv4']
+    }
+
+# Column name to value type
+PACKET_SCHEMA = {'timestamp': NUMBER}
+PACKET_SCHEMA.update({f'{layer}_{field}': TEXT if field in TEXT_FIELDS.get(layer, ()) else NUMBER
+                      for layer, fields in LAYER_FIELDS.items()
+                      for field in fields})
+PACKET_SCHEMA['label'] = TEXT
+
+# Values read as missing, same as pandas' default `na_values`
+NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+    '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+    ]
+
+
+def register_columns(types: dict):
+    """Add or change column types of the packet schema, e.g. for new packet fields.
+
+    Args:
+        types (dict): Column name to `NUMBER` or `TEXT`
+
+    Raises:
+        ValueError: If a type is neither `NUMBER` nor `TEXT`
+    """
+    for column, value_type in types.items():
+        if value_type not in (NUMBER, TEXT):
+            raise ValueError(f"Unknown type for column '{column}': {value_type}")
+    PACKET_SCHEMA.update(types)
+
+
+def column_types(columns: list, text: bool=False) -> dict:
+    """Value types of the given columns, leaving out columns missing from the schema.
+
+    Args:
+        columns (list): Column names
+        text (bool, optional): if True, all columns are read as strings. Defaults to False.
+
+    Returns:
+        dict: Column name to `NUMBER` or `TEXT`
+    """
+    if text:
+        return dict.fromkeys(columns, TEXT)
+    return {column: PACKET_SCHEMA[column] for column in columns if column in PACKET_SCHEMA}
+
+
+def default_engine() -> str:
+    """'pyarrow' if pyarrow is installed, else pandas' 'c' parser."""
+    try:
+        import pyarrow.csv  # noqa: F401
+        return 'pyarrow'
+    except ImportError:
+        return 'c'
+
+
+def read_packet_csv(path: str,
+                    columns: list=None,
+                    chunksize: int=None,
+                    engine: str=None,
+                    text: bool=False):
+    """Read a packet data csv file with the types of the packet schema.
+
+    Columns are returned in file order, as with `pd.read_csv(..., usecols=columns)`;
+    columns missing from the schema have their type inferred. If a value does not
+    parse as its registered type (e.g. text in a numeric field), the file, or the
+    rest of it when reading in chunks, is read again with inferred types, so the
+    values are the same as with `pd.read_csv`.
+
+    Args:
+        path (str): csv file
+        columns (list, optional): Columns to read, all columns if None. Defaults to None.
+        chunksize (int, optional): Rows per chunk, whole file if None. Defaults to None.
+        engine (str, optional): 'pyarrow' or 'c', 'pyarrow' if installed if None. Defaults to None.
+        text (bool, optional): if True, reads all values as strings, e.g. to rewrite
+                               rows without changing them. Defaults to False.
+
+    Returns:
+        DataFrame: Packet data, or an iterator of DataFrame chunks if `chunksize` is set
+    """
+    engine = engine or default_engine()
+    if columns is None:
+        columns = list(pd.read_csv(path, nrows=0).columns)
+    types = column_types(columns, text=text)
+
+    if chunksize is not None:
+        return _read_chunks(path, columns, types, chunksize, engine)
+
+    try:
+        if engine == 'pyarrow':
+            return _pyarrow_reader(path, columns, types, incremental=False).to_pandas()
+        return pd.read_csv(path, usecols=columns, dtype=types)
+    except ValueError as e:
+        _warn_untyped(path, e)
+        return pd.read_csv(path, usecols=columns)
+
+
+def read_labelled_data(paths: list, columns: list=None, chunksize: int=100_000):
+    """Lazily scan labelled csv partitions in record batches.
+
+    Values are read with the types of the packet schema.
+
+    Args:
+        paths (list): Labelled csv files, e.g. from `load_n_filter.labelled_partitions`
+        columns (list, optional): Columns to read, all columns if None. Defaults to None.
+        chunksize (int, optional): Rows per batch. Defaults to 100_000.
+
+    Yields:
+        Iterator[DataFrame]: Batches of labelled rows, partition by partition
+    """
+    for path in paths:
+        for chunk in read_packet_csv(path, columns=columns, chunksize=chunksize):
+            yield chunk
+
+
+def _warn_untyped(path: str, error: Exception):
+    warnings.warn(f"Values of '{path}' do not match the packet schema, "
+                  f"reading with inferred types: {error}", RuntimeWarning, stacklevel=3)
+
+
+def _read_chunks(path: str, columns: list, types: dict, chunksize: int, engine: str):
+    # Typed chunks, then inferred types from the first chunk that fails to parse
+    ROW_OFFSET = 0
+    try:
+        if engine == 'pyarrow':
+            chunks = _pyarrow_chunks(path, columns, types, chunksize)
+        else:
+            chunks = pd.read_csv(path, usecols=columns, dtype=types, chunksize=chunksize)
+        for chunk in chunks:
+            ROW_OFFSET += len(chunk)
+            yield chunk
+        return
+    except ValueError as e:
+        _warn_untyped(path, e)
+
+    with pd.read_csv(path, usecols=columns, chunksize=chunksize,
+                     skiprows=range(1, ROW_OFFSET + 1)) as reader:
+        for chunk in reader:
+            chunk.index += ROW_OFFSET
+            yield chunk
+
+
+def _pyarrow_reader(path: str, columns: list, types: dict, incremental: bool):
+    """Whole table (or incremental batch reader) of the given columns, in file
+    order, parsed directly to the schema types.
+
+    Types are passed to pyarrow's parser rather than applied after reading, so
+    hexadecimal strings are not parsed as numbers and empty values stay missing.
+    """
+    import pyarrow as pa
+    from pyarrow import csv
+
+    header = list(pd.read_csv(path, nrows=0).columns)
+    wanted = set(columns)
+    convert_options = csv.ConvertOptions(
+        include_columns=[column for column in header if column in wanted],
+        column_types={column: pa.float64() if value_type == NUMBER else pa.string()
+                      for column, value_type in types.items()},
+        null_values=NA_VALUES,
+        strings_can_be_null=True)
+
+    if incremental:
+        return csv.open_csv(path, convert_options=convert_options)
+    return csv.read_csv(path, convert_options=convert_options)
+
+
+def _pyarrow_chunks(path: str, columns: list, types: dict, chunksize: int):
+    """Stream a csv file with pyarrow's incremental reader, regrouping its record
+    batches into DataFrames of `chunksize` rows indexed like pandas' chunks."""
+    import pyarrow as pa
+
+    reader = _pyarrow_reader(path, columns, types, incremental=True)
+    ROW_OFFSET = 0
+
+    def _frame(table) -> DataFrame:
+        frame = table.to_pandas()
+        frame.index = pd.RangeIndex(ROW_OFFSET, ROW_OFFSET + len(frame))
+        return frame
+
+    pending, pending_rows = [], 0
+    for batch in reader:
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= chunksize:
+            table = pa.Table.from_batches(pending, schema=reader.schema)
+            yield _frame(table.slice(0, chunksize))
+            ROW_OFFSET += chunksize
+            pending = table.slice(chunksize).to_batches()
+            pending_rows -= chunksize
+    if pending_rows:
+        yield _frame(pa.Table.from_batches(pending, schema=reader.schema))
@@ -4,142 +4,80 @@ on demand
 
 """
 
-import pyshark
-from pyshark import FileCapture
 import pandas as pd
 from pandas import DataFrame
 from tqdm import tqdm
+from src.data.pcap_reader import read_packets, PACKET_COLUMNS
 
 
-def pcap_stream(PCAPNG_FILE: str) -> DataFrame:
+def pcap_stream(PCAPNG_FILE: str, engine: str = 'pyshark', batch_size: int = None) -> DataFrame:
     """Yield packets from a PCAP file as DataFrame
 
-    Uses pyshark to read PCAP file and then parses the specified fields
-    to generte DataFrame format of the data
+    Uses pyshark (or the native pcap reader) to read PCAP file and then parses
+    the specified fields to generte DataFrame format of the data
+
+    With `batch_size` set, yields record batches of up to `batch_size` packets
+    as dictionaries of column lists instead, which `batches_to_frame` assembles
+    into a single DataFrame in linear time.
 
     Args:
-        PCAPNG_FILE (str): _description_
+        PCAPNG_FILE (str): PCAP or PCAPNG file to be read
+        engine (str, optional): Packet parsing engine, 'pyshark' or 'native'. Defaults to 'pyshark'.
+        batch_size (int, optional): Packets per record batch, single packets if None. Defaults to None.
 
     Returns:
-        DataFrame: _description_
+        DataFrame: Single row DataFrame of packet fields
 
     Yields:
-        Iterator[DataFrame]: _description_
+        Iterator[DataFrame]: Single row DataFrame of packet fields
+        (Iterator[dict]: {column: [values]} record batches if `batch_size` is set)
     """    
+    packets = tqdm(read_packets(PCAPNG_FILE, engine), desc="Reading packets", unit=" packets")
+
+    if batch_size is None:
+        # Iterate over the packets
+        for packet_data in packets:
+
+            # convert dictionary to dataframe
+            df = pd.DataFrame(packet_data, index=[0])
+            yield df
+        return
+
+    batch = {column: [] for column in PACKET_COLUMNS}
+    COUNT = 0
+    for packet_data in packets:
+        for column, values in batch.items():
+            values.append(packet_data[column])
+        COUNT += 1
+
+        if COUNT == batch_size:
+            yield batch
+            batch = {column: [] for column in PACKET_COLUMNS}
+            COUNT = 0
+
+    if COUNT > 0:
+        yield batch
 
-    # Open the pcapng file using FileCapture
-    capture = pyshark.FileCapture(PCAPNG_FILE, keep_packets=False)
-
-    # Iterate over the packets
-    for packet in tqdm(capture, desc="Reading packets", unit=" packets"):
-
-        # Create empty packet dictionary
-        packet_data = {}
-
-        # Extract IP fields from the packet into the dictionary
-        ip_fields = [
-            'version', 'hdr_len', 'dsfield', 'dsfield_dscp', 'dsfield_ecn', 'len', 'id', 'flags',
-            'flags_rb', 'flags_df', 'flags_mf', 'frag_offset', 'ttl', 'proto', 'checksum',
-            'checksum_status', 'src', 'addr', 'src_host', 'host', 'dst', 'dst_host'
-            ]
-
-        if 'IP' in packet:
-            packet_data.update({
-                'timestamp': packet.sniff_time.timestamp(),
-                **{f'ip_{field}': getattr(packet.ip, field) if hasattr(packet.ip, field) else '' for field in ip_fields}
-            })
-        else:
-            packet_data.update({
-                'timestamp': packet.sniff_time.timestamp(),
-                **{f'ip_{field}': None for field in ip_fields}
-            })
-
-        # Extract TCP fields from the packet into the dictionary
-        tcp_fields = [
-            'srcport', 'dstport', 'port', 'stream', 'completeness', 'len', 'seq', 'seq_raw',
-            'nxtseq', 'ack', 'ack_raw', 'hdr_len', 'flags', 'flags_res', 'flags_ae', 'flags_cwr',
-            'flags_ece', 'flags_urg', 'flags_ack', 'flags_push', 'flags_reset', 'flags_syn',
-            'flags_fin', 'flags_str', 'window_size_value', 'window_size', 'window_size_scalefactor',
-            'checksum', 'checksum_status', 'urgent_pointer', '', 'time_relative', 'time_delta',
-            'analysis', 'analysis_bytes_in_flight', 'analysis_push_bytes_sent'
-            ]
-
-        if 'TCP' in packet:
-            packet_data.update({
-                **{f'tcp_{field}': getattr(packet.tcp, field) if hasattr(packet.tcp, field) else '' for field in tcp_fields}
-            })
-        else:
-            packet_data.update({
-                **{f'tcp_{field}': None for field in tcp_fields}
-            })
-
-        # Extract UDP fields from the packet into the dictionary
-        udp_fields = [
-            'srcport', 'dstport', 'port', 'length', 'checksum', 'checksum_status', 'stream',
-            'time_relative', 'time_delta'
-            ]
-
-        if 'UDP' in packet:
-            packet_data.update({
-                **{f'udp_{field}': getattr(packet.udp, field) if hasattr(packet.udp, field) else '' for field in udp_fields}
-            })
-        else:
-            packet_data.update({
-                **{f'udp_{field}': None for field in udp_fields}
-            })
-
-        # Extract ETH fields from the packet into the dictionary
-        eth_fields = [
-            'dst', 'dst_resolved', 'dst_oui', 'dst_oui_resolved', 'addr', 'addr_resolved', 'addr_oui',
-            'addr_oui_resolved', 'dst_lg', 'lg', 'dst_ig', 'ig', 'src', 'src_resolved', 'src_oui',
-            'src_oui_resolved', 'src_lg', 'src_ig', 'type'
-            ]
-
-        if 'ETH' in packet:
-            packet_data.update({
-                **{f'eth_{field}': getattr(packet.eth, field) if hasattr(packet.eth, field) else '' for field in eth_fields}
-            })
-        else:
-            packet_data.update({
-                **{f'eth_{field}': None for field in eth_fields}
-            })
-
-        # Extract ICMP fields from the packet into the dictionary
-        icmp_fields = [
-            'type', 'code', 'checksum', 'checksum_status', 'ident', 'ident_le', 'seq',
-            'seq_le', 'data_len'
-            ]
-
-        if 'ICMP' in packet:
-            packet_data.update({
-                **{f'icmp_{field}': getattr(packet.icmp, field) if hasattr(packet.icmp, field) else '' for field in icmp_fields}
-            })
-        else:
-            packet_data.update({
-                **{f'icmp_{field}': None for field in icmp_fields}
-            })
-
-        # Extract ARP fields from the packet into the dictionary
-        arp_fields = [
-            'hw_type', 'proto_type', 'hw_size', 'proto_size', 'opcode', 'src_hw_mac',
-            'src_proto_ipv4', 'dst_hw_mac', 'dst_proto_ipv4'
-            ]
-
-        if 'ARP' in packet:
-            packet_data.update({
-                **{f'arp_{field}': getattr(packet.arp, field) if hasattr(packet.arp, field) else '' for field in arp_fields}
-            })
-        else:
-            packet_data.update({
-                **{f'arp_{field}': None for field in arp_fields}
-            })
-
-        # convert dictionary to dataframe
-        df = pd.DataFrame(packet_data, index=[0])
-        yield df
-
-    # Close the capture session
-    capture.close()
+
+def batches_to_frame(batches) -> DataFrame:
+    """Assemble record batches from `pcap_stream` into a single DataFrame.
+
+    Column values are kept as the Python objects the engine produced, so the
+    frame holds the same values (and writes the same csv) as concatenating the
+    single row DataFrames.
+
+    Args:
+        batches (Iterable[dict]): {column: [values]} record batches
+
+    Returns:
+        DataFrame: Packet fields, one row per packet
+    """
+    columns = {column: [] for column in PACKET_COLUMNS}
+    for batch in batches:
+        for column, values in batch.items():
+            columns[column].extend(values)
+
+    return pd.DataFrame(columns, dtype=object)
 
 # ----------------------------------------------------------------
 # # Demo
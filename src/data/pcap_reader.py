@@ -0,0 +1,597 @@
+"""
+This module is used to read packet data from pcap and pcapng files without tshark.
+
+Parses the pcap/pcapng global and record headers and decodes the
+Ethernet/IPv4/TCP/UDP/ICMP/ARP headers of each packet directly into the same
+`ip_*`, `tcp_*`, `udp_*`, `eth_*`, `icmp_*` and `arp_*` columns produced by the
+pyshark engine.
+
+"""
+
+import struct
+from typing import BinaryIO, Iterator, Tuple
+
+
+# Packet fields per protocol layer (same order as the pyshark engine)
+IP_FIELDS = [
+    'version', 'hdr_len', 'dsfield', 'dsfield_dscp', 'dsfield_ecn', 'len', 'id', 'flags',
+    'flags_rb', 'flags_df', 'flags_mf', 'frag_offset', 'ttl', 'proto', 'checksum',
+    'checksum_status', 'src', 'addr', 'src_host', 'host', 'dst', 'dst_host'
+    ]
+
+TCP_FIELDS = [
+    'srcport', 'dstport', 'port', 'stream', 'completeness', 'len', 'seq', 'seq_raw',
+    'nxtseq', 'ack', 'ack_raw', 'hdr_len', 'flags', 'flags_res', 'flags_ae', 'flags_cwr',
+    'flags_ece', 'flags_urg', 'flags_ack', 'flags_push', 'flags_reset', 'flags_syn',
+    'flags_fin', 'flags_str', 'window_size_value', 'window_size', 'window_size_scalefactor',
+    'checksum', 'checksum_status', 'urgent_pointer', '', 'time_relative', 'time_delta',
+    'analysis', 'analysis_bytes_in_flight', 'analysis_push_bytes_sent'
+    ]
+
+UDP_FIELDS = [
+    'srcport', 'dstport', 'port', 'length', 'checksum', 'checksum_status', 'stream',
+    'time_relative', 'time_delta'
+    ]
+
+ETH_FIELDS = [
+    'dst', 'dst_resolved', 'dst_oui', 'dst_oui_resolved', 'addr', 'addr_resolved', 'addr_oui',
+    'addr_oui_resolved', 'dst_lg', 'lg', 'dst_ig', 'ig', 'src', 'src_resolved', 'src_oui',
+    'src_oui_resolved', 'src_lg', 'src_ig', 'type'
+    ]
+
+ICMP_FIELDS = [
+    'type', 'code', 'checksum', 'checksum_status', 'ident', 'ident_le', 'seq',
+    'seq_le', 'data_len'
+    ]
+
+ARP_FIELDS = [
+    'hw_type', 'proto_type', 'hw_size', 'proto_size', 'opcode', 'src_hw_mac',
+    'src_proto_ipv4', 'dst_hw_mac', 'dst_proto_ipv4'
+    ]
+
+LAYER_FIELDS = {
+    'ip': IP_FIELDS, 'tcp': TCP_FIELDS, 'udp': UDP_FIELDS,
+    'eth': ETH_FIELDS, 'icmp': ICMP_FIELDS, 'arp': ARP_FIELDS
+    }
+
+# All packet columns in the order they are written to csv
+PACKET_COLUMNS = ['timestamp'] + [f'{layer}_{field}'
+                                  for layer, fields in LAYER_FIELDS.items()
+                                  for field in fields]
+
+# Link-layer header types
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = (101, 228)
+
+# Record headers
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6), b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9), b'\xa1\xb2\x3c\x4d': ('>', 1e-9)
+    }
+PCAPNG_SHB = b'\x0a\x0d\x0d\x0a'
+
+# TCP flag characters as shown by tshark in `tcp.flags.str`
+TCP_FLAG_CHARS = 'RRRACEUAPRSF'
+
+# tshark value of `*.checksum.status` when checksum validation is disabled
+CHECKSUM_UNVERIFIED = 2
+
+
+def read_pcap(fileobj: BinaryIO) -> Iterator[Tuple[float, int, bytes]]:
+    """Yield raw packet records from an open pcap or pcapng file.
+
+    Args:
+        fileobj (BinaryIO): File opened in binary mode
+
+    Raises:
+        ValueError: If the file is neither pcap nor pcapng
+
+    Yields:
+        Iterator[Tuple[float, int, bytes]]: timestamp (s), link-layer type, packet bytes
+    """
+    magic = fileobj.read(4)
+    if magic in PCAP_MAGIC:
+        yield from _read_pcap_records(fileobj, magic)
+    elif magic == PCAPNG_SHB:
+        yield from _read_pcapng_blocks(fileobj, magic)
+    else:
+        raise ValueError(f"Unrecognized capture file format (magic: {magic.hex()})")
+
+
+def _read_pcap_records(fileobj: BinaryIO, magic: bytes) -> Iterator[Tuple[float, int, bytes]]:
+    """Yield records of a classic pcap file after its magic number has been read.
+    """
+    endian, resolution = PCAP_MAGIC[magic]
+    header = fileobj.read(20)
+    if len(header) < 20:
+        return
+    linktype = struct.unpack(endian+'HHiIII', header)[5] & 0x0FFFFFFF
+
+    record_header = struct.Struct(endian+'IIII')
+    while True:
+        rec = fileobj.read(16)
+        if len(rec) < 16:
+            return
+        ts_sec, ts_frac, incl_len, _ = record_header.unpack(rec)
+        data = fileobj.read(incl_len)
+        if len(data) < incl_len:
+            return
+        if resolution == 1e-6:
+            timestamp = ts_sec + ts_frac / 1e6
+        else:
+            # Match datetime's microsecond precision used by the pyshark engine
+            timestamp = ts_sec + round(ts_frac / 1e3) / 1e6
+        yield timestamp, linktype, data
+
+
+def _read_pcapng_blocks(fileobj: BinaryIO, magic: bytes) -> Iterator[Tuple[float, int, bytes]]:
+    """Yield packets of a pcapng file after the first block type has been read.
+    """
+    endian = '<'
+    interfaces = []
+    block_type = magic
+
+    while True:
+        # Block total length (byte order is only known after the SHB body)
+        raw_len = fileobj.read(4)
+        if len(raw_len) < 4:
+            return
+
+        if block_type == PCAPNG_SHB:
+            bom = fileobj.read(4)
+            endian = '<' if bom == b'\x4d\x3c\x2b\x1a' else '>'
+            block_len = struct.unpack(endian+'I', raw_len)[0]
+            if block_len < 12:
+                return
+            body = bom + fileobj.read(block_len - 12)
+            # A new section resets the interface list
+            interfaces = []
+        else:
+            block_len = struct.unpack(endian+'I', raw_len)[0]
+            if block_len < 12:
+                return
+            body = fileobj.read(block_len - 8)
+        if len(body) < block_len - 8:
+            return
+
+        btype = struct.unpack(endian+'I', block_type)[0]
+        if btype == 1:
+            # Interface Description Block
+            linktype = struct.unpack(endian+'H', body[:2])[0]
+            interfaces.append((linktype, _pcapng_tsresol(body[8:-4], endian)))
+        elif btype == 6:
+            # Enhanced Packet Block
+            if_id, ts_high, ts_low, cap_len, _ = struct.unpack(endian+'IIIII', body[:20])
+            linktype, resolution = interfaces[if_id]
+            ticks = (ts_high << 32) | ts_low
+            yield _ticks_to_seconds(ticks, resolution), linktype, body[20:20+cap_len]
+        elif btype == 3:
+            # Simple Packet Block (no timestamp)
+            linktype, _ = interfaces[0]
+            orig_len = struct.unpack(endian+'I', body[:4])[0]
+            cap_len = min(orig_len, block_len - 16)
+            yield 0.0, linktype, body[4:4+cap_len]
+        elif btype == 2:
+            # Obsolete Packet Block
+            if_id, _, ts_high, ts_low, cap_len, _ = struct.unpack(endian+'HHIIII', body[:20])
+            linktype, resolution = interfaces[if_id]
+            ticks = (ts_high << 32) | ts_low
+            yield _ticks_to_seconds(ticks, resolution), linktype, body[20:20+cap_len]
+
+        block_type = fileobj.read(4)
+        if len(block_type) < 4:
+            return
+
+
+def _pcapng_tsresol(options: bytes, endian: str) -> Tuple[int, int]:
+    """Return the (base, exponent) timestamp resolution of an interface from its options.
+    """
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack(endian+'HH', options[offset:offset+4])
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            value = options[offset+4]
+            return (2, value & 0x7F) if value & 0x80 else (10, value)
+        offset += 4 + ((length + 3) & ~3)
+    return 10, 6
+
+
+def _ticks_to_seconds(ticks: int, resolution: Tuple[int, int]) -> float:
+    """Convert pcapng timestamp ticks to seconds rounded to microseconds.
+    """
+    base, exponent = resolution
+    seconds, remainder = divmod(ticks, base ** exponent)
+    if (base, exponent) == (10, 6):
+        return seconds + remainder / 1e6
+    return seconds + round(remainder * 1e6 / base ** exponent) / 1e6
+
+
+def format_ip_flags(value) -> str:
+    """Format IPv4 flags the way they appear in the training data.
+
+    The training csv files hold `ip.flags` as the 3-bit flags field, e.g. '0x02'
+    for Don't Fragment, as printed by the tshark that produced them. Other tshark
+    versions print the flags in place within the header byte ('0x40') or the
+    16-bit flags and fragment offset word ('0x4000'); these are shifted back
+    so both engines write the same value whatever the installed tshark.
+
+    Args:
+        value: 3-bit flags as an int, or tshark's hex string of `ip.flags`
+
+    Returns:
+        str: Flags as '0x' and two hex digits, `value` unchanged if not a hex string
+    """
+    if not isinstance(value, int):
+        try:
+            value = int(str(value), 16)
+        except ValueError:
+            return value
+    if value > 0xFF:
+        value >>= 13
+    elif value > 0x07:
+        value >>= 5
+    return f'0x{value:02x}'
+
+
+def _mac(raw: bytes) -> str:
+    return ':'.join(f'{b:02x}' for b in raw)
+
+
+def _ipv4(raw: bytes) -> str:
+    return '.'.join(str(b) for b in raw)
+
+
+class PacketDecoder:
+    """Decode raw packets into flat dictionaries of pyshark-style fields.
+
+    Holds the per-conversation state (stream indices, initial sequence numbers,
+    window scaling, timing) needed for the fields tshark derives across packets.
+    Values that tshark prints as hex are kept as `0x` strings, addresses as
+    strings and everything else as numbers, which is how they read back from csv.
+
+    Fields without an equivalent outside tshark's dissectors are approximated:
+    `*_oui_resolved` are left empty (no manufacturer database), `*_resolved`
+    repeat the address, `tcp_completeness` is the bitmask of the conversation so
+    far and the name-less `tcp_` field holds tshark's 'Timestamps' text.
+    """
+
+    def __init__(self):
+        self.tcp_streams = {}
+        self.udp_streams = {}
+
+    def decode(self, timestamp: float, linktype: int, data: bytes) -> dict:
+        """Decode a single packet
+
+        Args:
+            timestamp (float): Capture time in seconds since the epoch
+            linktype (int): Link-layer header type of the capture interface
+            data (bytes): Captured packet bytes
+
+        Returns:
+            dict: Packet fields, `None` for absent layers and '' for absent fields
+        """
+        layers = {}
+
+        ethertype = None
+        payload = data
+        if linktype == LINKTYPE_ETHERNET and len(data) >= 14:
+            layers['eth'] = self._eth(data)
+            ethertype = struct.unpack('!H', data[12:14])[0]
+            payload = data[14:]
+            # Skip 802.1Q/802.1ad tags
+            while ethertype in (0x8100, 0x88A8) and len(payload) >= 4:
+                ethertype = struct.unpack('!H', payload[2:4])[0]
+                payload = payload[4:]
+        elif linktype in LINKTYPE_RAW and data:
+            ethertype = 0x0800 if data[0] >> 4 == 4 else 0x86DD
+
+        transport = None
+        if ethertype == 0x0800 and len(payload) >= 20:
+            layers['ip'], proto, transport = self._ipv4(payload)
+        elif ethertype == 0x86DD and len(payload) >= 40:
+            proto, transport = payload[6], payload[40:]
+            src, dst = payload[8:24], payload[24:40]
+        elif ethertype == 0x0806 and len(payload) >= 28:
+            layers['arp'] = self._arp(payload)
+
+        if transport is not None:
+            if 'ip' in layers:
+                src, dst = layers['ip']['src'], layers['ip']['dst']
+            if proto == 6 and len(transport) >= 20:
+                layers['tcp'] = self._tcp(timestamp, src, dst, transport, layers.get('ip'))
+            elif proto == 17 and len(transport) >= 8:
+                layers['udp'] = self._udp(timestamp, src, dst, transport)
+            elif proto == 1 and 'ip' in layers and len(transport) >= 4:
+                layers['icmp'] = self._icmp(transport)
+
+        packet_data = {'timestamp': timestamp}
+        for layer, fields in LAYER_FIELDS.items():
+            values = layers.get(layer)
+            if values is None:
+                packet_data.update({f'{layer}_{field}': None for field in fields})
+            else:
+                packet_data.update({f'{layer}_{field}': values.get(field, '') for field in fields})
+
+        return packet_data
+
+    def _eth(self, data: bytes) -> dict:
+        dst, src = _mac(data[0:6]), _mac(data[6:12])
+        dst_oui = int.from_bytes(data[0:3], 'big')
+        src_oui = int.from_bytes(data[6:9], 'big')
+        dst_lg, dst_ig = (data[0] >> 1) & 1, data[0] & 1
+        src_lg, src_ig = (data[6] >> 1) & 1, data[6] & 1
+        return {
+            'dst': dst, 'dst_resolved': dst, 'dst_oui': dst_oui,
+            'addr': dst, 'addr_resolved': dst, 'addr_oui': dst_oui,
+            'dst_lg': dst_lg, 'lg': dst_lg, 'dst_ig': dst_ig, 'ig': dst_ig,
+            'src': src, 'src_resolved': src, 'src_oui': src_oui,
+            'src_lg': src_lg, 'src_ig': src_ig,
+            'type': f'0x{struct.unpack("!H", data[12:14])[0]:04x}'
+            }
+
+    def _ipv4(self, payload: bytes):
+        (ver_ihl, tos, total_len, ident, frag,
+         ttl, proto, checksum) = struct.unpack('!BBHHHBBH', payload[:12])
+        hdr_len = (ver_ihl & 0x0F) * 4
+        src, dst = _ipv4(payload[12:16]), _ipv4(payload[16:20])
+        flags = frag >> 13
+        frag_offset = frag & 0x1FFF
+        fields = {
+            'version': ver_ihl >> 4, 'hdr_len': hdr_len,
+            'dsfield': f'0x{tos:02x}', 'dsfield_dscp': tos >> 2, 'dsfield_ecn': tos & 0x03,
+            'len': total_len, 'id': f'0x{ident:04x}', 'flags': format_ip_flags(flags),
+            'flags_rb': (flags >> 2) & 1, 'flags_df': (flags >> 1) & 1, 'flags_mf': flags & 1,
+            'frag_offset': frag_offset, 'ttl': ttl, 'proto': proto,
+            'checksum': f'0x{checksum:04x}', 'checksum_status': CHECKSUM_UNVERIFIED,
+            'src': src, 'addr': src, 'src_host': src, 'host': src,
+            'dst': dst, 'dst_host': dst
+            }
+        # Only the first fragment carries the transport header
+        transport = payload[hdr_len:total_len] if frag_offset == 0 else None
+        return fields, proto, transport
+
+    def _arp(self, payload: bytes) -> dict:
+        hw_type, proto_type, hw_size, proto_size, opcode = struct.unpack('!HHBBH', payload[:8])
+        fields = {
+            'hw_type': hw_type, 'proto_type': f'0x{proto_type:04x}',
+            'hw_size': hw_size, 'proto_size': proto_size, 'opcode': opcode
+            }
+        if hw_size == 6 and proto_size == 4:
+            fields.update({
+                'src_hw_mac': _mac(payload[8:14]), 'src_proto_ipv4': _ipv4(payload[14:18]),
+                'dst_hw_mac': _mac(payload[18:24]), 'dst_proto_ipv4': _ipv4(payload[24:28])
+                })
+        return fields
+
+    def _icmp(self, transport: bytes) -> dict:
+        icmp_type, code, checksum = struct.unpack('!BBH', transport[:4])
+        fields = {
+            'type': icmp_type, 'code': code,
+            'checksum': f'0x{checksum:04x}', 'checksum_status': CHECKSUM_UNVERIFIED
+            }
+        # Echo request/reply
+        if icmp_type in (0, 8) and len(transport) >= 8:
+            fields.update({
+                'ident': struct.unpack('!H', transport[4:6])[0],
+                'ident_le': struct.unpack('<H', transport[4:6])[0],
+                'seq': struct.unpack('!H', transport[6:8])[0],
+                'seq_le': struct.unpack('<H', transport[6:8])[0],
+                'data_len': len(transport) - 8
+                })
+        return fields
+
+    def _conversation(self, streams: dict, timestamp: float, src, dst, srcport: int, dstport: int):
+        """Return (stream state, direction) of a conversation, creating it on first sight.
+        """
+        key = (src, srcport, dst, dstport)
+        reverse = (dst, dstport, src, srcport)
+        if key in streams:
+            return streams[key], 0
+        if reverse in streams:
+            return streams[reverse], 1
+        state = {
+            'index': len(streams), 'first': timestamp, 'last': timestamp,
+            'isn': [None, None], 'scale': [None, None], 'acked': [None, None],
+            'push': [0, 0], 'completeness': 0
+            }
+        streams[key] = state
+        return state, 0
+
+    def _tcp(self, timestamp: float, src, dst, transport: bytes, ip: dict) -> dict:
+        (srcport, dstport, seq_raw, ack_raw,
+         off_flags, window, checksum, urgent) = struct.unpack('!HHIIHHHH', transport[:20])
+        hdr_len = (off_flags >> 12) * 4
+        flags = off_flags & 0x0FFF
+        if ip is not None:
+            seg_len = max(ip['len'] - ip['hdr_len'] - hdr_len, 0)
+        else:
+            seg_len = max(len(transport) - hdr_len, 0)
+
+        syn, fin, rst, ack = flags & 0x02, flags & 0x01, flags & 0x04, flags & 0x10
+        state, direction = self._conversation(self.tcp_streams, timestamp, src, dst, srcport, dstport)
+        peer = 1 - direction
+
+        # Relative sequence numbers are based on the first segment seen per direction
+        if state['isn'][direction] is None or syn:
+            state['isn'][direction] = seq_raw
+        if ack and state['isn'][peer] is None:
+            state['isn'][peer] = (ack_raw - 1) & 0xFFFFFFFF
+        seq = (seq_raw - state['isn'][direction]) & 0xFFFFFFFF
+        nxtseq = (seq + seg_len + (1 if syn else 0) + (1 if fin else 0)) & 0xFFFFFFFF
+        rel_ack = (ack_raw - state['isn'][peer]) & 0xFFFFFFFF if ack else 0
+
+        # Window scaling is negotiated by the window scale option on SYN segments
+        if syn:
+            state['scale'][direction] = _tcp_window_shift(transport[20:hdr_len])
+        if syn:
+            window_size, scalefactor = window, ''
+        elif state['scale'][0] is None and state['scale'][1] is None:
+            window_size, scalefactor = window, -1
+        elif state['scale'][direction] is None or state['scale'][peer] is None:
+            window_size, scalefactor = window, -2
+        else:
+            scalefactor = 1 << state['scale'][direction]
+            window_size = window * scalefactor
+
+        state['completeness'] |= (
+            (1 if syn and not ack else 0) | (2 if syn and ack else 0) |
+            (4 if ack and not syn else 0) | (8 if seg_len else 0) |
+            (16 if fin else 0) | (32 if rst else 0)
+            )
+
+        fields = {
+            'srcport': srcport, 'dstport': dstport, 'port': srcport,
+            'stream': state['index'], 'completeness': state['completeness'],
+            'len': seg_len, 'seq': seq, 'seq_raw': seq_raw, 'nxtseq': nxtseq,
+            'ack': rel_ack, 'ack_raw': ack_raw, 'hdr_len': hdr_len,
+            'flags': f'0x{flags:04x}', 'flags_res': (flags >> 9) & 0x07,
+            'flags_ae': (flags >> 8) & 1, 'flags_cwr': (flags >> 7) & 1,
+            'flags_ece': (flags >> 6) & 1, 'flags_urg': (flags >> 5) & 1,
+            'flags_ack': (flags >> 4) & 1, 'flags_push': (flags >> 3) & 1,
+            'flags_reset': (flags >> 2) & 1, 'flags_syn': (flags >> 1) & 1,
+            'flags_fin': flags & 1,
+            'flags_str': ''.join(c if flags & (1 << (11 - i)) else '·'
+                                 for i, c in enumerate(TCP_FLAG_CHARS)),
+            'window_size_value': window, 'window_size': window_size,
+            'window_size_scalefactor': scalefactor,
+            'checksum': f'0x{checksum:04x}', 'checksum_status': CHECKSUM_UNVERIFIED,
+            'urgent_pointer': urgent, '': 'Timestamps',
+            'time_relative': round(timestamp - state['first'], 9),
+            'time_delta': round(timestamp - state['last'], 9),
+            }
+
+        # SEQ/ACK analysis for segments carrying data
+        if ack:
+            state['acked'][peer] = rel_ack
+        if seg_len:
+            state['push'][direction] += seg_len
+            acked = state['acked'][direction] or 0
+            fields.update({
+                'analysis': 'SEQ/ACK analysis',
+                'analysis_bytes_in_flight': (nxtseq - acked) & 0xFFFFFFFF
+                })
+            if flags & 0x08:
+                fields['analysis_push_bytes_sent'] = state['push'][direction]
+                state['push'][direction] = 0
+
+        state['last'] = timestamp
+        return fields
+
+    def _udp(self, timestamp: float, src, dst, transport: bytes) -> dict:
+        srcport, dstport, length, checksum = struct.unpack('!HHHH', transport[:8])
+        state, _ = self._conversation(self.udp_streams, timestamp, src, dst, srcport, dstport)
+        fields = {
+            'srcport': srcport, 'dstport': dstport, 'port': srcport, 'length': length,
+            'checksum': f'0x{checksum:04x}',
+            # tshark reports a zero UDP checksum as "not present"
+            'checksum_status': CHECKSUM_UNVERIFIED if checksum else 3,
+            'stream': state['index'],
+            'time_relative': round(timestamp - state['first'], 9),
+            'time_delta': round(timestamp - state['last'], 9)
+            }
+        state['last'] = timestamp
+        return fields
+
+
+def _tcp_window_shift(options: bytes):
+    """Return the window scale shift of a SYN segment's options, or None if absent.
+    """
+    offset = 0
+    while offset < len(options):
+        kind = options[offset]
+        if kind == 0:
+            break
+        if kind == 1:
+            offset += 1
+            continue
+        if offset + 1 >= len(options):
+            break
+        length = options[offset+1]
+        if kind == 3 and length == 3 and offset + 2 < len(options):
+            return min(options[offset+2], 14)
+        if length < 2:
+            break
+        offset += length
+    return None
+
+
+def native_packets(PCAPNG_FILE: str) -> Iterator[dict]:
+    """Yield decoded packets of a PCAP or PCAPNG file as dictionaries.
+
+    Args:
+        PCAPNG_FILE (str): PCAP or PCAPNG file to be read
+
+    Yields:
+        Iterator[dict]: Packet fields keyed by `PACKET_COLUMNS`
+    """
+    decoder = PacketDecoder()
+    with open(PCAPNG_FILE, 'rb') as f:
+        for timestamp, linktype, data in read_pcap(f):
+            yield decoder.decode(timestamp, linktype, data)
+
+
+def pyshark_packets(PCAPNG_FILE: str) -> Iterator[dict]:
+    """Yield packets of a PCAP or PCAPNG file as dictionaries using pyshark.
+
+    Starts a tshark subprocess through `pyshark.FileCapture` and reads every
+    field listed in `LAYER_FIELDS` from the dissected packet layers. `ip_flags`
+    is normalized with `format_ip_flags`, as its format depends on the tshark version.
+
+    Args:
+        PCAPNG_FILE (str): PCAP or PCAPNG file to be read
+
+    Yields:
+        Iterator[dict]: Packet fields keyed by `PACKET_COLUMNS`
+    """
+    import pyshark
+
+    # Open the pcapng file using FileCapture
+    capture = pyshark.FileCapture(PCAPNG_FILE, keep_packets=False)
+
+    try:
+        for packet in capture:
+            packet_data = {'timestamp': packet.sniff_time.timestamp()}
+
+            # Extract each layer's fields from the packet into the dictionary
+            for layer, fields in LAYER_FIELDS.items():
+                if layer.upper() in packet:
+                    packet_layer = getattr(packet, layer)
+                    packet_data.update({
+                        f'{layer}_{field}': getattr(packet_layer, field) if hasattr(packet_layer, field) else ''
+                        for field in fields
+                        })
+                else:
+                    packet_data.update({f'{layer}_{field}': None for field in fields})
+
+            if packet_data['ip_flags']:
+                packet_data['ip_flags'] = format_ip_flags(packet_data['ip_flags'])
+
+            yield packet_data
+    finally:
+        # Close the capture session
+        capture.close()
+
+
+# Available packet parsing engines
+ENGINES = {'pyshark': pyshark_packets, 'native': native_packets}
+
+
+def read_packets(PCAPNG_FILE: str, engine: str = 'pyshark') -> Iterator[dict]:
+    """Yield packets of a PCAP or PCAPNG file as dictionaries with the chosen engine.
+
+    Args:
+        PCAPNG_FILE (str): PCAP or PCAPNG file to be read
+        engine (str, optional): 'pyshark' (tshark dissection) or 'native'
+                                (pure-Python header decoding). Defaults to 'pyshark'.
+
+    Raises:
+        ValueError: If the engine is unknown
+
+    Returns:
+        Iterator[dict]: Packet fields keyed by `PACKET_COLUMNS`
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown packet engine '{engine}', expected one of {list(ENGINES)}")
+    return ENGINES[engine](PCAPNG_FILE)
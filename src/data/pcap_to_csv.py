@@ -5,10 +5,10 @@ in chunks.
 """
 
 import re
-import pyshark
 import pandas as pd
 from pandas import DataFrame
 from tqdm import tqdm
+from src.data.pcap_reader import read_packets
 
 
 
@@ -17,10 +17,12 @@ def pcapng_to_csv(PCAPNG_FILE: str,
                   CSV_NAME: str=None,
                   BATCH_SIZE: int = 1000,
                   data_desc_path: str = './data/external/dataset_description.xlsx',
+                  engine: str = 'pyshark',
+                  return_df: bool = True,
                   ) -> DataFrame:
     """Convert PCAP or PCAPNG file to CSV file and return same as Pandas Dataframe.
 
-    Uses PyShark module to read PCAP file and then parses the specified fields to
+    Uses PyShark module (or the native pcap reader) to read PCAP file and then parses the specified fields to
     collect required data into Pandas DataFrame which is then saved to permanent
     memory in chunks to save working memory.
 
@@ -30,9 +32,12 @@ def pcapng_to_csv(PCAPNG_FILE: str,
         CSV_NAME (str, optional): Output CSV file name, uses PCAP file name with .csv extension if not provided. Defaults to None.
         BATCH_SIZE (int, optional): Number of packets to parse before dumping to memory. Defaults to 1000.
         data_desc_path (str, optional): Path to the dataset description file. Defaults to './data/external/dataset_description.xlsx'.
+        engine (str, optional): Packet parsing engine, 'pyshark' or 'native'. Defaults to 'pyshark'.
+        return_df (bool, optional): if False, does not read the CSV file back and returns its
+            path instead, keeping at most `BATCH_SIZE` packets in memory. Defaults to True.
 
     Returns:
-        DataFrame: DataFrame of parsed network packet data.
+        DataFrame: DataFrame of parsed network packet data (CSV file path if `return_df` is False).
     """        
     # Load data description
     data_description = pd.read_excel(data_desc_path, 
@@ -43,8 +48,8 @@ def pcapng_to_csv(PCAPNG_FILE: str,
     packets_list = []
     packets_df = pd.DataFrame()  # Initialize the final DataFrame
 
-    # Open the pcapng file using FileCapture
-    capture = pyshark.FileCapture(PCAPNG_FILE, keep_packets=False)
+    # Open the pcapng file with the selected engine
+    capture = read_packets(PCAPNG_FILE, engine)
 
     # Get pcapng filename
     file_name = re.search(r'([^/\\]+)\.\w+$', PCAPNG_FILE).group(1)
@@ -65,114 +70,13 @@ def pcapng_to_csv(PCAPNG_FILE: str,
     BATCH_COUNT = 0
 
     # Iterate over the packets
-    for packet in tqdm(capture, desc="Reading packets", unit=" packets", total=LIMIT):
+    for packet_data in tqdm(capture, desc="Reading packets", unit=" packets", total=LIMIT):
         if COUNT >= LIMIT:
             break
 
         # Increment the loop counter
         COUNT +=1
 
-        # Create empty packet dictionary
-        packet_data = {}
-
-        # Extract IP fields from the packet into the dictionary
-        ip_fields = [
-            'version', 'hdr_len', 'dsfield', 'dsfield_dscp', 'dsfield_ecn', 'len', 'id', 'flags',
-            'flags_rb', 'flags_df', 'flags_mf', 'frag_offset', 'ttl', 'proto', 'checksum',
-            'checksum_status', 'src', 'addr', 'src_host', 'host', 'dst', 'dst_host'
-            ]
-
-        if 'IP' in packet:
-            packet_data.update({
-                'timestamp': packet.sniff_time.timestamp(),
-                **{f'ip_{field}': getattr(packet.ip, field) if hasattr(packet.ip, field) else '' for field in ip_fields}
-            })
-        else:
-            packet_data.update({
-                'timestamp': packet.sniff_time.timestamp(),
-                **{f'ip_{field}': None for field in ip_fields}
-            })
-
-        # Extract TCP fields from the packet into the dictionary
-        tcp_fields = [
-            'srcport', 'dstport', 'port', 'stream', 'completeness', 'len', 'seq', 'seq_raw',
-            'nxtseq', 'ack', 'ack_raw', 'hdr_len', 'flags', 'flags_res', 'flags_ae', 'flags_cwr',
-            'flags_ece', 'flags_urg', 'flags_ack', 'flags_push', 'flags_reset', 'flags_syn',
-            'flags_fin', 'flags_str', 'window_size_value', 'window_size', 'window_size_scalefactor',
-            'checksum', 'checksum_status', 'urgent_pointer', '', 'time_relative', 'time_delta',
-            'analysis', 'analysis_bytes_in_flight', 'analysis_push_bytes_sent'
-            ]
-
-        if 'TCP' in packet:
-            packet_data.update({
-                **{f'tcp_{field}': getattr(packet.tcp, field) if hasattr(packet.tcp, field) else '' for field in tcp_fields}
-            })
-        else:
-            packet_data.update({
-                **{f'tcp_{field}': None for field in tcp_fields}
-            })
-
-        # Extract UDP fields from the packet into the dictionary
-        udp_fields = [
-            'srcport', 'dstport', 'port', 'length', 'checksum', 'checksum_status', 'stream',
-            'time_relative', 'time_delta'
-            ]
-
-        if 'UDP' in packet:
-            packet_data.update({
-                **{f'udp_{field}': getattr(packet.udp, field) if hasattr(packet.udp, field) else '' for field in udp_fields}
-            })
-        else:
-            packet_data.update({
-                **{f'udp_{field}': None for field in udp_fields}
-            })
-
-        # Extract ETH fields from the packet into the dictionary
-        eth_fields = [
-            'dst', 'dst_resolved', 'dst_oui', 'dst_oui_resolved', 'addr', 'addr_resolved', 'addr_oui',
-            'addr_oui_resolved', 'dst_lg', 'lg', 'dst_ig', 'ig', 'src', 'src_resolved', 'src_oui',
-            'src_oui_resolved', 'src_lg', 'src_ig', 'type'
-            ]
-
-        if 'ETH' in packet:
-            packet_data.update({
-                **{f'eth_{field}': getattr(packet.eth, field) if hasattr(packet.eth, field) else '' for field in eth_fields}
-            })
-        else:
-            packet_data.update({
-                **{f'eth_{field}': None for field in eth_fields}
-            })
-
-        # Extract ICMP fields from the packet into the dictionary
-        icmp_fields = [
-            'type', 'code', 'checksum', 'checksum_status', 'ident', 'ident_le', 'seq',
-            'seq_le', 'data_len'
-            ]
-
-        if 'ICMP' in packet:
-            packet_data.update({
-                **{f'icmp_{field}': getattr(packet.icmp, field) if hasattr(packet.icmp, field) else '' for field in icmp_fields}
-            })
-        else:
-            packet_data.update({
-                **{f'icmp_{field}': None for field in icmp_fields}
-            })
-
-        # Extract ARP fields from the packet into the dictionary
-        arp_fields = [
-            'hw_type', 'proto_type', 'hw_size', 'proto_size', 'opcode', 'src_hw_mac',
-            'src_proto_ipv4', 'dst_hw_mac', 'dst_proto_ipv4'
-            ]
-
-        if 'ARP' in packet:
-            packet_data.update({
-                **{f'arp_{field}': getattr(packet.arp, field) if hasattr(packet.arp, field) else '' for field in arp_fields}
-            })
-        else:
-            packet_data.update({
-                **{f'arp_{field}': None for field in arp_fields}
-            })
-
         # Append the dictionary to the list
         packets_list.append(packet_data)
 
@@ -201,13 +105,20 @@ def pcapng_to_csv(PCAPNG_FILE: str,
 
     # Save any remaining packets_df to a CSV file
     if not packets_df.empty:
-        packets_df.to_csv(CSV_FILE_PATH, index=False, header=False, mode='a')
-
-    packets_csv: pd.DataFrame = pd.read_csv(CSV_FILE_PATH)
+        if BATCH_COUNT == 0:
+            # Fewer packets than batch size: file has not been created yet
+            packets_df.to_csv(CSV_FILE_PATH, index=False, header=True, mode='w')
+        else:
+            packets_df.to_csv(CSV_FILE_PATH, index=False, header=False, mode='a')
 
     # Close the capture session
     capture.close()
-    
+
+    if not return_df:
+        return CSV_FILE_PATH
+
+    packets_csv: pd.DataFrame = pd.read_csv(CSV_FILE_PATH)
+
     return packets_csv
 
 # ----------------------------------------------------------------
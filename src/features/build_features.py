@@ -2,9 +2,11 @@
 Transform, encode and select features from dataset
 """
 
+import os
 import warnings
+from math import ceil
 import pandas as pd
-from pandas import DataFrame
+from pandas import DataFrame, Series
 import joblib
 import numpy as np
 from numpy import ndarray
@@ -12,6 +14,8 @@ from matplotlib import pyplot as plt
 import ipaddress
 from sklearn.preprocessing import OneHotEncoder
 from tqdm import tqdm
+from src.data.packet_schema import read_labelled_data
+from src.features.processed_data import save_processed, new_manifest, write_manifest, merge_shards, ShardWriter
 
 # Model and Optimization 
 from sklearn.preprocessing import StandardScaler, Normalizer, MinMaxScaler
@@ -69,22 +73,44 @@ def get_features(data: DataFrame, optimal_features: list, train: bool=True) -> D
         return data_optimal_features
 
 
-def label_data(data: DataFrame, column: str, label_mapping: dict) -> DataFrame:
+def label_data(data: DataFrame, column: str, label_mapping: dict, engine: str='vectorized') -> DataFrame:
     """
     Labels specified column in dataset based on mapping provided
 
+    The vectorized engine looks every value up at once in an index of the
+    mapping keys, works with any DataFrame index and checks all labels
+    before changing the data.
+
     Args:
-        data (DataFrame): _description_
-        column (str): _description_
-        label_mapping (dict): _description_
+        data (DataFrame): Dataset to be labelled
+        column (str): Column holding the string labels
+        label_mapping (dict): str to int dictionary for label encoding
+        engine (str, optional): 'vectorized' maps the column at once, 'python' walks
+                                every row. Both give identical outputs. Defaults to 'vectorized'.
+
+    Raises:
+        ValueError: If the column holds labels missing from `label_mapping`
 
     Returns:
         DataFrame: Dataset with `int` encoded label column
     """    
+    if engine == 'vectorized':
+        labels = data[column]
+        codes = pd.Index(list(label_mapping)).get_indexer(labels)
+        unknown = codes < 0
+        if unknown.any():
+            raise ValueError(f"Unknown labels in column '{column}': "
+                             f"{sorted(map(str, labels[unknown].unique()))}")
+        encoded = np.fromiter(label_mapping.values(), dtype='int64', count=len(label_mapping))
+        data[column] = encoded[codes]
+
+        return data
 
     progress_bar = tqdm(total=len(data), desc='Label Encoding', unit=" rows")
 
-    for i, value in enumerate(data[column]):
+    for i, value in data[column].items():
+        if value not in label_mapping:
+            raise ValueError(f"Unknown label in column '{column}': {value}")
         data.at[i, column] = label_mapping[value]
         progress_bar.update(1)
 
@@ -95,7 +121,71 @@ def label_data(data: DataFrame, column: str, label_mapping: dict) -> DataFrame:
     return data
 
 
-def undersample_data(data: DataFrame, label_column: str) -> DataFrame:
+def _undersample_targets(value_counts: Series) -> dict:
+    """Number of data points kept for each label by `undersample_data`.
+
+    Args:
+        value_counts (Series): Count of each label
+
+    Returns:
+        dict: Label to number of data points kept
+    """
+    mean_count = value_counts.mean()
+    total_count = value_counts.sum()
+
+    return {value: int((count / total_count) * mean_count) if count > mean_count else int(count)
+            for value, count in value_counts.items()}
+
+
+def _approximate_mode(class_counts: ndarray, n_draws: int, rng: np.random.RandomState) -> ndarray:
+    # Per-class counts of `n_draws` rows allocated as `StratifiedShuffleSplit` does:
+    # proportional counts rounded down, then one more row for the classes with the
+    # largest remainders, ties broken at random
+    continuous = class_counts / class_counts.sum() * n_draws
+    floored = np.floor(continuous)
+    need_to_add = int(n_draws - floored.sum())
+    if need_to_add > 0:
+        remainder = continuous - floored
+        for value in np.sort(np.unique(remainder))[::-1]:
+            (inds,) = np.where(remainder == value)
+            add_now = min(len(inds), need_to_add)
+            floored[rng.choice(inds, size=add_now, replace=False)] += 1
+            need_to_add -= add_now
+            if need_to_add == 0:
+                break
+    return floored.astype(int)
+
+
+def _split_targets(targets: dict, label_mapping: dict, test_size: float, random_state: int) -> dict:
+    """Number of data points of each label put in the test set by `split`.
+
+    Same allocation as `train_test_split(..., stratify=y)`: the test set holds
+    `ceil(test_size * n)` rows, spread over the labels in the same order
+    (sorted encoded labels) and with the same tie-breaking.
+
+    Args:
+        targets (dict): Label to number of data points kept by the undersampling
+        label_mapping (dict): str to int dictionary for label encoding
+        test_size (float): Share of the data points in the test set
+        random_state (int): Seed used by `train_test_split`
+
+    Returns:
+        dict: Label to number of data points in the test set
+    """
+    labels = sorted(targets, key=lambda value: label_mapping[value])
+    class_counts = np.array([targets[value] for value in labels])
+    n_samples = int(class_counts.sum())
+    n_test = ceil(test_size * n_samples)
+    rng = np.random.RandomState(random_state)
+    train_counts = _approximate_mode(class_counts, n_samples - n_test, rng)
+    test_counts = _approximate_mode(class_counts - train_counts, n_test, rng)
+    return dict(zip(labels, test_counts.tolist()))
+
+
+def undersample_data(data: DataFrame,
+                     label_column: str,
+                     engine: str='vectorized',
+                     random_state: int=42) -> DataFrame:
     """Undersample data points with label count greater than the mean label count of the dataset.
 
     Undersampling Strategy:
@@ -105,13 +195,38 @@ def undersample_data(data: DataFrame, label_column: str) -> DataFrame:
     trimming all oversampled points to a fixed number, thus retaining the underlying
     difference in frequency, but still preventing excessive skew in distribution.
 
+    The vectorized engine groups the rows by label once, draws the row numbers
+    to keep with a seeded generator and gathers them, shuffled, in a single take.
+    For datasets that do not fit in memory, see `reservoir_undersample`.
+
     Args:
         data (DataFrame): DataFrame to be undersampled
         label_column (str): Column holding the labels
+        engine (str, optional): 'vectorized' samples row numbers, 'python' filters and
+                                concatenates a DataFrame per label. Both keep the same
+                                number of points per label. Defaults to 'vectorized'.
+        random_state (int, optional): Seed of the sampling and shuffling. Defaults to 42.
 
     Returns:
         DataFrame: Undersampled DataFrame
     """    
+    if engine == 'vectorized':
+        rng = np.random.default_rng(random_state)
+        codes, uniques = pd.factorize(data[label_column])
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        targets = _undersample_targets(Series(counts, index=uniques))
+
+        # Row numbers grouped by label (missing labels, coded -1, sort first and are dropped)
+        order = np.argsort(codes, kind='stable')[np.count_nonzero(codes < 0):]
+        groups = np.split(order, np.cumsum(counts)[:-1])
+
+        selected = [rng.choice(rows, size=targets[value], replace=False) if targets[value] < len(rows) else rows
+                    for value, rows in zip(uniques, groups)]
+        rows = np.concatenate(selected) if selected else np.empty(0, dtype=np.intp)
+        rng.shuffle(rows)
+
+        return data.iloc[rows].reset_index(drop=True)
+
     value_counts = data[label_column].value_counts()
     mean_count = value_counts.mean()
 
@@ -120,23 +235,201 @@ def undersample_data(data: DataFrame, label_column: str) -> DataFrame:
     for value, count in value_counts.items():
         if count > mean_count:
             undersampled_count = int((count / value_counts.sum()) * mean_count)
-            subset = data[data[label_column] == value].sample(n=undersampled_count, random_state=42)
+            subset = data[data[label_column] == value].sample(n=undersampled_count, random_state=random_state)
             undersampled_data = pd.concat([undersampled_data, subset], ignore_index=True)
         else:
             subset = data[data[label_column] == value]
             undersampled_data = pd.concat([undersampled_data, subset], ignore_index=True)
 
     # Randomize the undersampled data
-    randomized_data = undersampled_data.sample(frac=1, random_state=42)
+    randomized_data = undersampled_data.sample(frac=1, random_state=random_state)
 
     return randomized_data
 
 
-def convert_to_float(data: DataFrame) -> DataFrame:
+def count_labels(chunks, label_column: str) -> Series:
+    """Count the labels of a dataset read in chunks, e.g. the first pass of
+    `reservoir_undersample`.
+
+    Args:
+        chunks (Iterable[DataFrame]): Chunks of the dataset (only `label_column` is needed)
+        label_column (str): Column holding the labels
+
+    Returns:
+        Series: Count of each label
+    """
+    value_counts = Series(dtype='int64')
+    for chunk in chunks:
+        value_counts = value_counts.add(chunk[label_column].value_counts(), fill_value=0)
+
+    return value_counts.astype('int64')
+
+
+def reservoir_undersample(chunks,
+                          label_column: str,
+                          value_counts: Series,
+                          random_state: int=42) -> DataFrame:
+    """Undersample a dataset read in chunks, with the strategy of `undersample_data`,
+    keeping in memory only the sampled data points.
+
+    Every row gets a random key and each label keeps the rows with the smallest
+    keys, which is a uniform sample without replacement. Rows that cannot make
+    it into a full sample are skipped without being copied.
+
+    Args:
+        chunks (Iterable[DataFrame]): Chunks of the dataset, e.g. from `pd.read_csv(..., chunksize=...)`
+        label_column (str): Column holding the labels
+        value_counts (Series): Count of each label in the whole dataset, see `count_labels`
+        random_state (int, optional): Seed of the sampling and shuffling. Defaults to 42.
+
+    Returns:
+        DataFrame: Undersampled DataFrame
+    """
+    rng = np.random.default_rng(random_state)
+    targets = _undersample_targets(value_counts)
+    # Label to [kept parts, keys of the parts, number of rows, largest key still accepted]
+    reservoirs = {value: [[], [], 0, 1.0] for value, target in targets.items() if target > 0}
+
+    def _compact(reservoir: list, target: int):
+        # Keep the `target` rows with the smallest keys
+        part = pd.concat(reservoir[0]) if len(reservoir[0]) > 1 else reservoir[0][0]
+        keys = np.concatenate(reservoir[1])
+        if len(keys) > target:
+            best = np.argpartition(keys, target - 1)[:target]
+            part, keys = part.iloc[best], keys[best]
+            reservoir[3] = keys.max()
+        reservoir[:3] = [[part], [keys], len(keys)]
+
+    for chunk in chunks:
+        keys = rng.random(len(chunk))
+        codes, uniques = pd.factorize(chunk[label_column])
+        for code, value in enumerate(uniques):
+            reservoir = reservoirs.get(value)
+            if reservoir is None:
+                continue
+            rows = np.flatnonzero((codes == code) & (keys < reservoir[3]))
+            if not len(rows):
+                continue
+            reservoir[0].append(chunk.iloc[rows])
+            reservoir[1].append(keys[rows])
+            reservoir[2] += len(rows)
+            if reservoir[2] > 2 * targets[value]:
+                _compact(reservoir, targets[value])
+
+    parts, part_keys = [], []
+    for value, reservoir in reservoirs.items():
+        if reservoir[2]:
+            _compact(reservoir, targets[value])
+            parts.extend(reservoir[0])
+            part_keys.extend(reservoir[1])
+    if not parts:
+        return DataFrame()
+
+    # Random keys give a random order of the sampled rows
+    order = np.argsort(np.concatenate(part_keys), kind='stable')
+
+    return pd.concat(parts).iloc[order].reset_index(drop=True)
+
+
+def _convert_value(value) -> float:
+    """Convert a single value to float.
+
+    NaN values become -3, numbers are cast to float, hexadecimal strings and
+    dotted-quad IP addresses are converted to int, strings of floats are cast
+    to float and any other text or type becomes -4.
+
+    Args:
+        value (Any): Value to be converted
+
+    Returns:
+        float: Converted value
+    """
+    if pd.isna(value):
+        return -3  # Assign -3 for NaN values
+    elif isinstance(value, (int, float)):
+        return float(value)  # Convert numbers to float
+    elif isinstance(value, str):
+        try:
+            if value.startswith('0x'):
+                return int(value, 16)  # Convert hexadecimal string to int
+            elif '.' in value:
+                parts = value.split('.')
+                if len(parts) == 4:
+                    ip = ipaddress.ip_address(value)
+                    return int(ip)  # Convert IP address to int
+                else:
+                    return float(value)  # Convert string representation of float to float
+            else:
+                return -4  # Assign -4 for regular text values
+        except ValueError:
+            return -4  # Assign -4 for text that cannot be converted
+        except ipaddress.AddressValueError:
+            return -4  # Assign -4 for invalid IP addresses
+    else:
+        return -4  # Assign -4 for other non-convertible values
+
+
+def _convert_column(column: Series) -> ndarray:
+    """Convert a whole column to float64 with the rules of `_convert_value`.
+
+    Numeric columns are cast directly. In object columns the elements are
+    split by type once; numbers are cast in bulk and strings are dictionary
+    encoded with `pd.factorize`, so each distinct string (packet fields repeat
+    heavily) is parsed only once and broadcast back with a single take.
+
+    Args:
+        column (Series): Column to be converted
+
+    Returns:
+        ndarray: float64 values of the column
+    """
+    if isinstance(column.dtype, np.dtype) and column.dtype.kind in 'biuf':
+        converted = column.to_numpy(dtype='float64', copy=True)
+        converted[np.isnan(converted)] = -3
+        return converted
+
+    if column.dtype == object:
+        values = column.to_numpy()
+    else:
+        # Extension dtypes: keep the element types seen when iterating the column
+        values = np.fromiter(column, dtype=object, count=len(column))
+    missing = pd.isna(values)
+    converted = np.full(len(values), -4, dtype='float64')
+    converted[missing] = -3
+
+    if pd.api.types.infer_dtype(values, skipna=True) == 'string':
+        strings = ~missing
+        numbers = None
+    else:
+        # Classify elements by their Python type (few distinct types per column)
+        type_codes, types = pd.factorize(np.frompyfunc(type, 1, 1)(values))
+        is_str = np.array([issubclass(t, str) for t in types], dtype=bool)
+        is_number = np.array([issubclass(t, (int, float)) for t in types], dtype=bool)
+        strings = is_str[type_codes] & ~missing if len(types) else ~missing
+        numbers = is_number[type_codes] & ~missing if len(types) else None
+
+    if numbers is not None and numbers.any():
+        converted[numbers] = values[numbers].astype('float64')
+
+    if strings.any():
+        codes, uniques = pd.factorize(values[strings])
+        table = np.array([_convert_value(value) for value in uniques], dtype='float64')
+        converted[strings] = table[codes]
+
+    return converted
+
+
+def convert_to_float(data: DataFrame, engine: str='vectorized', progress: bool=True) -> DataFrame:
     """Parse Dataframe columns and convert all values to float
 
+    NaN values become -3, hexadecimal strings and dotted-quad IP addresses are
+    converted to int and text that cannot be converted becomes -4.
+
     Args:
         data (DataFrame): DataFrame to be parsed
+        engine (str, optional): 'vectorized' converts column-wise, 'python' walks
+                                every cell. Both give identical outputs. Defaults to 'vectorized'.
+        progress (bool, optional): if False, hides the progress bar. Defaults to True.
 
     Returns:
         DataFrame: DataFrame with all columns as floats
@@ -144,11 +437,19 @@ def convert_to_float(data: DataFrame) -> DataFrame:
     if 'tcp_flags_str' in data.columns or 'tcp_flags_fin' in data.columns:
         # Drop the 'tcp_flags_str' and 'tcp_flags_fin' column
         data = data.drop(['tcp_flags_str', 'tcp_flags_fin'], axis=1)  
-    
+
+    if engine == 'vectorized':
+        converted = {col: _convert_column(data[col])
+                     for col in tqdm(data.columns, desc='Converting to float64', unit=' columns',
+                                     disable=not progress)}
+
+        return pd.DataFrame(converted, index=data.index, columns=data.columns)
+
     # Setup progress bar
     progress_bar = tqdm(total=(len(data.columns) * len(data)),
                         desc='Converting to float64',
-                        unit = ' data points')
+                        unit = ' data points',
+                        disable=not progress)
     
     for col in data.columns:
 
@@ -156,30 +457,7 @@ def convert_to_float(data: DataFrame) -> DataFrame:
         converted_values = []
 
         for value in data[col]:
-
-            if pd.isna(value):
-                converted_values.append(-3)  # Assign -3 for NaN values
-            elif isinstance(value, (int, float)):
-                converted_values.append(float(value))  # Convert numbers to float
-            elif isinstance(value, str):
-                try:
-                    if value.startswith('0x'):
-                        converted_values.append(int(value, 16))  # Convert hexadecimal string to int
-                    elif '.' in value:
-                        parts = value.split('.')
-                        if len(parts) == 4:
-                            ip = ipaddress.ip_address(value)
-                            converted_values.append(int(ip))  # Convert IP address to int
-                        else:
-                            converted_values.append(float(value))  # Convert string representation of float to float
-                    else:
-                        converted_values.append(-4)  # Assign -4 for regular text values
-                except ValueError:
-                    converted_values.append(-4)  # Assign -4 for text that cannot be converted
-                except ipaddress.AddressValueError:
-                    converted_values.append(-4)  # Assign -4 for invalid IP addresses
-            else:
-                converted_values.append(-4)  # Assign -4 for other non-convertible values
+            converted_values.append(_convert_value(value))
             
             # update progress bar
             progress_bar.update(1)
@@ -262,26 +540,26 @@ label_mapping: dict={
                     'mitm_arpspoofing':7, 'scanning_host':8, 'scanning_port':9, 'scanning_os':10
                     }
 
+# Model input features, in column order (shared by training and serving)
+OPTIMAL_FEATURES: list=[
+    'timestamp', 'ip_len', 'ip_id', 'ip_flags', 'ip_ttl', 'ip_proto',
+    'ip_checksum', 'ip_dst', 'ip_dst_host','tcp_srcport', 'tcp_dstport',
+    'tcp_port', 'tcp_stream', 'tcp_completeness', 'tcp_seq_raw', 'tcp_ack',
+    'tcp_ack_raw', 'tcp_flags_reset', 'tcp_flags_syn', 'tcp_window_size_value',
+    'tcp_window_size', 'tcp_window_size_scalefactor', 'tcp_', 'udp_srcport',
+    'udp_dstport', 'udp_port', 'udp_length', 'udp_time_delta', 'eth_dst_oui',
+    'eth_addr_oui', 'eth_dst_lg', 'eth_lg', 'eth_ig', 'eth_src_oui', 'eth_type',
+    'icmp_type', 'icmp_code', 'icmp_checksum', 'icmp_checksum_status', 'arp_opcode'
+    ]
+
 def preprocess(data: DataFrame,
                train: bool=True,
                save: bool=True,
                path: str = './data/processed/',
                label_col: str = 'label',
-               optimal_features: list=[
-                'timestamp', 'ip_len', 'ip_id', 'ip_flags', 'ip_ttl', 'ip_proto',
-                'ip_checksum', 'ip_dst', 'ip_dst_host','tcp_srcport', 'tcp_dstport',
-                'tcp_port', 'tcp_stream', 'tcp_completeness', 'tcp_seq_raw', 'tcp_ack',
-                'tcp_ack_raw', 'tcp_flags_reset', 'tcp_flags_syn', 'tcp_window_size_value',
-                'tcp_window_size', 'tcp_window_size_scalefactor', 'tcp_', 'udp_srcport',
-                'udp_dstport', 'udp_port', 'udp_length', 'udp_time_delta', 'eth_dst_oui',
-                'eth_addr_oui', 'eth_dst_lg', 'eth_lg', 'eth_ig', 'eth_src_oui', 'eth_type',
-                'icmp_type', 'icmp_code', 'icmp_checksum', 'icmp_checksum_status', 'arp_opcode'
-                ],
-                label_mapping: dict={
-                    'normal':0, 'dos_synflooding':1, 'mirai_ackflooding':2, 'host_discovery':3,
-                    'telnet_bruteforce':4, 'mirai_httpflooding':5, 'mirai_udpflooding':6,
-                    'mitm_arpspoofing':7, 'scanning_host':8, 'scanning_port':9, 'scanning_os':10
-                    }):
+               optimal_features: list=OPTIMAL_FEATURES,
+               label_mapping: dict=label_mapping,
+               fmt: str='npy'):
     """Pipeline to apply all preprocessing steps defined in `build_features` module to dataset.
 
     Extract optimal features from raw dataset, encode `str` labels to `int`, undersample imbalanced
@@ -295,8 +573,10 @@ def preprocess(data: DataFrame,
         save (bool, optional): if False, returns preprocessed data without dumping to memory. Defaults to True.
         path (str, optional): Path to save preprocessed data. Defaults to './data/processed/'.
         label_col (str, optional): Name of column with data label. Defaults to 'label'.
-        optimal_features (list, optional): List of features to be extracted from raw data. Defaults to predefined list.
-        label_mapping (_type_, optional): str to int dictionary for label encoding. Defaults to predefined dictionary.
+        optimal_features (list, optional): List of features to be extracted from raw data. Defaults to OPTIMAL_FEATURES.
+        label_mapping (_type_, optional): str to int dictionary for label encoding. Defaults to `label_mapping`.
+        fmt (str, optional): 'npy' saves memory-mappable `.npy` arrays with a `manifest.json`,
+                             'csv' saves text files. Defaults to 'npy'.
 
     Returns:
         X_train_scaled (NDArray), X_test_scaled (NDArray), y_train (DataFrame), y_test (DataFrame): if train==True
@@ -315,7 +595,14 @@ def preprocess(data: DataFrame,
 
         y_train = y_train.astype(int)
         y_test = y_test.astype(int)
-        if save==True:
+        if save==True and fmt=='npy':
+            save_processed(path,
+                           {'X_train_scaled': X_train_scaled,
+                            'X_test_scaled': X_test_scaled,
+                            'y_train': y_train.to_numpy(),
+                            'y_test': y_test.to_numpy()},
+                           features=list(X_train.columns))
+        elif save==True:
             np.savetxt(str(path+'X_train_scaled.csv'), X_train_scaled, delimiter=',')
             np.savetxt(str(path+'X_test_scaled.csv'), X_test_scaled, delimiter=',')
             y_train.to_csv(str(path+'y_train.csv'), index=False, header=True, mode='w')
@@ -331,7 +618,155 @@ def preprocess(data: DataFrame,
 
         return data
     
-def inference_preprocess(data: DataFrame) -> ndarray:
+def _sequential_sample(rng: np.random.Generator, size: int, remaining: int, needed: int) -> ndarray:
+    """Positions, among the next `size` of `remaining` items, of the items drawn by a
+    uniform sample of `needed` of the `remaining` items taken without replacement.
+
+    Called on consecutive blocks of a stream, it draws exactly `needed` items in
+    total while seeing one block at a time.
+    """
+    if needed <= 0 or size == 0:
+        return np.empty(0, dtype=np.intp)
+    if needed >= remaining:
+        return np.arange(size)
+    drawn = rng.hypergeometric(size, remaining - size, needed)
+    return np.sort(rng.choice(size, size=drawn, replace=False))
+
+
+def preprocess_out_of_core(paths: list,
+                           path: str = './data/processed/',
+                           label_col: str = 'label',
+                           optimal_features: list=OPTIMAL_FEATURES,
+                           label_mapping: dict=label_mapping,
+                           scaler_path: str = './src/features/scaler.pkl',
+                           chunksize: int=100_000,
+                           shard_rows: int=1_000_000,
+                           test_size: float=0.2,
+                           random_state: int=42,
+                           merge: bool=False) -> dict:
+    """Training preprocessing of `preprocess` for labelled csv files larger than memory.
+
+    Reads only the optimal features and label column, `chunksize` rows at a time,
+    in three passes over the files:
+
+    1. Count the labels to get the undersampling targets of `undersample_data`.
+    2. Draw the undersampled rows and their stratified train/test assignment as the
+       chunks stream by, encode labels, convert features to float, fit the scaler
+       with `StandardScaler.partial_fit` on the train rows and write both splits to
+       `.npy` shards (see `processed_data.ShardWriter`).
+    3. Scale the feature shards in place, block by block.
+
+    Memory use is bounded by the chunk size, whatever the size of the files.
+    The per-label counts of the undersample and of each split are the same as with
+    `preprocess` (see `_split_targets`); rows keep the order of the files instead
+    of being shuffled.
+
+    Args:
+        paths (list): Labelled csv files, e.g. from `load_n_filter.labelled_partitions`
+        path (str, optional): Path to save the shards and manifest. Defaults to './data/processed/'.
+        label_col (str, optional): Name of column with data label. Defaults to 'label'.
+        optimal_features (list, optional): List of features to be extracted from raw data. Defaults to OPTIMAL_FEATURES.
+        label_mapping (dict, optional): str to int dictionary for label encoding. Defaults to `label_mapping`.
+        scaler_path (str, optional): Path to save the fitted scaler. Defaults to './src/features/scaler.pkl'.
+        chunksize (int, optional): Rows read at a time. Defaults to 100_000.
+        shard_rows (int, optional): Rows per shard. Defaults to 1_000_000.
+        test_size (float, optional): Share of the rows in the test set. Defaults to 0.2.
+        random_state (int, optional): Seed of the sampling and split. Defaults to 42.
+        merge (bool, optional): if True, also concatenates the shards of each array into
+                                single `.npy` files, as written by `preprocess`. Defaults to False.
+
+    Raises:
+        ValueError: If the files hold labels missing from `label_mapping`, or no rows to train on
+
+    Returns:
+        dict: Manifest of the processed data, listing the shards of 'X_train_scaled',
+              'X_test_scaled', 'y_train' and 'y_test'
+    """
+    columns = list(optimal_features) + [label_col]
+
+    # Pass 1: label counts and number of rows kept per label in each split
+    value_counts = count_labels(read_labelled_data(paths, [label_col], chunksize), label_col)
+    label_data(DataFrame({label_col: value_counts.index}), label_col, label_mapping)
+    targets = _undersample_targets(value_counts)
+    test_targets = _split_targets(targets, label_mapping, test_size, random_state)
+    n_test = sum(test_targets.values())
+    n_train = sum(targets.values()) - n_test
+    if n_train == 0:
+        raise ValueError(f"No labelled rows to train on in {len(paths)} files")
+
+    # Pass 2: sample, split, convert, fit scaler, write unscaled shards
+    rng = np.random.default_rng(random_state)
+    # Label to [rows not seen yet, rows still to keep, kept rows still to put in test]
+    states = {value: [int(value_counts[value]), targets[value], test_targets[value]]
+              for value in targets}
+    n_features = len(optimal_features)
+    writers = {
+        'X_train_scaled': ShardWriter(path, 'X_train_scaled', n_train, n_features, np.float64, shard_rows),
+        'X_test_scaled': ShardWriter(path, 'X_test_scaled', n_test, n_features, np.float64, shard_rows),
+        'y_train': ShardWriter(path, 'y_train', n_train, None, np.int64, shard_rows),
+        'y_test': ShardWriter(path, 'y_test', n_test, None, np.int64, shard_rows)
+        }
+    scaler = StandardScaler()
+
+    progress_bar = tqdm(total=int(value_counts.sum()), desc='Preprocessing', unit=' rows')
+    for chunk in read_labelled_data(paths, columns, chunksize):
+        codes, uniques = pd.factorize(chunk[label_col])
+        train_rows, test_rows = [], []
+        for code, value in enumerate(uniques):
+            state = states[value]
+            rows = np.flatnonzero(codes == code)
+            kept = rows[_sequential_sample(rng, len(rows), state[0], state[1])]
+            in_test = np.zeros(len(kept), dtype=bool)
+            in_test[_sequential_sample(rng, len(kept), state[1], state[2])] = True
+            state[0] -= len(rows)
+            state[1] -= len(kept)
+            state[2] -= int(in_test.sum())
+            train_rows.append(kept[~in_test])
+            test_rows.append(kept[in_test])
+
+        for split_name, rows in (('train', train_rows), ('test', test_rows)):
+            rows = np.sort(np.concatenate(rows)) if rows else np.empty(0, dtype=np.intp)
+            if not len(rows):
+                continue
+            part = label_data(chunk.iloc[rows], label_col, label_mapping)
+            features = convert_to_float(part[optimal_features], progress=False)
+            if split_name == 'train':
+                scaler.partial_fit(features)
+            writers[f'X_{split_name}_scaled'].write(features.to_numpy(dtype=np.float64))
+            writers[f'y_{split_name}'].write(part[label_col].to_numpy(dtype=np.int64))
+        progress_bar.update(len(chunk))
+    progress_bar.close()
+
+    shards = {name: writer.close() for name, writer in writers.items()}
+    joblib.dump(scaler, scaler_path)
+
+    # Pass 3: scale feature shards in place, as `StandardScaler.transform` does
+    for name in ('X_train_scaled', 'X_test_scaled'):
+        for shard in shards[name]:
+            data = np.load(os.path.join(path, shard['file']), mmap_mode='r+')
+            for start in range(0, len(data), chunksize):
+                block = data[start:start+chunksize]
+                np.subtract(block, scaler.mean_, out=block)
+                np.divide(block, scaler.scale_, out=block)
+            data.flush()
+            del data
+
+    manifest = new_manifest(optimal_features, scaler_path)
+    manifest['shards'] = shards
+    write_manifest(path, manifest)
+
+    if merge:
+        for name in shards:
+            if shards[name]:
+                manifest = merge_shards(path, name)
+
+    return manifest
+
+
+def inference_preprocess(data: DataFrame,
+                         scaler: StandardScaler=None,
+                         progress: bool=True,
+                         features: list=OPTIMAL_FEATURES) -> ndarray:
     """Preprocessing pipeline for inference data.
 
     Extract optimal features, convert data to float and apply scaler 
@@ -339,24 +774,18 @@ def inference_preprocess(data: DataFrame) -> ndarray:
 
     Args:
         data (DataFrame): Data to be preprocessed
+        scaler (StandardScaler, optional): Fitted scaler, loaded from memory if None. Defaults to None.
+        progress (bool, optional): if False, hides the progress bar. Defaults to True.
+        features (list, optional): Model input features, in column order. Defaults to OPTIMAL_FEATURES.
 
     Returns:
         ndarray: Preprocessed data
     """    
-    optimal_features=[
-        'timestamp', 'ip_len', 'ip_id', 'ip_flags', 'ip_ttl', 'ip_proto',
-        'ip_checksum', 'ip_dst', 'ip_dst_host','tcp_srcport', 'tcp_dstport',
-        'tcp_port', 'tcp_stream', 'tcp_completeness', 'tcp_seq_raw', 'tcp_ack',
-        'tcp_ack_raw', 'tcp_flags_reset', 'tcp_flags_syn', 'tcp_window_size_value',
-        'tcp_window_size', 'tcp_window_size_scalefactor', 'tcp_', 'udp_srcport',
-        'udp_dstport', 'udp_port', 'udp_length', 'udp_time_delta', 'eth_dst_oui',
-        'eth_addr_oui', 'eth_dst_lg', 'eth_lg', 'eth_ig', 'eth_src_oui', 'eth_type',
-        'icmp_type', 'icmp_code', 'icmp_checksum', 'icmp_checksum_status', 'arp_opcode'
-        ]
-    scaler = joblib.load('./src/features/scaler.pkl')
-
-    data_optimal_features = data[optimal_features]
-    data_floats = convert_to_float(data_optimal_features)
+    if scaler is None:
+        scaler = joblib.load('./src/features/scaler.pkl')
+
+    data_optimal_features = data[features]
+    data_floats = convert_to_float(data_optimal_features, progress=progress)
     data_scaled = scaler.transform(data_floats)
 
     return data_scaled
@@ -0,0 +1,283 @@
+"""
+Save and load the processed train/test splits as `.npy` arrays with a manifest
+
+Splits too large for memory are written as row shards, `.npy` files of a
+fixed number of rows listed in the manifest, filled incrementally.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from numpy import ndarray
+import sklearn
+
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def file_version(path: str) -> str:
+    """Short content hash identifying a serialized artifact (scaler, model).
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        str: First 12 hex digits of the file's SHA-256
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()[:12]
+
+
+def save_processed(path: str,
+                   arrays: dict,
+                   features: list,
+                   scaler_path: str = './src/features/scaler.pkl') -> dict:
+    """Save processed arrays as `.npy` files and write a manifest next to them.
+
+    The manifest records the shape and dtype of each array, the feature order
+    of the input matrices and the version of the scaler used to produce them.
+
+    Args:
+        path (str): Directory to save the arrays in
+        arrays (dict): Array name to `ndarray`, e.g. {'X_train_scaled': X_train_scaled}
+        features (list): Feature names in column order
+        scaler_path (str, optional): Scaler the arrays were scaled with. Defaults to './src/features/scaler.pkl'.
+
+    Returns:
+        dict: Manifest
+    """
+    os.makedirs(path, exist_ok=True)
+
+    manifest = new_manifest(features, scaler_path)
+
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        file_name = f'{name}.npy'
+        np.save(os.path.join(path, file_name), array, allow_pickle=False)
+        manifest['arrays'][name] = _entry(file_name, array)
+
+    write_manifest(path, manifest)
+
+    return manifest
+
+
+def new_manifest(features: list, scaler_path: str = './src/features/scaler.pkl') -> dict:
+    """Manifest of a processed data directory, without arrays yet.
+
+    Args:
+        features (list): Feature names in column order
+        scaler_path (str, optional): Scaler the arrays were scaled with. Defaults to './src/features/scaler.pkl'.
+
+    Returns:
+        dict: Manifest
+    """
+    return {
+        'format': 'npy',
+        'features': list(features),
+        'scaler': {
+            'path': scaler_path,
+            'version': file_version(scaler_path),
+            'sklearn_version': sklearn.__version__
+            },
+        'arrays': {}
+        }
+
+
+def write_manifest(path: str, manifest: dict):
+    """Write the manifest of a processed data directory.
+
+    Args:
+        path (str): Directory holding the processed arrays
+        manifest (dict): Manifest
+    """
+    with open(os.path.join(path, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+
+def _entry(file_name: str, array: ndarray) -> dict:
+    # Manifest record of a saved array
+    return {
+        'file': file_name,
+        'shape': list(array.shape),
+        'dtype': str(array.dtype)
+        }
+
+
+def read_manifest(path: str) -> dict:
+    """Load the manifest of a processed data directory.
+
+    Args:
+        path (str): Directory holding the processed arrays
+
+    Returns:
+        dict: Manifest
+    """
+    with open(os.path.join(path, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+def load_array(path: str, skip_header: int = 0, mmap: bool = True) -> ndarray:
+    """Load a processed array from `.npy` (memory-mapped, no copy) or legacy csv.
+
+    Args:
+        path (str): Path to `.npy` or `.csv` file
+        skip_header (int, optional): Header lines to skip for csv files. Defaults to 0.
+        mmap (bool, optional): if True, memory-maps `.npy` files read-only. Defaults to True.
+
+    Returns:
+        ndarray: Loaded array
+    """
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r' if mmap else None, allow_pickle=False)
+    else:
+        return np.genfromtxt(path, delimiter=',', skip_header=skip_header)
+
+
+class ShardWriter:
+    """Write the rows of an array of known length into `.npy` shards of
+    `shard_rows` rows, in any number of blocks.
+
+    Shards are created as memory-mapped files and filled in place, so only the
+    block being written needs to be in memory.
+
+    Args:
+        path (str): Directory to save the shards in
+        name (str): Array name, shards are saved as '{name}-00000.npy', ...
+        rows (int): Total number of rows
+        columns (int, optional): Number of columns, 1D shards if None. Defaults to None.
+        dtype (optional): Data type. Defaults to float64.
+        shard_rows (int, optional): Rows per shard. Defaults to 1_000_000.
+    """
+    def __init__(self,
+                 path: str,
+                 name: str,
+                 rows: int,
+                 columns: int = None,
+                 dtype=np.float64,
+                 shard_rows: int = 1_000_000):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.name = name
+        self.rows = rows
+        self.columns = columns
+        self.dtype = np.dtype(dtype)
+        self.shard_rows = shard_rows
+        self.written = 0
+        self.shards = []
+        self._shard = None
+
+    def _open_shard(self):
+        # Next shard, sized to the rows still to be written
+        index = len(self.shards)
+        rows = min(self.shard_rows, self.rows - index * self.shard_rows)
+        shape = (rows,) if self.columns is None else (rows, self.columns)
+        file_name = f'{self.name}-{index:05d}.npy'
+        self._shard = np.lib.format.open_memmap(os.path.join(self.path, file_name), mode='w+',
+                                                dtype=self.dtype, shape=shape)
+        self.shards.append(_entry(file_name, self._shard))
+
+    def write(self, block: ndarray):
+        """Append rows.
+
+        Args:
+            block (ndarray): Rows to append
+
+        Raises:
+            ValueError: If more rows are written than the total
+        """
+        if self.written + len(block) > self.rows:
+            raise ValueError(f"{self.name}: writing {len(block)} rows after {self.written} "
+                             f"exceeds the {self.rows} rows expected")
+        start = 0
+        while start < len(block):
+            offset = self.written % self.shard_rows
+            if offset == 0:
+                self._close_shard()
+                self._open_shard()
+            stop = start + min(len(block) - start, len(self._shard) - offset)
+            self._shard[offset:offset + stop - start] = block[start:stop]
+            self.written += stop - start
+            start = stop
+
+    def _close_shard(self):
+        if self._shard is not None:
+            self._shard.flush()
+            self._shard = None
+
+    def close(self) -> list:
+        """Flush the last shard.
+
+        Raises:
+            ValueError: If fewer rows were written than the total
+
+        Returns:
+            list: Manifest records of the shards, in row order
+        """
+        self._close_shard()
+        if self.written != self.rows:
+            raise ValueError(f"{self.name}: {self.written} rows written, {self.rows} expected")
+        return self.shards
+
+
+def load_shards(path: str, name: str, mmap: bool = True) -> list:
+    """Load the shards of an array listed in the manifest.
+
+    Args:
+        path (str): Directory holding the processed arrays
+        name (str): Array name, e.g. 'X_train_scaled'
+        mmap (bool, optional): if True, memory-maps the shards read-only. Defaults to True.
+
+    Returns:
+        list: Shards, in row order
+    """
+    return [load_array(shard_path, mmap=mmap) for shard_path in shard_paths(path, name)]
+
+
+def shard_paths(path: str, name: str) -> list:
+    """Paths of the shards of an array listed in the manifest.
+
+    Args:
+        path (str): Directory holding the processed arrays
+        name (str): Array name, e.g. 'X_train_scaled'
+
+    Returns:
+        list: Shard paths, in row order
+    """
+    return [os.path.join(path, shard['file']) for shard in read_manifest(path)['shards'][name]]
+
+
+def merge_shards(path: str, name: str, block_rows: int = 1_000_000) -> dict:
+    """Concatenate the shards of an array into a single '{name}.npy', block by block,
+    and add it to the manifest.
+
+    Args:
+        path (str): Directory holding the processed arrays
+        name (str): Array name, e.g. 'X_train_scaled'
+        block_rows (int, optional): Rows copied at a time. Defaults to 1_000_000.
+
+    Returns:
+        dict: Manifest
+    """
+    shards = load_shards(path, name)
+    rows = sum(len(shard) for shard in shards)
+    file_name = f'{name}.npy'
+    merged = np.lib.format.open_memmap(os.path.join(path, file_name), mode='w+',
+                                       dtype=shards[0].dtype, shape=(rows,) + shards[0].shape[1:])
+    start = 0
+    for shard in shards:
+        for block in range(0, len(shard), block_rows):
+            rows = shard[block:block + block_rows]
+            merged[start:start + len(rows)] = rows
+            start += len(rows)
+    merged.flush()
+
+    manifest = read_manifest(path)
+    manifest['arrays'][name] = _entry(file_name, merged)
+    del merged
+    write_manifest(path, manifest)
+
+    return manifest
@@ -0,0 +1,187 @@
+"""
+Fused scaling and prediction for the trained XGBoost model.
+
+Applies the fitted scaler's mean and scale column by column into a reused
+float32 buffer and predicts on it with `Booster.inplace_predict`, instead of
+allocating the scaled float64 matrix and a `DMatrix` copy of it per batch.
+Class probabilities are computed from the raw class scores, so they are
+available for both `multi:softmax` and `multi:softprob` boosters.
+"""
+
+import time
+import json
+import threading
+import numpy as np
+from numpy import ndarray
+from pandas import DataFrame
+import xgboost as xgb
+from src.utils.metrics import SCALE_SECONDS, PREDICT_SECONDS, PREDICT_PACKETS, batch_size_label
+
+
+def softmax(margins: ndarray) -> ndarray:
+    """Class probabilities from raw class scores, computed in place.
+
+    Args:
+        margins (ndarray): Raw scores of shape (N, number of classes)
+
+    Returns:
+        ndarray: Probabilities, each row summing to 1
+    """
+    margins -= margins.max(axis=1, keepdims=True)
+    np.exp(margins, out=margins)
+    margins /= margins.sum(axis=1, keepdims=True)
+    return margins
+
+
+def top_k(probabilities: ndarray, k: int) -> tuple:
+    """Most probable classes of each row, most probable first.
+
+    Args:
+        probabilities (ndarray): Class probabilities of shape (N, number of classes)
+        k (int): Number of classes to keep
+
+    Returns:
+        tuple: Classes (N, k) and their probabilities (N, k)
+    """
+    k = min(k, probabilities.shape[1])
+    classes = np.argpartition(-probabilities, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(probabilities, classes, axis=1)
+    order = np.argsort(-top, axis=1, kind='stable')
+    return np.take_along_axis(classes, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+
+class FusedPredictor:
+    """Scaler and booster applied in one pass over a batch.
+
+    Values are scaled in float64 exactly like `StandardScaler.transform`, then
+    stored as float32, the precision XGBoost predicts with, so predictions are
+    identical to `booster.predict(xgb.DMatrix(scaler.transform(data)))`.
+
+    Buffers are kept per thread and grown as needed up to `block_rows` rows, so
+    concurrent requests can share a predictor. Larger batches are predicted
+    block by block, so a large batch does not leave each thread holding a
+    buffer of its size.
+
+    Args:
+        booster (xgb.Booster): Trained model
+        scaler (StandardScaler, optional): Fitted scaler, inputs are taken as already
+            scaled if None. Defaults to None.
+        block_rows (int, optional): Rows scaled and predicted at a time. Defaults to 65_536.
+    """
+    def __init__(self, booster: xgb.Booster, scaler=None, block_rows: int=65_536):
+        self.booster = booster
+        self.block_rows = block_rows
+        self.num_features = booster.num_features()
+        learner = json.loads(booster.save_config())['learner']['learner_model_param']
+        self.num_classes = max(int(learner.get('num_class', 0)), 1)
+        self.mean = None
+        self.scale = None
+        if scaler is not None:
+            if getattr(scaler, 'mean_', None) is not None:
+                self.mean = np.asarray(scaler.mean_, dtype=np.float64)
+            if getattr(scaler, 'scale_', None) is not None:
+                self.scale = np.asarray(scaler.scale_, dtype=np.float64)
+        self._local = threading.local()
+
+    def _buffers(self, n_rows: int) -> tuple:
+        # Per thread float32 input buffer and float64 column scratch, grown geometrically
+        # up to `block_rows`; larger inputs get buffers that are not kept
+        if n_rows > self.block_rows:
+            return (np.empty((n_rows, self.num_features), dtype=np.float32),
+                    np.empty(n_rows, dtype=np.float64))
+        capacity = getattr(self._local, 'capacity', 0)
+        if capacity == 0 or n_rows > capacity:
+            capacity = min(max(n_rows, 2 * capacity, 256), self.block_rows)
+            self._local.inputs = np.empty((capacity, self.num_features), dtype=np.float32)
+            self._local.column = np.empty(capacity, dtype=np.float64)
+            self._local.capacity = capacity
+        return self._local.inputs[:n_rows], self._local.column[:n_rows]
+
+    def transform(self, data, scaled: bool=False) -> ndarray:
+        """Scale a batch into the calling thread's float32 buffer.
+
+        The returned array is overwritten by the next call from the same thread.
+
+        Args:
+            data (DataFrame | ndarray): Float features, one row per packet, in model column order
+            scaled (bool, optional): if True, data is already scaled and only copied. Defaults to False.
+
+        Returns:
+            ndarray: Float32 model inputs
+        """
+        columns = self._check(data)
+        start_time = time.perf_counter()
+        inputs, column = self._buffers(columns.shape[0])
+        for j in range(self.num_features):
+            values = columns.iloc[:, j].to_numpy() if isinstance(columns, DataFrame) else columns[:, j]
+            if scaled or (self.mean is None and self.scale is None):
+                inputs[:, j] = values
+                continue
+            np.copyto(column, values, casting='unsafe')
+            if self.mean is not None:
+                np.subtract(column, self.mean[j], out=column)
+            if self.scale is not None:
+                np.divide(column, self.scale[j], out=column)
+            inputs[:, j] = column
+
+        if not scaled:
+            SCALE_SECONDS.observe(time.perf_counter() - start_time)
+        return inputs
+
+    def _check(self, data):
+        # DataFrame or 2D array of model inputs
+        columns = data if isinstance(data, DataFrame) else np.asarray(data)
+        if columns.ndim != 2 or columns.shape[1] != self.num_features:
+            raise ValueError(f"Expected {self.num_features} features per row, got shape {columns.shape}")
+        return columns
+
+    def _blocks(self, data):
+        # Row blocks of `block_rows` rows: (start, block)
+        columns = self._check(data)
+        for start in range(0, len(columns), self.block_rows):
+            stop = start + self.block_rows
+            yield start, columns.iloc[start:stop] if isinstance(columns, DataFrame) else columns[start:stop]
+
+    def _inplace_predict(self, inputs: ndarray, **kwargs) -> ndarray:
+        # Booster call, timed per batch size
+        with PREDICT_SECONDS.time(batch_size=batch_size_label(len(inputs))):
+            predictions = self.booster.inplace_predict(inputs, **kwargs)
+        PREDICT_PACKETS.inc(len(inputs))
+        return predictions
+
+    def predict(self, data, scaled: bool=False) -> ndarray:
+        """Predict the class of a batch.
+
+        Args:
+            data (DataFrame | ndarray): Float features, one row per packet, in model column order
+            scaled (bool, optional): if True, data is already scaled. Defaults to False.
+
+        Returns:
+            ndarray: Predicted class of each packet
+        """
+        predictions = np.empty(len(self._check(data)), dtype=np.float32)
+        for start, block in self._blocks(data):
+            classes = self._inplace_predict(self.transform(block, scaled=scaled))
+            if classes.ndim == 2:
+                # `multi:softprob` booster: one probability per class
+                classes = classes.argmax(axis=1)
+            predictions[start:start+len(classes)] = classes
+        return predictions
+
+    def predict_proba(self, data, scaled: bool=False) -> ndarray:
+        """Class probabilities of a batch.
+
+        Args:
+            data (DataFrame | ndarray): Float features, one row per packet, in model column order
+            scaled (bool, optional): if True, data is already scaled. Defaults to False.
+
+        Returns:
+            ndarray: Probabilities of shape (N, number of classes)
+        """
+        probabilities = np.empty((len(self._check(data)), self.num_classes), dtype=np.float32)
+        for start, block in self._blocks(data):
+            margins = self._inplace_predict(self.transform(block, scaled=scaled), predict_type='margin')
+            rows = probabilities[start:start+len(block)]
+            rows[:] = margins.reshape(len(block), -1)
+            softmax(rows)
+        return probabilities
@@ -0,0 +1,265 @@
+"""
+Live intrusion detection on a capture that is still being written.
+
+Reads packets continuously from a growing pcap file or ring buffer directory,
+micro-batches them through the inference preprocessing and the trained XGBoost
+model, and emits an alert for every packet classified as an attack, within a
+bounded latency of the packet being read. With a confidence threshold, packets
+the model is unsure about are passed to a slower secondary check instead.
+"""
+
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from src.data.live_capture import follow_packets
+from src.data.packet_schema import PACKET_SCHEMA, NUMBER
+from src.features.build_features import label_mapping, convert_to_float
+from src.models.model_bundle import ModelBundle
+from src.utils.backend_log_config import backend as logger
+
+
+reversed_label = {value: key for key, value in label_mapping.items()}
+
+# Packet fields reported in alerts
+ALERT_FIELDS = ['timestamp', 'ip_src', 'ip_dst', 'tcp_srcport', 'tcp_dstport',
+                'udp_srcport', 'udp_dstport', 'eth_src', 'eth_dst']
+
+# End of capture marker on the packet queue
+_END = object()
+
+
+def log_alert(alert: dict):
+    """Default alert handler: log the alert and print it as a JSON line.
+
+    Args:
+        alert (dict): Alert from `LiveIDS`
+    """
+    logger.warning(f"Attack detected: {alert}")
+    print(json.dumps(alert), flush=True)
+
+
+class LiveIDS:
+    """Streaming inference over a live capture.
+
+    Packets are decoded by a reader thread and queued; the main loop collects
+    them into micro-batches of up to `batch_size` packets and runs a batch as
+    soon as it is full or its oldest packet has waited `max_latency` seconds.
+
+    Args:
+        model_path (str, optional): Trained XGBoost model. Defaults to './models/xgb_model.bin'.
+        scaler_path (str, optional): Fitted scaler. Defaults to './src/features/scaler.pkl'.
+        batch_size (int, optional): Maximum packets per micro-batch. Defaults to 256.
+        max_latency (float, optional): Maximum seconds a packet waits for its batch. Defaults to 0.5.
+        on_alert (Callable, optional): Called with an alert dict for each attack packet. Defaults to `log_alert`.
+        queue_size (int, optional): Maximum decoded packets waiting for inference. Defaults to 100_000.
+        threshold (float, optional): Confidence below which a packet is uncertain, the model
+            prediction is used for all packets if None. Defaults to None.
+        secondary (Callable, optional): Called with the uncertain packets of a batch and their class
+            probabilities, returns their classes. Uncertain packets keep the model prediction if None.
+            Defaults to None.
+    """
+    def __init__(self,
+                 model_path: str='./models/xgb_model.bin',
+                 scaler_path: str='./src/features/scaler.pkl',
+                 batch_size: int=256,
+                 max_latency: float=0.5,
+                 on_alert=log_alert,
+                 queue_size: int=100_000,
+                 threshold: float=None,
+                 secondary=None):
+        self.bundle = ModelBundle.load(model_path, scaler_path)
+        # Only the model's input fields need converting
+        self.columns = self.bundle.features
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.on_alert = on_alert
+        self.queue_size = queue_size
+        self.threshold = threshold
+        self.secondary = secondary
+        self.stats = {}
+
+    def predict(self, packets: list) -> np.ndarray:
+        """Classify a batch of decoded packets.
+
+        Field values are typed the same way as in the csv files processed by the
+        API, without writing them to csv.
+
+        Args:
+            packets (list): Packet field dictionaries
+
+        Returns:
+            np.ndarray: Predicted class of each packet
+        """
+        return self.bundle.predict_packets(self._frame(packets))
+
+    def classify(self, packets: list) -> dict:
+        """Classify a batch of decoded packets with class probabilities and
+        flag the ones below the confidence threshold.
+
+        Args:
+            packets (list): Packet field dictionaries
+
+        Returns:
+            dict: Classification results, see `ModelBundle.classify`
+        """
+        floats = convert_to_float(self._frame(packets)[self.columns], progress=False)
+        return self.bundle.classify(floats, threshold=self.threshold, scaled=False)
+
+    def _frame(self, packets: list) -> pd.DataFrame:
+        # Model input fields typed as when read back from csv: empty values are
+        # missing and numeric columns of the packet schema become numbers, unless
+        # a value does not parse, in which case read_csv reads the column as text
+        data = {}
+        for column in self.columns:
+            values = [np.nan if value is None or value == '' else value
+                      for value in (packet[column] for packet in packets)]
+            if PACKET_SCHEMA.get(column) == NUMBER:
+                try:
+                    values = np.array(values, dtype=np.float64)
+                except (TypeError, ValueError):
+                    values = [np.nan if pd.isna(value) else str(value) for value in values]
+            data[column] = values
+        return pd.DataFrame(data)
+
+    def _read(self, source: str, packets: queue.Queue, stop: threading.Event, follow: bool):
+        # Reader thread: decode packets and queue them with their arrival time
+        try:
+            for packet in follow_packets(source, stop=stop, follow=follow):
+                packets.put((time.perf_counter(), packet))
+        except Exception as exc:
+            logger.exception(f"Live capture reader failed: {exc}")
+        finally:
+            packets.put(_END)
+
+    def _run_batch(self, batch: list):
+        arrivals, packets = zip(*batch)
+        confidence = None
+        if self.threshold is None:
+            predictions = self.predict(packets)
+        else:
+            classified = self.classify(packets)
+            predictions, confidence = classified['classes'], classified['confidence']
+            uncertain = classified['uncertain']
+            self.stats['uncertain'] += len(uncertain)
+            if self.secondary is not None and len(uncertain):
+                predictions[uncertain] = self.secondary([packets[i] for i in uncertain],
+                                                        classified['probabilities'][uncertain])
+        done = time.perf_counter()
+
+        self.stats['packets'] += len(packets)
+        self.stats['batches'] += 1
+        self.stats['max_latency'] = max(self.stats['max_latency'], done - arrivals[0])
+
+        for i, (arrival, packet, prediction) in enumerate(zip(arrivals, packets, predictions)):
+            if int(prediction) != label_mapping['normal']:
+                self.stats['alerts'] += 1
+                alert = {field: packet[field] for field in ALERT_FIELDS}
+                alert['attack_type'] = reversed_label[int(prediction)]
+                if confidence is not None:
+                    alert['confidence'] = float(confidence[i])
+                alert['latency'] = done - arrival
+                self.on_alert(alert)
+
+    def run(self, source: str, follow: bool=True, duration: float=None) -> dict:
+        """Run detection on a capture until it ends, `duration` elapses or
+        `stop()` is called.
+
+        Args:
+            source (str): Growing capture file or ring buffer directory
+            follow (bool, optional): if False, processes what has been written so far and
+                returns, e.g. to measure throughput. Defaults to True.
+            duration (float, optional): Seconds to run for, until stopped if None. Defaults to None.
+
+        Returns:
+            dict: Run statistics: packets, batches, alerts, uncertain packets, packets per
+            second and maximum latency (seconds from a packet being read to its prediction)
+        """
+        self._stop = threading.Event()
+        packets = queue.Queue(maxsize=self.queue_size)
+        reader = threading.Thread(target=self._read, args=(source, packets, self._stop, follow),
+                                  daemon=True)
+        self.stats = {'packets': 0, 'batches': 0, 'alerts': 0, 'uncertain': 0, 'max_latency': 0.0}
+
+        logger.info(f"Live IDS started on {source}")
+        start_time = time.perf_counter()
+        end_time = start_time + duration if duration else None
+        reader.start()
+
+        batch = []
+        while True:
+            now = time.perf_counter()
+            if end_time is not None and now >= end_time:
+                self._stop.set()
+
+            # Wait for the next packet until the oldest packet of the batch is due
+            timeout = self.max_latency
+            if batch:
+                timeout = max(batch[0][0] + self.max_latency - now, 0)
+            if end_time is not None:
+                timeout = max(min(timeout, end_time - now), 0)
+
+            try:
+                item = packets.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            # Take whatever else is already queued, so a backlog is cleared in full batches
+            ended = item is _END
+            while item is not None and not ended:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = packets.get_nowait()
+                except queue.Empty:
+                    item = None
+                ended = item is _END
+
+            if ended:
+                break
+
+            if batch and (len(batch) >= self.batch_size or
+                          time.perf_counter() - batch[0][0] >= self.max_latency):
+                self._run_batch(batch)
+                batch = []
+
+        if batch:
+            self._run_batch(batch)
+        reader.join()
+
+        elapsed_time = time.perf_counter() - start_time
+        self.stats['elapsed'] = elapsed_time
+        self.stats['packets_per_second'] = self.stats['packets'] / elapsed_time if elapsed_time else 0.0
+        logger.info(f"Live IDS stopped: {self.stats}")
+
+        return self.stats
+
+    def stop(self):
+        """Stop a running `run()` after the packets already read."""
+        self._stop.set()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Live IDS on a growing capture file or ring buffer directory')
+    parser.add_argument('source', help='pcap/pcapng file or ring buffer directory')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--max-latency', type=float, default=0.5)
+    parser.add_argument('--duration', type=float, default=None)
+    parser.add_argument('--threshold', type=float, default=None,
+                        help='confidence below which packets are counted as uncertain')
+    parser.add_argument('--no-follow', action='store_true',
+                        help='process what has been captured so far and exit (throughput benchmark)')
+    args = parser.parse_args()
+
+    ids = LiveIDS(batch_size=args.batch_size, max_latency=args.max_latency, threshold=args.threshold)
+    try:
+        stats = ids.run(args.source, follow=not args.no_follow, duration=args.duration)
+    except KeyboardInterrupt:
+        ids.stop()
+        stats = ids.stats
+    print(json.dumps(stats), file=sys.stderr)
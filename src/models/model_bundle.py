@@ -0,0 +1,163 @@
+"""
+Serving bundle of the trained model: booster, scaler and input feature list,
+loaded together and identified by a single version ID.
+"""
+
+import joblib
+import numpy as np
+from numpy import ndarray
+from pandas import DataFrame
+import xgboost as xgb
+from src.features.build_features import convert_to_float, OPTIMAL_FEATURES
+from src.features.processed_data import file_version
+from src.models.fused_predictor import FusedPredictor, top_k
+from src.utils.metrics import CONVERT_SECONDS, SCALE_SECONDS
+
+
+class ModelBundle:
+    """Booster, scaler and feature list used together for inference.
+
+    Build with `ModelBundle.load`. A bundle is never modified once loaded, so it
+    can be shared by concurrent requests and replaced as a whole on reload.
+
+    Args:
+        booster (xgb.Booster): Trained model
+        scaler (StandardScaler): Scaler fitted on the training data
+        features (list): Model input features, in column order
+        version (str): Bundle version ID
+    """
+    def __init__(self, booster: xgb.Booster, scaler, features: list, version: str):
+        self.booster = booster
+        self.scaler = scaler
+        self.features = list(features)
+        self.version = version
+        self.predictor = FusedPredictor(booster, scaler)
+
+    @classmethod
+    def load(cls,
+             model_path: str='./models/xgb_model.bin',
+             scaler_path: str='./src/features/scaler.pkl',
+             features: list=OPTIMAL_FEATURES) -> 'ModelBundle':
+        """Load and check a bundle.
+
+        Args:
+            model_path (str, optional): Trained XGBoost model. Defaults to './models/xgb_model.bin'.
+            scaler_path (str, optional): Fitted scaler. Defaults to './src/features/scaler.pkl'.
+            features (list, optional): Model input features. Defaults to OPTIMAL_FEATURES.
+
+        Raises:
+            ValueError: If the scaler or model do not match the feature list
+
+        Returns:
+            ModelBundle: Loaded bundle, versioned by the content of the model and scaler files
+        """
+        booster = xgb.Booster()
+        booster.load_model(model_path)
+        scaler = joblib.load(scaler_path)
+
+        # Refuse artifacts trained on other features than the ones served
+        fitted_features = getattr(scaler, 'feature_names_in_', None)
+        if fitted_features is not None and list(fitted_features) != list(features):
+            raise ValueError(f"Scaler was fitted on features {list(fitted_features)}, "
+                             f"expected {list(features)}")
+        if scaler.n_features_in_ != len(features) or booster.num_features() != len(features):
+            raise ValueError(f"Scaler ({scaler.n_features_in_}) and model ({booster.num_features()}) "
+                             f"inputs do not match the {len(features)} features")
+
+        version = f'{file_version(model_path)}-{file_version(scaler_path)}'
+
+        return cls(booster, scaler, features, version)
+
+    @property
+    def num_features(self) -> int:
+        return len(self.features)
+
+    def preprocess(self, data: DataFrame, progress: bool=False) -> ndarray:
+        """Extract the features of raw packet data, convert them to float and scale them.
+
+        Args:
+            data (DataFrame): Raw packet data
+            progress (bool, optional): if True, shows the conversion progress bar. Defaults to False.
+
+        Returns:
+            ndarray: Scaled features
+        """
+        # Same steps as `inference_preprocess`, timed separately
+        with CONVERT_SECONDS.time():
+            data_floats = convert_to_float(data[self.features], progress=progress)
+        with SCALE_SECONDS.time():
+            return self.scaler.transform(data_floats)
+
+    def predict(self, features: ndarray) -> ndarray:
+        """Predict the class of preprocessed packets.
+
+        Args:
+            features (ndarray): Scaled features, one row per packet
+
+        Returns:
+            ndarray: Predicted class of each packet
+        """
+        return self.predictor.predict(features, scaled=True)
+
+    def classify(self,
+                 features: ndarray,
+                 k: int=1,
+                 threshold: float=None,
+                 secondary=None,
+                 scaled: bool=True) -> dict:
+        """Predict the class of preprocessed packets with their probabilities, and
+        route low-confidence packets to a secondary check.
+
+        Return dictionary with keys:
+            "classes": Predicted class of each packet\n
+            "probabilities": Probability of each class, one row per packet\n
+            "confidence": Probability of the predicted class\n
+            "top_classes": `k` most probable classes of each packet\n
+            "top_probabilities": Probabilities of `top_classes`\n
+            "uncertain": Indices of the packets with confidence below `threshold`
+
+        Args:
+            features (ndarray): Scaled features, one row per packet
+            k (int, optional): Number of most probable classes to return. Defaults to 1.
+            threshold (float, optional): Confidence below which a packet is uncertain,
+                none are if None. Defaults to None.
+            secondary (Callable, optional): Called once with the features and probabilities of
+                the uncertain packets, returns their classes. Defaults to None.
+            scaled (bool, optional): if False, features are float converted but not scaled yet. Defaults to True.
+
+        Returns:
+            dict: Classification results
+        """
+        probabilities = self.predictor.predict_proba(features, scaled=scaled)
+        top_classes, top_probabilities = top_k(probabilities, k)
+        classes = top_classes[:, 0].copy()
+        confidence = top_probabilities[:, 0]
+
+        uncertain = np.empty(0, dtype=np.intp)
+        if threshold is not None:
+            uncertain = np.flatnonzero(confidence < threshold)
+        if secondary is not None and len(uncertain):
+            classes[uncertain] = secondary(np.asarray(features)[uncertain], probabilities[uncertain])
+
+        return {
+            'classes': classes,
+            'probabilities': probabilities,
+            'confidence': confidence,
+            'top_classes': top_classes,
+            'top_probabilities': top_probabilities,
+            'uncertain': uncertain
+            }
+
+    def predict_packets(self, data: DataFrame) -> ndarray:
+        """Predict the class of raw packet data, scaling and predicting in one pass
+        without keeping the scaled features.
+
+        Args:
+            data (DataFrame): Raw packet data
+
+        Returns:
+            ndarray: Predicted class of each packet
+        """
+        with CONVERT_SECONDS.time():
+            data_floats = convert_to_float(data[self.features], progress=False)
+        return self.predictor.predict(data_floats)
@@ -2,49 +2,177 @@
 Train and evaluate ML model 
 """
 # General
+import os
+import sys
 import time
 import json
 import joblib
-import numpy as np
+from src.features.processed_data import load_array, shard_paths
+from src.models.fused_predictor import FusedPredictor
 # ML Model
 import xgboost as xgb
 # Evaluation
 from sklearn.metrics import classification_report
 
 
-def train_model(MODELS_DIR: str, X_TRAIN_PATH: str, Y_TRAIN_PATH: str) -> float:
+def train_model(MODELS_DIR: str,
+                X_TRAIN_PATH: str,
+                Y_TRAIN_PATH: str,
+                objective: str='multi:softmax') -> float:
     """Train XGBoost Model 
 
     Args:
         MODELS_DIR (str): Path to save trained model
-        X_TRAIN_PATH (str): Path to load train features
-        Y_TRAIN_PATH (str): Path to load train targets
+        X_TRAIN_PATH (str): Path to load train features (`.npy` or `.csv`)
+        Y_TRAIN_PATH (str): Path to load train targets (`.npy` or `.csv`)
+        objective (str, optional): 'multi:softmax' or 'multi:softprob', both are served
+                                   with class probabilities. Defaults to 'multi:softmax'.
 
     Returns:
         float: Model training time
     """    
 
-    # Load train data from memory
-    X_train_scaled = np.genfromtxt(X_TRAIN_PATH, delimiter=',')
-    y_train = np.genfromtxt(Y_TRAIN_PATH, delimiter=',', skip_header=1)
+    # Load train data from memory (`.npy` files are memory-mapped)
+    X_train_scaled = load_array(X_TRAIN_PATH)
+    y_train = load_array(Y_TRAIN_PATH, skip_header=1)
 
+    # Convert the training data to XGBoost's DMatrix format
+    dtrain = xgb.DMatrix(X_train_scaled, label=y_train)
+
+    # Train the XGBoost model
+    st = time.process_time()
+    xgb_model = xgb.train(_xgb_params(objective), dtrain)
+    xgb_train_time = time.process_time() - st
+
+    # Save model
+    xgb_model.save_model(MODELS_DIR+'xgb_model.bin')
+
+    return xgb_train_time
+
+
+def _xgb_params(objective: str) -> dict:
     # XGB model parameters
-    xgb_params = {
-        'objective': 'multi:softmax',
+    return {
+        'objective': objective,
         'num_class': 11,  
         'max_depth': 5,
         'learning_rate': 0.1,
         'subsample': 0.8,
         'colsample_bytree': 0.8,
+        'tree_method': 'hist',
         'eval_metric': 'merror'
     }
 
-    # Convert the training data to XGBoost's DMatrix format
-    dtrain = xgb.DMatrix(X_train_scaled, label=y_train)
+
+def reset_peak_memory() -> bool:
+    """Reset the peak resident memory of the process to its current resident
+    memory, so that `peak_memory_mb` measures only what runs afterwards.
+
+    Uses `/proc/self/clear_refs` (Linux 4.0 and later).
+
+    Returns:
+        bool: True if the peak was reset, False where it cannot be
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_memory_mb() -> float:
+    """Peak resident memory of the process since it started, or since the last
+    `reset_peak_memory`, in MiB.
+
+    Returns:
+        float: Peak memory, None where the `resource` module is not available (Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+class ShardIter(xgb.DataIter):
+    """Feed `.npy` train shards to XGBoost one at a time.
+
+    Each shard is memory-mapped when XGBoost asks for the next batch and
+    released once it has been consumed.
+
+    Args:
+        X_paths (list): Feature shards, in row order
+        y_paths (list): Target shards, matching `X_paths`
+        cache_prefix (str, optional): Path prefix of the external memory cache,
+                                      data is kept in memory if None. Defaults to None.
+    """
+    def __init__(self, X_paths: list, y_paths: list, cache_prefix: str=None):
+        if len(X_paths) != len(y_paths):
+            raise ValueError(f"{len(X_paths)} feature shards but {len(y_paths)} target shards")
+        self.X_paths = list(X_paths)
+        self.y_paths = list(y_paths)
+        self._index = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data) -> int:
+        if self._index == len(self.X_paths):
+            return 0
+        input_data(data=load_array(self.X_paths[self._index]),
+                   label=load_array(self.y_paths[self._index]))
+        self._index += 1
+        return 1
+
+    def reset(self):
+        self._index = 0
+
+
+def train_model_sharded(MODELS_DIR: str,
+                        PROCESSED_DIR: str,
+                        objective: str='multi:softmax',
+                        matrix: str='external',
+                        cache_dir: str=None) -> float:
+    """Train XGBoost Model on the train shards written by `preprocess_out_of_core`,
+    without loading the training set in memory.
+
+    Shards are streamed through a `ShardIter`. With the 'external' matrix, XGBoost
+    writes the data to an on-disk page cache and trains from it, so the feature
+    matrix is held on disk rather than in memory. With the 'quantile' matrix, the data is
+    kept in memory as a `QuantileDMatrix`, which stores one histogram bin index
+    per value instead of the float matrix. In both cases XGBoost still keeps
+    its per-row training state (gradients and predictions of each class) in memory.
+
+    Args:
+        MODELS_DIR (str): Path to save trained model
+        PROCESSED_DIR (str): Path holding the shards and their `manifest.json`
+        objective (str, optional): 'multi:softmax' or 'multi:softprob'. Defaults to 'multi:softmax'.
+        matrix (str, optional): 'external' or 'quantile'. Defaults to 'external'.
+        cache_dir (str, optional): Directory of the external memory cache,
+                                   '{PROCESSED_DIR}/cache' if None. Defaults to None.
+
+    Raises:
+        ValueError: If `matrix` is neither 'external' nor 'quantile'
+
+    Returns:
+        float: Model training time
+    """
+    X_paths = shard_paths(PROCESSED_DIR, 'X_train_scaled')
+    y_paths = shard_paths(PROCESSED_DIR, 'y_train')
+
+    if matrix == 'external':
+        cache_dir = cache_dir or os.path.join(PROCESSED_DIR, 'cache')
+        os.makedirs(cache_dir, exist_ok=True)
+        dtrain = xgb.DMatrix(ShardIter(X_paths, y_paths, cache_prefix=os.path.join(cache_dir, 'train')))
+    elif matrix == 'quantile':
+        dtrain = xgb.QuantileDMatrix(ShardIter(X_paths, y_paths))
+    else:
+        raise ValueError(f"Unknown matrix: '{matrix}', expected 'external' or 'quantile'")
 
     # Train the XGBoost model
     st = time.process_time()
-    xgb_model = xgb.train(xgb_params, dtrain)
+    xgb_model = xgb.train(_xgb_params(objective), dtrain)
     xgb_train_time = time.process_time() - st
 
     # Save model
@@ -59,6 +187,7 @@ def evaluate_model(MODELS_DIR: str,
                    X_TEST_PATH: str,
                    Y_TEST_PATH: str,
                    train_time: float,
+                   peak_memory: float=None
                 ) -> dict:
     """Evaluate trained model.
 
@@ -68,16 +197,18 @@ def evaluate_model(MODELS_DIR: str,
 
     Args:
         MODELS_DIR (str): Path to load trained model
-        X_TEST_PATH (str): Path to load test features
-        Y_TEST_PATH (str): Path to load test features
+        X_TEST_PATH (str): Path to load test features (`.npy` or `.csv`)
+        Y_TEST_PATH (str): Path to load test targets (`.npy` or `.csv`)
         train_time (float): return value from `train_model` function
+        peak_memory (float, optional): Peak memory in MiB during training, from
+                                       `peak_memory_mb` after `reset_peak_memory`. Defaults to None.
 
     Returns:
         dict: Evaluation metrics
     """
     
-    X_test_scaled = np.genfromtxt(X_TEST_PATH, delimiter=',')
-    y_test = np.genfromtxt(Y_TEST_PATH, delimiter=',', skip_header=1)
+    X_test_scaled = load_array(X_TEST_PATH)
+    y_test = load_array(Y_TEST_PATH, skip_header=1)
 
     # Load model
     loaded_model = xgb.Booster()
@@ -86,8 +217,7 @@ def evaluate_model(MODELS_DIR: str,
 
     # XGB Predictions
     st = time.process_time()
-    dtest = xgb.DMatrix(X_test_scaled)
-    xgb_preds = loaded_model.predict(dtest)
+    xgb_preds = FusedPredictor(loaded_model).predict(X_test_scaled, scaled=True)
     xgb_inf_time = time.process_time() - st
 
     # Initialize metrics dictionary
@@ -95,6 +225,7 @@ def evaluate_model(MODELS_DIR: str,
 
     # Update Train and Inference time
     metrics.update({"train_time": train_time})
+    metrics.update({"peak_memory_mb": peak_memory})
     metrics.update({"inf_time/d_point": xgb_inf_time/len(xgb_preds)})
 
 
@@ -127,12 +258,12 @@ def evaluate_model(MODELS_DIR: str,
 #     # Define path to save model
 #     MODELS_DIR = './models/'
 #     # Training data paths
-#     X_TRAIN_PATH = './data/processed/X_train_scaled.csv'
-#     Y_TRAIN_PATH = './data/processed/y_train.csv'
+#     X_TRAIN_PATH = './data/processed/X_train_scaled.npy'
+#     Y_TRAIN_PATH = './data/processed/y_train.npy'
 
 #     # Test data paths
-#     X_TEST_PATH = './data/processed/X_test_scaled.csv'
-#     Y_TEST_PATH = './data/processed/y_test.csv'
+#     X_TEST_PATH = './data/processed/X_test_scaled.npy'
+#     Y_TEST_PATH = './data/processed/y_test.npy'
 
 #     train_time = train_model(MODELS_DIR, X_TRAIN_PATH, Y_TRAIN_PATH)
 
@@ -0,0 +1,206 @@
+"""
+Background job queue for the API service.
+
+Runs long jobs (e.g. parsing uploaded pcap files) on a bounded pool of worker
+processes, so request handlers return a job ID immediately, and tracks the
+status and progress of each job.
+"""
+
+import os
+import time
+import uuid
+import threading
+from functools import partial
+from multiprocessing import Manager
+from concurrent.futures import ProcessPoolExecutor, Future
+from src.utils.backend_log_config import backend as logger
+
+
+# Job status values
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def _report(progress, job_id: str, count: int):
+    """Record the number of items (packets) processed by a job."""
+    progress[job_id] = count
+
+
+def _run_job(fn, job_id: str, progress, args: tuple, kwargs: dict):
+    """Worker process entry point: runs `fn` with a `report` callback bound to
+    the job's progress counter."""
+    return fn(*args, report=partial(_report, progress, job_id), **kwargs)
+
+
+def _job_error(future: Future) -> str:
+    """Error message of a finished job, None if it succeeded."""
+    if future.cancelled():
+        return 'Job cancelled'
+    error = future.exception()
+    return None if error is None else str(error)
+
+
+class JobQueue:
+    """Bounded pool of worker processes running jobs in the background.
+
+    Jobs are functions accepting a `report` keyword argument, a callable taking
+    the number of items processed so far, which is exposed as the job progress.
+
+    Args:
+        max_workers (int, optional): Number of worker processes. Defaults to os.cpu_count().
+        max_history (int, optional): Number of finished jobs to keep track of. Defaults to 1000.
+        on_finish (Callable, optional): Called with the status and return value (None if it
+            failed) of each finished job, e.g. to record metrics. Defaults to None.
+    """
+    def __init__(self, max_workers: int=None, max_history: int=1000, on_finish=None):
+        self.max_workers = max_workers or os.cpu_count()
+        self.max_history = max_history
+        self.on_finish = on_finish
+        self._executor = None
+        self._manager = None
+        self._progress = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _start(self):
+        # Start the pool lazily, so importing the API does not spawn processes
+        if self._executor is None:
+            self._manager = Manager()
+            self._progress = self._manager.dict()
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            logger.info(f"Job queue started with {self.max_workers} workers")
+
+    def submit(self, fn, *args, name: str=None, **kwargs) -> str:
+        """Queue a job.
+
+        Args:
+            fn (Callable): Module level function to run, accepting a `report` keyword argument
+            *args: Positional arguments of `fn`
+            name (str, optional): Name to look the job up by, e.g. file name. Defaults to None.
+            **kwargs: Keyword arguments of `fn`
+
+        Returns:
+            str: Job ID
+        """
+        with self._lock:
+            self._start()
+            job_id = uuid.uuid4().hex
+            self._progress[job_id] = 0
+            future = self._executor.submit(_run_job, fn, job_id, self._progress, args, kwargs)
+            self._jobs[job_id] = {
+                'id': job_id,
+                'name': name,
+                'future': future,
+                'error': None,
+                'submitted': time.time(),
+                'finished': None
+                }
+            self._prune()
+
+        future.add_done_callback(partial(self._finish, job_id))
+        logger.info(f"Job {job_id} queued ({name})")
+        return job_id
+
+    def _finish(self, job_id: str, future: Future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job['finished'] = time.time()
+            job['error'] = _job_error(future)
+            if job['error'] is not None:
+                logger.warning(f"Job {job_id} failed: {job['error']}")
+            else:
+                logger.info(f"Job {job_id} done")
+
+        if self.on_finish is not None:
+            try:
+                result = future.result() if job['error'] is None else None
+                self.on_finish(self.status(job_id), result)
+            except Exception as exc:
+                logger.warning(f"Job {job_id} finish callback failed: {exc}")
+
+    def _prune(self):
+        # Forget the oldest finished jobs beyond `max_history`
+        finished = [job_id for job_id, job in self._jobs.items() if job['finished'] is not None]
+        for job_id in finished[:max(len(finished) - self.max_history, 0)]:
+            del self._jobs[job_id]
+            self._progress.pop(job_id, None)
+
+    def status(self, job_id: str) -> dict:
+        """Status of a job.
+
+        Return dictionary with keys:
+            "id": Job ID\n
+            "name": Job name\n
+            "status": One of 'queued', 'running', 'done', 'failed'\n
+            "packets": Number of items processed so far\n
+            "error": Error message if the job failed\n
+            "elapsed": Seconds since the job was queued, until it finished
+
+        Args:
+            job_id (str): Job ID
+
+        Returns:
+            dict: Job status, None if the job is unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            future = job['future']
+
+            error = None
+            if future.done():
+                error = _job_error(future)
+                status = FAILED if error is not None else DONE
+            elif future.running():
+                status = RUNNING
+            else:
+                status = QUEUED
+
+            end = job['finished'] or time.time()
+            return {
+                'id': job_id,
+                'name': job['name'],
+                'status': status,
+                'packets': self._progress.get(job_id, 0),
+                'error': error,
+                'elapsed': end - job['submitted']
+                }
+
+    def depth(self) -> int:
+        """Number of jobs queued or running.
+
+        Returns:
+            int: Unfinished jobs
+        """
+        with self._lock:
+            return sum(not job['future'].done() for job in self._jobs.values())
+
+    def latest(self, name: str) -> str:
+        """ID of the most recent job with the given name.
+
+        Args:
+            name (str): Job name
+
+        Returns:
+            str: Job ID, None if no job has that name
+        """
+        with self._lock:
+            for job_id in reversed(list(self._jobs)):
+                if self._jobs[job_id]['name'] == name:
+                    return job_id
+        return None
+
+    def shutdown(self):
+        """Stop the worker pool, waiting for running jobs."""
+        with self._lock:
+            executor, manager = self._executor, self._manager
+            self._executor = self._manager = None
+        # Outside the lock: done callbacks of running jobs need it
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+            manager.shutdown()
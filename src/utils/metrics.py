@@ -0,0 +1,199 @@
+"""
+In-process metrics of the API hot paths, exposed in the Prometheus text format.
+
+Counters, gauges and histograms are plain Python objects updated under a
+lock, cheap enough to record on every request. `render()` returns all
+registered metrics for a `/metrics` endpoint.
+"""
+
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+# Registered metrics, in registration order
+REGISTRY = []
+
+# Default histogram buckets, in seconds
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str='') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base of the metric types: name, help text, label names and one series per label values."""
+    kind = ''
+
+    def __init__(self, name: str, description: str, labels: tuple=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            series = sorted(self._series.items())
+        for values, state in series:
+            lines.extend(self._render_series(values, state))
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic total, e.g. bytes received.
+
+    Args:
+        name (str): Metric name
+        description (str): Help text
+        labels (tuple, optional): Label names. Defaults to ().
+    """
+    kind = 'counter'
+
+    def inc(self, amount: float=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, values: tuple, total) -> list:
+        return [f'{self.name}{_format_labels(self.label_names, values)} {_format_value(total)}']
+
+
+class Gauge(_Metric):
+    """Current value, set directly or read from `function` at render time.
+
+    Args:
+        name (str): Metric name
+        description (str): Help text
+        function (Callable, optional): Returns the current value. Defaults to None.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, description: str, function=None):
+        super().__init__(name, description)
+        self.function = function
+        self._series[()] = 0
+
+    def set(self, value: float):
+        with self._lock:
+            self._series[()] = value
+
+    def render(self) -> list:
+        if self.function is not None:
+            try:
+                self.set(self.function())
+            except Exception:
+                pass
+        return super().render()
+
+    def _render_series(self, values: tuple, value) -> list:
+        return [f'{self.name} {_format_value(value)}']
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets.
+
+    Args:
+        name (str): Metric name
+        description (str): Help text
+        buckets (tuple, optional): Bucket upper bounds, ascending. Defaults to TIME_BUCKETS.
+        labels (tuple, optional): Label names. Defaults to ().
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, buckets: tuple=TIME_BUCKETS, labels: tuple=()):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        index = bisect_left(self.buckets, value)
+        key = self._key(labels)
+        with self._lock:
+            state = self._series.get(key)
+            if state is None:
+                # Bucket counts (last one is +Inf), sum, count
+                state = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a `with` block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_series(self, values: tuple, state) -> list:
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f'{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}')
+        labels = _format_labels(self.label_names, values)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+def batch_size_label(size: int) -> str:
+    """Batch size bucket used as label value: smallest power of 4 not below `size`.
+
+    Args:
+        size (int): Batch size
+
+    Returns:
+        str: Label value, e.g. '1', '4', '16', ... '65536' or '+Inf'
+    """
+    bound = 1
+    while bound < size and bound < 65536:
+        bound *= 4
+    return str(bound) if size <= bound else '+Inf'
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format.
+
+    Returns:
+        str: Metrics text
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+## ----------------- API hot path metrics ----------------- ##
+
+PARSE_RATE = Histogram('ids_parse_packets_per_second',
+                       'Packets parsed per second by pcap processing jobs',
+                       buckets=(100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000))
+PARSE_PACKETS = Counter('ids_parse_packets_total', 'Packets parsed by pcap processing jobs')
+CONVERT_SECONDS = Histogram('ids_convert_to_float_seconds',
+                            'Duration of converting packet fields to float')
+SCALE_SECONDS = Histogram('ids_scale_seconds', 'Duration of scaling the model features')
+PREDICT_SECONDS = Histogram('ids_predict_seconds', 'Model prediction latency per batch',
+                            labels=('batch_size',))
+PREDICT_PACKETS = Counter('ids_predicted_packets_total', 'Packets classified by the model')
+UPLOAD_BYTES = Counter('ids_upload_bytes_total', 'Bytes of capture files uploaded')
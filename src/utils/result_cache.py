@@ -0,0 +1,200 @@
+"""
+Content-addressed cache of processed capture results for the API service.
+
+Entries are dictionaries of arrays (e.g. processed feature matrix, predictions)
+keyed by the SHA-256 of the uploaded capture and the versions of the scaler and
+model that produced them. Entries are kept in memory up to a byte budget, least
+recently used first out, and in a disk tier of `.npz` files with its own budget.
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from src.utils.backend_log_config import backend as logger
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 hex digest of a file's content.
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        str: Hex digest
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _read_only(array) -> np.ndarray:
+    # Cached arrays are shared between requests
+    array = np.asarray(array).view()
+    array.setflags(write=False)
+    return array
+
+
+class ResultCache:
+    """Two-tier LRU cache of processed results.
+
+    Args:
+        max_bytes (int, optional): Memory tier budget in bytes. Defaults to 512 MiB.
+        disk_dir (str, optional): Disk tier directory, no disk tier if None. Defaults to None.
+        max_disk_bytes (int, optional): Disk tier budget in bytes. Defaults to 4 GiB.
+    """
+    def __init__(self, max_bytes: int=512 << 20, disk_dir: str=None, max_disk_bytes: int=4 << 30):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def key(self, path: str, *versions: str) -> str:
+        """Cache key of a capture file processed with the given artifact versions.
+
+        File digests are remembered by path, size and modification time, so an
+        unchanged file is only hashed once.
+
+        Args:
+            path (str): Capture file
+            *versions (str): Versions of the artifacts the result depends on (scaler, model)
+
+        Returns:
+            str: Cache key
+        """
+        stat = os.stat(path)
+        file_id = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(file_id)
+        if digest is None:
+            digest = file_sha256(path)
+            with self._lock:
+                self._digests[file_id] = digest
+                if len(self._digests) > 1024:
+                    self._digests.popitem(last=False)
+
+        return '-'.join((digest,) + versions)
+
+    def get(self, key: str) -> dict:
+        """Look up an entry, promoting disk entries to memory.
+
+        Args:
+            key (str): Cache key
+
+        Returns:
+            dict: Arrays of the entry, None if not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._load(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, arrays: dict):
+        """Add an entry to both tiers.
+
+        Args:
+            key (str): Cache key
+            arrays (dict): Name to `ndarray`
+        """
+        arrays = {name: _read_only(array) for name, array in arrays.items()}
+        with self._lock:
+            self._remember(key, arrays)
+        self._store(key, arrays)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._entries:
+                return True
+        return self.disk_dir is not None and os.path.exists(self._path(key))
+
+    def _remember(self, key: str, arrays: dict):
+        # Memory tier, caller holds the lock
+        size = sum(array.nbytes for array in arrays.values())
+        if key in self._entries:
+            self.nbytes -= sum(array.nbytes for array in self._entries.pop(key).values())
+        if size > self.max_bytes:
+            return
+        self._entries[key] = arrays
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= sum(array.nbytes for array in evicted.values())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key+'.npz')
+
+    def _load(self, key: str) -> dict:
+        if self.disk_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                arrays = {name: _read_only(npz[name]) for name in npz.files}
+            # Mark as recently used for disk eviction
+            os.utime(path)
+            return arrays
+        except FileNotFoundError:
+            return None
+        except Exception as exc:
+            logger.warning(f"Dropping unreadable cache entry {path}: {exc}")
+            os.remove(path)
+            return None
+
+    def _store(self, key: str, arrays: dict):
+        if self.disk_dir is None:
+            return
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except Exception as exc:
+            logger.warning(f"Could not write cache entry {path}: {exc}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._evict_disk()
+
+    def _evict_disk(self):
+        # Remove least recently used files beyond the disk budget
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith('.npz'):
+                path = os.path.join(self.disk_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,256 @@
+"""
+Upload storage for the API service.
+
+Each upload is written to its own directory under the upload root, chunk by
+chunk, with its SHA-256 computed on the fly and a size cap, so captures of any
+size are received with constant memory and concurrent users do not share files.
+Uploads can be sent in several requests and resumed from the size already
+written. Upload directories are removed once older than a time to live.
+"""
+
+import os
+import re
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from src.utils.backend_log_config import backend as logger
+from src.utils.metrics import UPLOAD_BYTES
+
+
+class UploadError(Exception):
+    """Upload request that cannot be applied, with the HTTP status to answer with."""
+    def __init__(self, message: str, status_code: int=400, offset: int=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+# Name of the uploaded file, kept next to it (outputs derived from the file share its directory)
+_NAME_FILE = '.upload'
+
+
+class UploadStore:
+    """Per-upload directories with streamed, hashed, size-capped writes.
+
+    Args:
+        root (str): Directory holding the upload directories
+        max_bytes (int, optional): Maximum size of an upload in bytes. Defaults to 8 GiB.
+        ttl (float, optional): Seconds after which an upload directory is removed. Defaults to 24 hours.
+    """
+    def __init__(self, root: str, max_bytes: int=8 << 30, ttl: float=24 * 3600):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # Running hash of each upload, valid while it matches the size on disk
+        self._hashes = {}
+        self._busy = set()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def create(self, filename: str) -> str:
+        """Start an upload.
+
+        Args:
+            filename (str): Name of the uploaded file
+
+        Raises:
+            UploadError: If the file name is empty or invalid
+
+        Returns:
+            str: Upload ID
+        """
+        filename = os.path.basename(filename or '')
+        if filename in ('', '.', '..', _NAME_FILE):
+            raise UploadError(f"Invalid file name: '{filename}'")
+
+        self.prune()
+        upload_id = uuid.uuid4().hex
+        directory = os.path.join(self.root, upload_id)
+        os.makedirs(directory)
+        with open(os.path.join(directory, _NAME_FILE), 'w') as f:
+            f.write(filename)
+        open(os.path.join(directory, filename), 'wb').close()
+        with self._lock:
+            self._hashes[upload_id] = (0, hashlib.sha256())
+        logger.info(f"Upload {upload_id} started ({filename})")
+        return upload_id
+
+    def path(self, upload_id: str) -> str:
+        """Path of the uploaded file.
+
+        Args:
+            upload_id (str): Upload ID
+
+        Raises:
+            UploadError: If the upload does not exist
+
+        Returns:
+            str: File path
+        """
+        directory = os.path.join(self.root, upload_id or '')
+        try:
+            if not _UPLOAD_ID.match(upload_id or ''):
+                raise FileNotFoundError(upload_id)
+            with open(os.path.join(directory, _NAME_FILE)) as f:
+                return os.path.join(directory, f.read())
+        except FileNotFoundError:
+            raise UploadError(f"Unknown upload: {upload_id}", status_code=404)
+
+    def offset(self, upload_id: str) -> int:
+        """Number of bytes received so far, where the next chunk starts.
+
+        Args:
+            upload_id (str): Upload ID
+
+        Returns:
+            int: Bytes received
+        """
+        return os.path.getsize(self.path(upload_id))
+
+    def open(self, upload_id: str, offset: int) -> 'UploadWriter':
+        """Open an upload to append data at `offset`.
+
+        Args:
+            upload_id (str): Upload ID
+            offset (int): Expected number of bytes received so far
+
+        Raises:
+            UploadError: If `offset` is not the current size (409), or the upload is
+                already being written (409) or does not exist (404)
+
+        Returns:
+            UploadWriter: Writer, to be closed once the request body is written
+        """
+        path = self.path(upload_id)
+        with self._lock:
+            if upload_id in self._busy:
+                raise UploadError("Upload is being written by another request", status_code=409,
+                                  offset=os.path.getsize(path))
+            size = os.path.getsize(path)
+            if offset != size:
+                raise UploadError(f"Upload is at offset {size}, not {offset}", status_code=409,
+                                  offset=size)
+            self._busy.add(upload_id)
+            hashed_size, sha = self._hashes.get(upload_id, (None, None))
+
+        try:
+            if hashed_size != size:
+                # Hash lost (e.g. server restarted): rebuild it from the data on disk
+                sha = _hash_file(path)
+            return UploadWriter(self, upload_id, path, size, sha)
+        except Exception:
+            self._release(upload_id, None, None)
+            raise
+
+    def _release(self, upload_id: str, size: int, sha):
+        with self._lock:
+            self._busy.discard(upload_id)
+            self._hashes[upload_id] = (size, sha)
+
+    def finish(self, upload_id: str) -> dict:
+        """Finish an upload.
+
+        Args:
+            upload_id (str): Upload ID
+
+        Returns:
+            dict: "path", "size" and "sha256" of the uploaded file
+        """
+        path = self.path(upload_id)
+        with self._lock:
+            if upload_id in self._busy:
+                raise UploadError("Upload is being written by another request", status_code=409)
+            size = os.path.getsize(path)
+            hashed_size, sha = self._hashes.get(upload_id, (None, None))
+        if hashed_size != size:
+            sha = _hash_file(path)
+        logger.info(f"Upload {upload_id} complete: {size} bytes")
+        return {"path": path, "size": size, "sha256": sha.hexdigest()}
+
+    def remove(self, upload_id: str):
+        """Delete an upload and its directory.
+
+        Args:
+            upload_id (str): Upload ID
+        """
+        if _UPLOAD_ID.match(upload_id or ''):
+            shutil.rmtree(os.path.join(self.root, upload_id), ignore_errors=True)
+            with self._lock:
+                self._hashes.pop(upload_id, None)
+
+    def prune(self):
+        """Delete upload directories not modified within the time to live."""
+        cutoff = time.time() - self.ttl
+        for upload_id in os.listdir(self.root):
+            directory = os.path.join(self.root, upload_id)
+            try:
+                modified = max([os.path.getmtime(os.path.join(directory, name))
+                                for name in os.listdir(directory)] + [os.path.getmtime(directory)])
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            with self._lock:
+                busy = upload_id in self._busy
+            if modified < cutoff and not busy:
+                self.remove(upload_id)
+                logger.info(f"Deleted expired upload: {upload_id}")
+
+
+class UploadWriter:
+    """Appends chunks to an upload, hashing them and enforcing the size cap.
+
+    Obtained from `UploadStore.open`; `write` blocks on disk I/O, so async
+    callers run it in a thread.
+    """
+    def __init__(self, store: UploadStore, upload_id: str, path: str, size: int, sha):
+        self.store = store
+        self.upload_id = upload_id
+        self.start = size
+        self.size = size
+        self.sha = sha
+        self.file = open(path, 'ab')
+
+    def write(self, chunk: bytes):
+        """Append a chunk.
+
+        Args:
+            chunk (bytes): Data
+
+        Raises:
+            UploadError: If the upload would exceed the size cap (413)
+        """
+        if self.size + len(chunk) > self.store.max_bytes:
+            raise UploadError(f"Upload exceeds the {self.store.max_bytes} bytes limit",
+                              status_code=413, offset=self.start)
+        self.file.write(chunk)
+        self.sha.update(chunk)
+        self.size += len(chunk)
+        UPLOAD_BYTES.inc(len(chunk))
+
+    def close(self, discard: bool=False):
+        """Close the writer, releasing the upload for the next request.
+
+        Args:
+            discard (bool, optional): if True, drops the data written by this writer,
+                e.g. after an error, so the upload can be resumed from where it started.
+                Defaults to False.
+        """
+        if discard and self.size != self.start:
+            self.file.truncate(self.start)
+            self.file.close()
+            self.store._release(self.upload_id, None, None)
+            return
+        self.file.close()
+        self.store._release(self.upload_id, self.size, self.sha)
+
+
+def _hash_file(path: str):
+    """Running SHA-256 of a file's content."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha
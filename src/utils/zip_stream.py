@@ -0,0 +1,125 @@
+"""
+Zip archives streamed while they are written, for API responses.
+
+Members are compressed on the fly and the archive is yielded in pieces as each
+block of a member is written, so large results are sent without building the
+archive in memory or on disk. Member writers are generators that write to the
+member file in blocks and yield after each one.
+"""
+
+import zipfile
+from typing import Iterator
+import numpy as np
+from numpy import ndarray
+
+
+class _Sink:
+    """Write-only file collecting archive output until it is yielded."""
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def stream_zip(members: list, compresslevel: int=1) -> Iterator[bytes]:
+    """Write a zip archive, yielding its bytes as they are produced.
+
+    Args:
+        members (list): (name, date_time, writer) tuples, `writer` being a function
+            taking the member file and returning a generator that writes to it
+        compresslevel (int, optional): Deflate level, 1 is fastest. Defaults to 1.
+
+    Yields:
+        Iterator[bytes]: Pieces of the archive
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED,
+                         compresslevel=compresslevel) as archive:
+        for name, date_time, writer in members:
+            info = zipfile.ZipInfo(name, date_time=date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, 'w', force_zip64=True) as member:
+                for _ in writer(member):
+                    if sink.buffer:
+                        yield sink.take()
+            yield sink.take()
+    yield sink.take()
+
+
+def copy_file(path: str, block_size: int=1 << 20):
+    """Member writer copying a file.
+
+    Args:
+        path (str): File to copy
+        block_size (int, optional): Bytes per block. Defaults to 1 MiB.
+    """
+    def write(member):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                member.write(block)
+                yield
+    return write
+
+
+def csv_matrix(array: ndarray, rows: int=10_000):
+    """Member writer for a 2D array as text, formatted like `np.savetxt(..., delimiter=',')`.
+
+    Args:
+        array (ndarray): 2D array
+        rows (int, optional): Rows per block. Defaults to 10_000.
+    """
+    def write(member):
+        for start in range(0, len(array), rows):
+            np.savetxt(member, array[start:start+rows], delimiter=',')
+            yield
+    return write
+
+
+def npy_matrix(array: ndarray, rows: int=65_536):
+    """Member writer for an array in `.npy` format.
+
+    Args:
+        array (ndarray): Array
+        rows (int, optional): Rows per block. Defaults to 65_536.
+    """
+    def write(member):
+        data = np.ascontiguousarray(array)
+        np.lib.format.write_array_header_1_0(member, np.lib.format.header_data_from_array_1_0(data))
+        for start in range(0, len(data), rows):
+            member.write(data[start:start+rows].tobytes())
+            yield
+    return write
+
+
+def arrow_matrix(array: ndarray, columns: list, rows: int=65_536):
+    """Member writer for a 2D array as an Arrow IPC stream, one column per feature.
+
+    Requires `pyarrow`.
+
+    Args:
+        array (ndarray): 2D array
+        columns (list): Column names
+        rows (int, optional): Rows per record batch. Defaults to 65_536.
+    """
+    import pyarrow as pa
+
+    schema = pa.schema([(str(column), pa.from_numpy_dtype(array.dtype)) for column in columns])
+
+    def write(member):
+        with pa.ipc.new_stream(member, schema) as stream:
+            for start in range(0, len(array), rows):
+                block = array[start:start+rows]
+                stream.write_batch(pa.record_batch([block[:, j] for j in range(block.shape[1])],
+                                                   schema=schema))
+                yield
+    return write
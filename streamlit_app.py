@@ -5,19 +5,23 @@ Allows the user to upload PCAP or PCAPNG file to server and toggle data processi
 on server side, as well as streaming the processed file retrived from the server to the 
 prediction endpoint to infer the class of each network packet.
 
-The result is appended to an interactive DataFrame and at the end of the process, a comprehensive
-report is generated, as well as the option to download the flagged packets as CSV.
+Packets are sent to the batch prediction endpoint in batches, with a few requests in flight.
+Flagged packets are shown in an interactive DataFrame refreshed on a timer, and at the end of
+the process, a comprehensive report is generated, as well as the option to download the
+flagged packets as CSV.
 """
 
 import os
 import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from pandas import DataFrame
 import numpy as np
 import streamlit as st
 from io import StringIO, BytesIO
 import zipfile
-from collections import OrderedDict
 
 
 import requests
@@ -38,6 +42,15 @@ os.makedirs(temp_folder, exist_ok=True)
 server: str = 'https://54.227.227.65' # Deployment
 # server: str = 'http://127.0.0.1:8000' # Local
 
+# Streaming parameters
+BATCH_SIZE: int = int(os.environ.get('IDS_BATCH_SIZE', 1024))     # packets per request
+IN_FLIGHT: int = int(os.environ.get('IDS_IN_FLIGHT', 4))          # concurrent requests
+UI_REFRESH: float = float(os.environ.get('IDS_UI_REFRESH', 0.5))  # seconds between UI updates
+DISPLAY_ROWS: int = 1000                                          # latest attacks shown while streaming
+
+# One HTTP session per streaming thread
+_sessions = threading.local()
+
 
 
 def convert_df(df: DataFrame):
@@ -51,6 +64,67 @@ def convert_df(df: DataFrame):
     """    
     return df.to_csv().encode('utf-8')
 
+def predict_batch(packets: np.ndarray) -> tuple:
+    """Send a batch of processed packets to the batch prediction endpoint as raw float32.
+
+    Args:
+        packets (np.ndarray): Processed packets, one row per packet
+
+    Returns:
+        tuple: Predicted class of each packet and server side prediction time
+    """
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = _sessions.session = requests.session()
+
+    response = session.post(server+"/predict/batch",
+                            data=np.ascontiguousarray(packets, dtype='<f4').tobytes(),
+                            headers={'Content-Type': 'application/octet-stream'},
+                            params={'dtype': 'float32'},
+                            verify=False)
+    response.raise_for_status()
+    response = response.json()
+
+    return np.asarray(response["result"], dtype=np.int16), response["time"]
+
+def stream_predictions(packets: np.ndarray, batch_size: int=BATCH_SIZE, in_flight: int=IN_FLIGHT):
+    """Predict packets in batches with up to `in_flight` requests pending, yielding
+    results in packet order.
+
+    Args:
+        packets (np.ndarray): Processed packets, one row per packet
+        batch_size (int, optional): Packets per request. Defaults to BATCH_SIZE.
+        in_flight (int, optional): Maximum concurrent requests. Defaults to IN_FLIGHT.
+
+    Yields:
+        tuple: Index of the first packet of the batch, predicted classes and server side prediction time
+    """
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=in_flight) as executor:
+        for start in range(0, len(packets), batch_size):
+            pending.append((start, executor.submit(predict_batch, packets[start:start+batch_size])))
+            if len(pending) >= in_flight:
+                start, future = pending.popleft()
+                yield (start, *future.result())
+        while pending:
+            start, future = pending.popleft()
+            yield (start, *future.result())
+
+def attacks_frame(packets_df: DataFrame, rows: np.ndarray, labels: np.ndarray) -> DataFrame:
+    """Unprocessed attack packets with their attack type as first column.
+
+    Args:
+        packets_df (DataFrame): Unprocessed packets
+        rows (np.ndarray): Row numbers of the attack packets
+        labels (np.ndarray): Predicted class of the attack packets
+
+    Returns:
+        DataFrame: Attack packets
+    """
+    attack_data = packets_df.iloc[rows].reset_index(drop=True)
+    attack_data.insert(0, 'Attack Type', [reversed_label[int(label)] for label in labels])
+    return attack_data
+
 def run():
     """
     Streamlit configuration for Cloud Based IoT ISD web user interface
@@ -100,19 +174,39 @@ def run():
             with st.spinner("Processing file..."):
                 state = requests.post(server+"/process", json={"filename":st.session_state['filename']}, verify=False).json()
                 # Parse request response
-                if "complete" in str(state["response"]):
-                    st.info(state['response'])
+                if "job_id" not in state:
+                    if "complete" in str(state["response"]):
+                        st.info(state['response'])
+                    else:
+                        st.warning(state['response'])
                 else:
-                    st.warning(state['response'])
+                    # Poll processing job until it is done
+                    st.session_state['job_id'] = state['job_id']
+                    job_status = st.empty()
+                    while True:
+                        job = requests.get(server+"/jobs/"+state['job_id'], verify=False).json()
+                        if job.get('status') not in ('queued', 'running'):
+                            break
+                        job_status.text(f"Processing file: {job['packets']} packets parsed")
+                        time.sleep(0.5)
+                    job_status.empty()
+
+                    if job.get('status') == 'done':
+                        st.info(f"Processing complete! {job['packets']} packets parsed")
+                    else:
+                        st.warning(f"Processing failed: \n{job.get('error', job.get('response'))}")
         
         # Generate Predictions
         if st.button("Activate IDS"):
+            elapsed_time = None
             try:
                 st.info("Calling API engine")
                 # Donload Processed file from server
                 with st.spinner("Retrieving processed file..."):
                     # Make a POST request to the endpoint and provide the file path
-                    filename = {'filename': st.session_state['filename']}
+                    filename = {'filename': st.session_state['filename'],
+                                'job_id': st.session_state.get('job_id'),
+                                'format': 'npy'}
                     processed_file = requests.post(server+"/retrieve", json=filename, verify=False)
 
                     # Check if the request was successful (status code 200)
@@ -126,93 +220,71 @@ def run():
                             csv_content = processed_file.content
                             st.info("Processed packets retrived")
 
-                                
+
                 # Initialize streaming process parameters and parse downloaded data
                 # Initialize counters
                 TOTAL = 0
                 NORMAL = 0
                 ATTACK = 0
                 TOTAL_PRED_TIME = 0
-                display_data = pd.DataFrame()
-                
+
                 zip_file = zipfile.ZipFile(BytesIO(csv_content))
 
-                # Extract the CSV files from the zip archive
-                csv_files = [filename for filename in zip_file.namelist() if filename.endswith('.csv')]
+                # Extract the unprocessed CSV and processed NPY files from the zip archive
+                for member in zip_file.namelist():
+                    if member.endswith('unprocessed.csv'):
+                        # Read the CSV file into a DataFrame (unprocessed data)
+                        packets_df = pd.read_csv(BytesIO(zip_file.read(member)))
+                    elif member.endswith('.npy'):
+                        # Read the NPY file into a NumPy array (processed data)
+                        packets_arr = np.load(BytesIO(zip_file.read(member)), allow_pickle=False)
 
-                if len(csv_files) >= 2:
-                    # Read the first CSV file into a DataFrame (unprocessed data)
-                    csv_data1 = zip_file.read(csv_files[1])
-                    packets_df = pd.read_csv(BytesIO(csv_data1))
+                n_packets = min(len(packets_arr), len(packets_df))
+                packets_arr = packets_arr[:n_packets]
 
-                    # Read the second CSV file into a NumPy array (processed data)
-                    csv_data2 = zip_file.read(csv_files[0])
-                    packets_arr = np.genfromtxt(BytesIO(csv_data2), delimiter=',')
+                # Preallocated row numbers and classes of detected attacks
+                attack_rows = np.empty(n_packets, dtype=np.intp)
+                attack_labels = np.empty(n_packets, dtype=np.int16)
 
                 st.info('Initializing streaming process')
-                # Create request session for sending multiple requests to server 
-                session = requests.session()
 
                 # Initialize streaming progress bar
                 progress_bar = st.progress(0.0, text="Analysing packets...")
 
                 # Start streaming timer
                 start_time = time.perf_counter()
+                last_refresh = start_time
+
+                # Stream batches of requests for inferences
+                table = st.empty()
+                for start, predictions, pred_time in stream_predictions(packets_arr):
+                    # Increment total prediction time and counters
+                    TOTAL_PRED_TIME += pred_time
+                    TOTAL += len(predictions)
+
+                    # Record attack packets
+                    flagged = np.flatnonzero(predictions != label_mapping['normal'])
+                    attack_rows[ATTACK:ATTACK+len(flagged)] = start + flagged
+                    attack_labels[ATTACK:ATTACK+len(flagged)] = predictions[flagged]
+                    ATTACK += len(flagged)
+                    NORMAL += len(predictions) - len(flagged)
+
+                    # Update progress bar and latest attacks on a timer
+                    now = time.perf_counter()
+                    if now - last_refresh >= UI_REFRESH:
+                        last_refresh = now
+                        progress_bar.progress(float(TOTAL/n_packets), text="Analysing packets...")
+                        if ATTACK:
+                            latest = slice(max(ATTACK-DISPLAY_ROWS, 0), ATTACK)
+                            table.write(attacks_frame(packets_df, attack_rows[latest], attack_labels[latest]))
 
-                # Stream requests for inferences
-                with st.empty():
-                    # Loop through both datasets and make requests
-                    for packet_row, row in zip(range(len(packets_arr)), range(len(packets_df))):
-                        
-                        # Convert ndarry of packet to ordered dictionary
-                        packet = packets_arr[packet_row]
-                        packet = OrderedDict(enumerate(packet))
-                        
-                        # Send disctionary with request to prediction endpoint
-                        response = session.post(server+"/predict", json={"data":packet}, verify=False).json()
-                        # Parse response
-                        prediction = response["result"]
-                        pred_time = response["time"]
-
-                        # Increment total prediction time
-                        TOTAL_PRED_TIME+=pred_time
-
-                        # Increment total counter
-                        TOTAL+=1
-                        # Increement progress bar
-                        progress_bar.progress(float(TOTAL/len(packets_df)), text="Analysing packets...")
-
-                        if prediction==0.0:
-                            # Increment normal count
-                            NORMAL+=1
-                        
-                        else:
-                            # Convert numerical class of response to string equivalent and append
-                            # unprocessed version of attack packet to `display_data` dataframe
-
-                            # make copy of attack packet
-                            packet_data = packets_df.loc[[row]].copy()
-
-                            # get string eqivalent of attack class
-                            label_data = pd.DataFrame([{'Attack Type': reversed_label[int(prediction)]}])
-
-                            # add label and attack packet to a single row of data
-                            label_data.reset_index(drop=True, inplace=True)
-                            packet_data.reset_index(drop=True, inplace=True)
-                            attack_data = pd.concat([label_data, packet_data], axis=1)
-
-                            # append row of attack data to all detected attack data
-                            display_data = pd.concat([display_data, attack_data], axis=0)
-                            
-                            # update growing dataframe on web app
-                            st.write(display_data)
-                            
-                            
-                            # Increment attack count
-                            ATTACK+=1
-                
                 # Get total streaming time from timer
                 elapsed_time = time.perf_counter() - start_time
+                progress_bar.progress(1.0, text="Analysis complete")
+
+                # All detected attacks
+                display_data = attacks_frame(packets_df, attack_rows[:ATTACK], attack_labels[:ATTACK])
+                table.write(display_data)
 
                 # Get types of attacks and counts from attacks dataframe (`display_data`)
                 attacks = []
@@ -0,0 +1,9 @@
+"""
+Shared test setup: make the `src` package importable from the repository root.
+"""
+
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
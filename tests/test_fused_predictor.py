@@ -0,0 +1,86 @@
+"""
+Parity of the fused scaler and booster pass with the two-step
+`scaler.transform` then `booster.predict(xgb.DMatrix(...))` path, on the
+shipped model and scaler.
+"""
+
+import os
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+from src.features.build_features import OPTIMAL_FEATURES
+from src.models.fused_predictor import FusedPredictor
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def model():
+    booster = xgb.Booster()
+    booster.load_model(os.path.join(ROOT_DIR, 'models', 'xgb_model.bin'))
+    scaler = joblib.load(os.path.join(ROOT_DIR, 'src', 'features', 'scaler.pkl'))
+    return booster, scaler
+
+
+@pytest.fixture(scope='module')
+def packets(model):
+    # Unscaled features spread around the training distribution
+    _, scaler = model
+    rng = np.random.default_rng(0)
+    values = scaler.mean_ + scaler.scale_ * rng.standard_normal((2000, len(OPTIMAL_FEATURES)))
+    return pd.DataFrame(values, columns=OPTIMAL_FEATURES)
+
+
+def _two_step(booster, scaler, data, **kwargs):
+    return booster.predict(xgb.DMatrix(scaler.transform(data)), **kwargs)
+
+
+def _softmax(margins):
+    exp = np.exp(margins - margins.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def test_predict_matches_two_step(model, packets):
+    booster, scaler = model
+    expected = _two_step(booster, scaler, packets)
+
+    predictor = FusedPredictor(booster, scaler)
+    np.testing.assert_array_equal(predictor.predict(packets), expected)
+    np.testing.assert_array_equal(predictor.predict(packets.to_numpy()), expected)
+    np.testing.assert_array_equal(FusedPredictor(booster).predict(scaler.transform(packets), scaled=True),
+                                  expected)
+
+
+def test_predict_proba_matches_two_step(model, packets):
+    booster, scaler = model
+    margins = _two_step(booster, scaler, packets, output_margin=True).astype(np.float64)
+    expected = _softmax(margins.reshape(len(packets), -1))
+
+    probabilities = FusedPredictor(booster, scaler).predict_proba(packets)
+    assert probabilities.shape == expected.shape
+    np.testing.assert_allclose(probabilities, expected, atol=1e-6)
+    np.testing.assert_array_equal(probabilities.argmax(axis=1), _two_step(booster, scaler, packets))
+
+
+def test_blocks_match_single_pass(model, packets):
+    booster, scaler = model
+    whole = FusedPredictor(booster, scaler)
+    blocked = FusedPredictor(booster, scaler, block_rows=97)
+
+    np.testing.assert_array_equal(blocked.predict(packets), whole.predict(packets))
+    np.testing.assert_array_equal(blocked.predict_proba(packets), whole.predict_proba(packets))
+    # Kept buffers never exceed the block size
+    assert blocked._local.capacity <= 97
+
+
+def test_empty_batch(model):
+    booster, scaler = model
+    predictor = FusedPredictor(booster, scaler)
+    empty = np.empty((0, len(OPTIMAL_FEATURES)))
+
+    assert predictor.predict(empty).shape == (0,)
+    assert predictor.predict_proba(empty).shape == (0, predictor.num_classes)
+    with pytest.raises(ValueError):
+        predictor.predict(np.empty((0, 3)))
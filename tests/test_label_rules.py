@@ -0,0 +1,128 @@
+"""
+Parity of the `label_rules` table with the reference `data_filters` functions,
+on whole files and on files labelled in chunks.
+"""
+
+import io
+import numpy as np
+import pandas as pd
+import pytest
+from src.data import data_filters
+from src.data.label_rules import match_rules, apply_rules, global_columns, scan_context
+
+# The reference functions label through chained assignment
+pytestmark = [pytest.mark.filterwarnings('ignore::pandas.errors.SettingWithCopyWarning'),
+              pytest.mark.filterwarnings('ignore:ChainedAssignmentError:FutureWarning')]
+
+# A file matching each pattern of `LABEL_RULES`, and its reference filter
+REFERENCE_FILTERS = {
+    'benign-dec.pcap': data_filters.benign_dec,
+    'mitm-arpspoofing-2-dec.pcap': data_filters.mitm_arpspoofing_1_3_dec_filter,
+    'mitm-arpspoofing-5-dec.pcap': data_filters.mitm_arpspoofing_4_6_dec_filter,
+    'dos-synflooding-1-dec.pcap': data_filters.dos_synflooding_1_2_dec_filter,
+    'dos-synflooding-3-dec.pcap': data_filters.dos_synflooding_3_dec_filter,
+    'dos-synflooding-5-dec.pcap': data_filters.dos_synflooding_4_6_dec_filter,
+    'scan-hostport-1-dec.pcap': data_filters.scan_hostport_1_dec_filter,
+    'scan-hostport-2-dec.pcap': data_filters.scan_hostport_2_dec_filter,
+    'scan-hostport-3-dec.pcap': data_filters.scan_hostport_3_dec_filter,
+    'scan-hostport-4-dec.pcap': data_filters.scan_hostport_4_dec_filter,
+    'scan-hostport-5-dec.pcap': data_filters.scan_hostport_5_dec_filter,
+    'scan-hostport-6-dec.pcap': data_filters.scan_hostport_6_dec_filter,
+    'scan-portos-2-dec.pcap': data_filters.scan_portos_1_3_dec_filter,
+    'scan-portos-5-dec.pcap': data_filters.scan_portos_4_6_dec_filter,
+    'mirai-udpflooding-1-dec.pcap': data_filters.mirai_udpflooding_1_4_dec_filter,
+    'mirai-ackflooding-2-dec.pcap': data_filters.mirai_ackflooding_1_4_dec_filter,
+    'mirai-httpflooding-3-dec.pcap': data_filters.mirai_httpflooding_1_4_dec_filter,
+    'mirai-hostbruteforce-5-dec.pcap': data_filters.mirai_hostbruteforce_1_3_n_5_dec_filter,
+    'mirai-hostbruteforce-4-dec.pcap': data_filters.mirai_hostbruteforce_2_n_4_dec_filter,
+    }
+
+ATTACKER_MAC = 'f0:18:98:5e:ff:9f'
+
+# Values of the columns used by the rules, matching and not matching them
+COLUMN_VALUES = {
+    'eth_src': [ATTACKER_MAC, 'aa:bb:cc:dd:ee:ff', np.nan],
+    'eth_dst': ['ff:ff:ff:ff:ff:ff', ATTACKER_MAC, np.nan],
+    'eth_addr': [ATTACKER_MAC, 'ff:ff:ff:ff:ff:ff', np.nan],
+    'arp_hw_type': [1, 0, np.nan],
+    'arp_src_hw_mac': [ATTACKER_MAC, 'bc:1c:81:4b:ae:ba', np.nan],
+    'arp_dst_hw_mac': ['bc:1c:81:4b:ae:ba', '48:4b:aa:2c:d8:f9', '04:32:f4:45:17:b3',
+                       '88:36:6c:d7:1c:56', '00:00:00:00:00:00', np.nan],
+    'arp_src_proto_ipv4': ['192.168.0.13', '192.168.0.24', np.nan],
+    'arp_dst_proto_ipv4': ['192.168.0.1', '10.0.0.1', np.nan],
+    'ip_src': ['192.168.0.15', '192.168.0.16', '192.168.0.13', '192.168.0.24',
+               '222.1.2.3', '111.4.5.6', np.nan],
+    'ip_dst': ['192.168.0.13', '192.168.0.16', '192.168.0.24', '210.89.164.90', np.nan],
+    'ip_addr': ['192.168.0.24', '192.168.0.13', np.nan],
+    'icmp_type': [8, 3, np.nan],
+    'tcp_': ['Timestamps', np.nan],
+    'tcp_flags_syn': [1, 0, np.nan],
+    'tcp_flags_reset': [1, 0, np.nan],
+    'tcp_window_size': [1024, 64240, np.nan],
+    'tcp_dstport': [554, 19604, 23, 80, np.nan],
+    }
+
+# More rows than the largest row limit (14499)
+N_ROWS = 15_000
+
+
+def _packets(seed: int, falsy_icmp: bool) -> pd.DataFrame:
+    # Random packets, typed as read back from the converted csv files
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({column: pd.Series(values, dtype=object).iloc[
+                             rng.integers(len(values), size=N_ROWS)].to_numpy()
+                         for column, values in COLUMN_VALUES.items()})
+    if falsy_icmp:
+        data.loc[rng.integers(N_ROWS, size=3), 'icmp_type'] = 0
+    return pd.read_csv(io.StringIO(data.to_csv(index=False)))
+
+
+def _reference_labels(filename: str, data: pd.DataFrame) -> list:
+    return REFERENCE_FILTERS[filename](data.copy())['label'].tolist()
+
+
+def _chunked_labels(filename: str, data: pd.DataFrame, chunksize: int) -> list:
+    # As `load_n_filter.label_csv_in_chunks` does
+    rules = match_rules(filename)
+    chunks = [data.iloc[start:start+chunksize].copy() for start in range(0, len(data), chunksize)]
+    context = scan_context((chunk[list(global_columns(rules))] for chunk in chunks), rules)
+    labels = []
+    for chunk in chunks:
+        labels += apply_rules(chunk, rules, row_offset=chunk.index[0], context=context)['label'].tolist()
+    return labels
+
+
+@pytest.mark.parametrize('falsy_icmp', [False, True])
+@pytest.mark.parametrize('filename', list(REFERENCE_FILTERS))
+def test_rules_match_reference(filename, falsy_icmp):
+    data = _packets(len(filename), falsy_icmp)
+    expected = _reference_labels(filename, data)
+
+    assert apply_rules(data.copy(), match_rules(filename))['label'].tolist() == expected
+    # Chunk boundaries before, on and after the row limits
+    for chunksize in (1000, 4096):
+        assert _chunked_labels(filename, data, chunksize) == expected
+
+
+def test_rules_label_every_class():
+    # The generated packets exercise the rules, not only the 'normal' label
+    labels = set()
+    for filename in REFERENCE_FILTERS:
+        labels.update(_reference_labels(filename, _packets(len(filename), True)))
+    assert labels == {'normal', 'mitm_arpspoofing', 'dos_synflooding', 'scanning_host',
+                      'scanning_port', 'scanning_os', 'mirai_udpflooding', 'mirai_ackflooding',
+                      'mirai_httpflooding', 'host_discovery', 'telnet_bruteforce'}
+
+
+def test_any_falsy_missing_values():
+    # Missing values never count as falsy. In files read from csv they are NaN,
+    # truthy for the reference too; the reference counts object None as falsy
+    filename = 'scan-portos-2-dec.pcap'
+    data = _packets(len(filename), False)
+    rules = match_rules(filename)
+    expected = _reference_labels(filename, data)
+    assert 'scanning_os' not in expected
+
+    data['icmp_type'] = data['icmp_type'].astype(object).where(data['icmp_type'].notna(), None)
+    assert apply_rules(data.copy(), rules)['label'].tolist() == expected
+    assert 'scanning_os' in _reference_labels(filename, data)
@@ -0,0 +1,86 @@
+"""
+Typing of live micro-batches against the csv round trip of the API files.
+"""
+
+import io
+import os
+import struct
+import numpy as np
+import pandas as pd
+import pytest
+from src.data.pcap_reader import PacketDecoder, LINKTYPE_ETHERNET
+from src.features.build_features import convert_to_float
+from src.models.live_ids import LiveIDS
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ETH = bytes.fromhex('0a0000000001') + bytes.fromhex('0a0000000002')
+
+
+def _ipv4(proto: int, payload: bytes, ident: int) -> bytes:
+    return struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(payload), ident, 0x4000, 64, proto, 0,
+                       bytes([192, 168, 0, 13]), bytes([192, 168, 0, 1])) + payload
+
+
+def _frames(n: int) -> list:
+    frames = []
+    for i in range(n):
+        tcp = struct.pack('!HHIIHHHH', 50000 + i, 80, 1000 + i, i, 5 << 12 | 0x12, 64240, 0, 0)
+        udp = struct.pack('!HHHH', 5353, 53, 12, 0) + b'test'
+        icmp = struct.pack('!BBHHH', 8, 0, 0, 1, i)
+        arp = struct.pack('!HHBBH6s4s6s4s', 1, 0x0800, 6, 4, 1, ETH[6:], bytes([192, 168, 0, 13]),
+                          bytes(6), bytes([192, 168, 0, 1]))
+        frames += [ETH + b'\x08\x00' + _ipv4(6, tcp, i),
+                   ETH + b'\x08\x00' + _ipv4(17, udp, i),
+                   ETH + b'\x08\x00' + _ipv4(1, icmp, i),
+                   ETH + b'\x08\x06' + arp]
+    return frames
+
+
+@pytest.fixture(scope='module')
+def live():
+    return LiveIDS(model_path=os.path.join(ROOT_DIR, 'models', 'xgb_model.bin'),
+                   scaler_path=os.path.join(ROOT_DIR, 'src', 'features', 'scaler.pkl'))
+
+
+@pytest.fixture(scope='module')
+def packets():
+    decoder = PacketDecoder()
+    return [decoder.decode(1558342574.859557 + i * 0.000123, LINKTYPE_ETHERNET, frame)
+            for i, frame in enumerate(_frames(16))]
+
+
+def _csv_frame(columns: list, packets: list) -> pd.DataFrame:
+    # Previous typing of micro-batches: csv round trip of the model input fields
+    frame = pd.DataFrame({column: [packet[column] for packet in packets]
+                          for column in columns}, dtype=object)
+    return pd.read_csv(io.StringIO(frame.to_csv(index=False)))
+
+
+def _assert_same_floats(live, packets):
+    direct = convert_to_float(live._frame(packets)[live.columns], progress=False)
+    round_trip = convert_to_float(_csv_frame(live.columns, packets)[live.columns], progress=False)
+    np.testing.assert_allclose(direct.to_numpy(dtype=np.float64),
+                               round_trip.to_numpy(dtype=np.float64),
+                               rtol=1e-12, equal_nan=True)
+
+
+def test_frame_matches_csv_round_trip(live, packets):
+    _assert_same_floats(live, packets)
+    assert (live.predict(packets) ==
+            live.bundle.predict_packets(_csv_frame(live.columns, packets))).all()
+
+
+def test_frame_keeps_exact_timestamps(live, packets):
+    frame = live._frame(packets)
+    assert frame['timestamp'].tolist() == [packet['timestamp'] for packet in packets]
+
+
+def test_frame_unparsable_numbers(live, packets):
+    packets = [dict(packet) for packet in packets]
+    packets[0]['tcp_completeness'] = 'not a number'
+    packets[1]['ip_len'] = ''
+    frame = live._frame(packets)
+    assert frame['tcp_completeness'].dtype == object
+    assert np.isnan(frame['ip_len'][1])
+    _assert_same_floats(live, packets)
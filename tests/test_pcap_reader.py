@@ -0,0 +1,86 @@
+import shutil
+import struct
+import pytest
+from src.data.pcap_reader import format_ip_flags, native_packets, pyshark_packets
+
+
+# Header fields decoded the same way by tshark and the native engine
+COMPARED_COLUMNS = [
+    'eth_dst', 'eth_src', 'eth_type',
+    'ip_version', 'ip_hdr_len', 'ip_dsfield', 'ip_len', 'ip_id', 'ip_flags',
+    'ip_flags_rb', 'ip_flags_df', 'ip_flags_mf', 'ip_frag_offset', 'ip_ttl', 'ip_proto',
+    'ip_checksum', 'ip_src', 'ip_dst',
+    'tcp_srcport', 'tcp_dstport', 'tcp_seq_raw', 'tcp_hdr_len', 'tcp_flags',
+    'tcp_window_size_value', 'tcp_checksum', 'tcp_urgent_pointer',
+    'udp_srcport', 'udp_dstport', 'udp_length', 'udp_checksum',
+    'arp_hw_type', 'arp_proto_type', 'arp_opcode', 'arp_src_hw_mac', 'arp_src_proto_ipv4',
+    'arp_dst_hw_mac', 'arp_dst_proto_ipv4'
+    ]
+
+ETH_DST = bytes.fromhex('0a0000000001')
+ETH_SRC = bytes.fromhex('0a0000000002')
+
+
+def _ipv4(proto: int, payload: bytes, frag: int, ident: int) -> bytes:
+    header = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(payload), ident, frag, 64, proto, 0,
+                         bytes([192, 168, 0, 13]), bytes([192, 168, 0, 1]))
+    return header + payload
+
+
+def _frames() -> list:
+    tcp = struct.pack('!HHIIHHHH', 50000, 80, 1000, 0, 5 << 12 | 0x02, 64240, 0, 0)
+    udp = struct.pack('!HHHH', 5353, 53, 8 + 4, 0) + b'test'
+    arp = struct.pack('!HHBBH6s4s6s4s', 1, 0x0800, 6, 4, 1, ETH_SRC, bytes([192, 168, 0, 13]),
+                      bytes(6), bytes([192, 168, 0, 1]))
+    return [
+        # TCP SYN with Don't Fragment
+        ETH_DST + ETH_SRC + b'\x08\x00' + _ipv4(6, tcp, 0x4000, 0x1032),
+        # UDP without flags
+        ETH_DST + ETH_SRC + b'\x08\x00' + _ipv4(17, udp, 0x0000, 0x1033),
+        ETH_DST + ETH_SRC + b'\x08\x06' + arp
+        ]
+
+
+@pytest.fixture
+def small_pcap(tmp_path):
+    path = tmp_path / 'small.pcap'
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for i, frame in enumerate(_frames()):
+            f.write(struct.pack('<IIII', 1558342574 + i, 859557, len(frame), len(frame)))
+            f.write(frame)
+    return str(path)
+
+
+def _values(packets, columns: list) -> list:
+    return [{column: None if packet[column] in (None, '') else str(packet[column])
+             for column in columns}
+            for packet in packets]
+
+
+@pytest.mark.parametrize('value', [2, '0x02', '0x40', '0x4000'])
+def test_format_ip_flags_dont_fragment(value):
+    assert format_ip_flags(value) == '0x02'
+
+
+def test_format_ip_flags_keeps_other_bits():
+    assert format_ip_flags('0x2000') == '0x01'
+    assert format_ip_flags('0xa0') == '0x05'
+    assert format_ip_flags('0x00') == '0x00'
+
+
+def test_native_ip_flags(small_pcap):
+    tcp, udp, arp = native_packets(small_pcap)
+    assert (tcp['ip_flags'], tcp['ip_flags_df'], tcp['ip_flags_mf']) == ('0x02', 1, 0)
+    assert (udp['ip_flags'], udp['ip_flags_df']) == ('0x00', 0)
+    assert arp['ip_flags'] is None
+
+
+def test_native_matches_pyshark(small_pcap):
+    pytest.importorskip('pyshark')
+    if shutil.which('tshark') is None:
+        pytest.skip('tshark is not installed')
+
+    native = _values(native_packets(small_pcap), COMPARED_COLUMNS)
+    tshark = _values(pyshark_packets(small_pcap), COMPARED_COLUMNS)
+    assert native == tshark